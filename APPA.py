@@ -5,6 +5,7 @@ import json
 from streamlit.components.v1 import html
 import hashlib
 from urllib.parse import unquote, quote
+import mic_processing
 
 st.set_page_config(page_title="🎙 sing-along", layout="wide")
 
@@ -337,6 +338,10 @@ elif st.session_state.page == "Song Player" and st.session_state.get("selected_s
     .final-screen {display:none;position:fixed;top:0;left:0;width:100vw;height:100vh;background:rgba(0,0,0,0.95);justify-content:center;align-items:center;flex-direction:column;z-index:999;gap:12px;}
     #canvasPreview { display:none; }
     .note { font-size:13px; color:#bbb; margin-top:8px; }
+    .mic-meter {display:none;position:relative;width:60vw;height:6px;margin-top:12px;background:rgba(255,255,255,0.15);border-radius:3px;overflow:hidden;}
+    .mic-meter .rms {position:absolute;left:0;top:0;height:100%;width:0;background:linear-gradient(90deg,#33cc66,#ffcc00);}
+    .mic-meter .peak {position:absolute;top:0;height:100%;width:3px;left:0;background:#fff;}
+    .mic-meter.clip .peak {background:#ff3333;}
     </style>
     </head>
     <body>
@@ -346,6 +351,7 @@ elif st.session_state.page == "Song Player" and st.session_state.get("selected_s
     <div id="status">Ready 🎤</div>
     <audio id="originalAudio" src="data:audio/mp3;base64,%%ORIGINAL_B64%%"></audio>
     <audio id="accompaniment" src="data:audio/mp3;base64,%%ACCOMP_B64%%"></audio>
+    <div class="mic-meter" id="micMeter"><div class="rms" id="micRms"></div><div class="peak" id="micPeak"></div></div>
     <div class="controls">
     <button id="playBtn">▶ Play</button>
     <button id="recordBtn">🎙 Record</button>
@@ -365,6 +371,9 @@ elif st.session_state.page == "Song Player" and st.session_state.get("selected_s
     </div>
     <canvas id="canvasPreview"></canvas>
     <script>
+    %%MIC_CHAIN_JS%%
+    const micMeter = document.getElementById('micMeter'), micRms = document.getElementById('micRms'), micPeak = document.getElementById('micPeak');
+    function showMicLevel(level){micRms.style.width = meterPercent(level.rms) + '%'; micPeak.style.left = meterPercent(level.peak) + '%'; micMeter.classList.toggle('clip', level.clip);}
     let mediaRecorder, recordedChunks = [], mixedBlob = null, playRecordingAudio = null, isPlaying = false;
     const original = document.getElementById('originalAudio'), acc = document.getElementById('accompaniment');
     const status = document.getElementById('status'), statusFinal = document.getElementById('statusFinal');
@@ -379,11 +388,11 @@ elif st.session_state.page == "Song Player" and st.session_state.get("selected_s
     recordBtn.onclick = async () => {
     recordedChunks = []; status.innerText="🎙 Preparing mic...";
     let micStream; try {micStream = await navigator.mediaDevices.getUserMedia({audio:{ echoCancellation:true, noiseSuppression:true },video:false});} catch(err){alert('Allow microphone access');return;}
-    const audioCtx = new (window.AudioContext || window.webkitAudioContext)(); const micSource = audioCtx.createMediaStreamSource(micStream);
+    const audioCtx = new (window.AudioContext || window.webkitAudioContext)(); const micChain = await createMicChain(audioCtx, micStream, showMicLevel); micMeter.style.display = 'block';
     const accResp = await fetch(acc.src); const accBuf = await accResp.arrayBuffer(); const accDecoded = await audioCtx.decodeAudioData(accBuf);
     const accSource = audioCtx.createBufferSource(); accSource.buffer = accDecoded; const dest = audioCtx.createMediaStreamDestination();
     const micGain = audioCtx.createGain(); micGain.gain.value=1.0; const accGain = audioCtx.createGain(); accGain.gain.value=0.7;
-    micSource.connect(micGain).connect(dest); accSource.connect(accGain).connect(dest);
+    micChain.output.connect(micGain).connect(dest); accSource.connect(accGain).connect(dest);
     const accOutSource = audioCtx.createBufferSource(); accOutSource.buffer = accDecoded; accOutSource.connect(audioCtx.destination);
     accSource.start(); accOutSource.start(); await new Promise(res=>setTimeout(res,150));
     const img = lyricsImg; const w = img.naturalWidth||1280; const h = img.naturalHeight||720; canvas.width=w; canvas.height=h; let rafId;
@@ -395,7 +404,7 @@ elif st.session_state.page == "Song Player" and st.session_state.get("selected_s
     original.currentTime=0; acc.currentTime=0; try{ await original.play(); }catch(e){} try{ await acc.play(); }catch(e){}
     playBtn.style.display = "none"; recordBtn.style.display = "none"; stopBtn.style.display = "inline-block"; status.innerText = "🎙 Recording...";
     original.onended = async () => { stopRecording(); }; stopBtn.onclick = async () => { stopRecording(); };
-    async function stopRecording(){try{ mediaRecorder.stop(); }catch(e){} try{ accSource.stop(); accOutSource.stop(); audioCtx.close(); }catch(e){} cancelAnimationFrame(rafId); try{ original.pause(); acc.pause(); }catch(e){} try{ micStream.getTracks().forEach(t=>t.stop()); }catch(e){}
+    async function stopRecording(){try{ mediaRecorder.stop(); }catch(e){} try{ accSource.stop(); accOutSource.stop(); micChain.disconnect(); audioCtx.close(); }catch(e){} micMeter.style.display = 'none'; cancelAnimationFrame(rafId); try{ original.pause(); acc.pause(); }catch(e){} try{ micStream.getTracks().forEach(t=>t.stop()); }catch(e){}
     status.innerText="⏳ Processing mix... Please wait"; stopBtn.style.display = "none";
     mediaRecorder.onstop = async () => {
     mixedBlob = new Blob(recordedChunks, { type:'video/webm' }); const url = URL.createObjectURL(mixedBlob);
@@ -415,6 +424,7 @@ elif st.session_state.page == "Song Player" and st.session_state.get("selected_s
     karaoke_html = karaoke_html.replace("%%LOGO_B64%%", logo_b64 or "")
     karaoke_html = karaoke_html.replace("%%ORIGINAL_B64%%", original_b64 or "")
     karaoke_html = karaoke_html.replace("%%ACCOMP_B64%%", accompaniment_b64 or "")
+    karaoke_html = karaoke_html.replace("%%MIC_CHAIN_JS%%", mic_processing.MIC_CHAIN_JS)
 
     html(karaoke_html, height=700, width=1920)
 
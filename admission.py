@@ -0,0 +1,123 @@
+"""Admission control for Song Player renders.
+
+A Song Player run that cannot hand the browser media URLs inlines the
+tracks as base64 data URIs -- several MB per run, all alive at once while
+the script builds the component props.  When a shared link goes viral,
+hundreds of those runs start together and a small instance runs out of
+memory.  ``AdmissionController`` caps what one process renders at a time:
+
+* ``max_renders`` heavy runs in flight, of which ``admin_reserve`` are kept
+  for admins, so an admin can always open the player (and the dashboard
+  never waits behind guests);
+* ``max_bytes`` of estimated inlined media in flight (a single run larger
+  than the budget is still admitted when nothing else is running).
+
+Everyone else waits in a FIFO line.  The page polls with its ticket every
+``retry_after`` seconds (``poll``, which only reports the position and
+never takes a slot) and is shown its position; tickets that stop polling
+fall out of the line.  A slot is only taken by ``try_acquire`` in the run
+that renders, inside ``held``, so an abandoned tab can never keep one.  ``max_waiting`` bounds the line itself --
+beyond it a visitor is told to come back later instead of queueing.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+ADMITTED = "admitted"
+QUEUED = "queued"
+REJECTED = "rejected"
+
+
+class AdmissionController:
+    def __init__(self, max_renders=4, max_bytes=64 * 1024 * 1024, admin_reserve=1,
+                 max_waiting=200, retry_after=3):
+        self.max_renders = max(1, max_renders)
+        self.max_bytes = max_bytes
+        self.admin_reserve = min(admin_reserve, self.max_renders - 1)
+        self.max_waiting = max_waiting
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._active = {}              # ticket -> bytes
+        self._waiting = OrderedDict()  # ticket -> last poll
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.peak_active = 0
+        self.peak_waiting = 0
+
+    def _expire(self, now):
+        stale = now - 3 * self.retry_after
+        for ticket in [t for t, seen in self._waiting.items() if seen < stale]:
+            del self._waiting[ticket]
+
+    def _fits(self, cost, admin):
+        limit = self.max_renders if admin else self.max_renders - self.admin_reserve
+        if len(self._active) >= limit:
+            return False
+        in_flight = sum(self._active.values())
+        return not self._active or in_flight + cost <= self.max_bytes
+
+    def try_acquire(self, ticket, cost=0, admin=False):
+        """(status, position): ADMITTED, (QUEUED, 1-based place in line) or REJECTED"""
+        return self._check(ticket, cost, admin, take=True)
+
+    def poll(self, ticket, cost=0, admin=False):
+        """Like try_acquire, but ADMITTED only means "your turn": no slot is taken"""
+        return self._check(ticket, cost, admin, take=False)
+
+    def _check(self, ticket, cost, admin, take):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if ticket in self._active:
+                return ADMITTED, 0
+            # Admins skip the line; everyone else goes in order
+            first_in_line = not self._waiting or next(iter(self._waiting)) == ticket
+            if (admin or first_in_line) and self._fits(cost, admin):
+                if not take:
+                    self._waiting[ticket] = now
+                    return ADMITTED, 0
+                self._waiting.pop(ticket, None)
+                self._active[ticket] = cost
+                self.admitted += 1
+                self.peak_active = max(self.peak_active, len(self._active))
+                return ADMITTED, 0
+            if ticket not in self._waiting:
+                if len(self._waiting) >= self.max_waiting:
+                    self.rejected += 1
+                    return REJECTED, 0
+                self.queued += 1
+            self._waiting[ticket] = now
+            self.peak_waiting = max(self.peak_waiting, len(self._waiting))
+            return QUEUED, list(self._waiting).index(ticket) + 1
+
+    def release(self, ticket):
+        with self._lock:
+            self._active.pop(ticket, None)
+
+    @contextmanager
+    def held(self, ticket):
+        """Release the ticket when the admitted render finishes, however it ends"""
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.time())
+            return {
+                "active": len(self._active),
+                "max_renders": self.max_renders,
+                "admin_reserve": self.admin_reserve,
+                "bytes_in_flight": sum(self._active.values()),
+                "max_bytes": self.max_bytes,
+                "waiting": len(self._waiting),
+                "max_waiting": self.max_waiting,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "peak_active": self.peak_active,
+                "peak_waiting": self.peak_waiting,
+            }
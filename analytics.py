@@ -0,0 +1,204 @@
+"""Play / record analytics without a synchronous insert per event.
+
+Pages and the player call ``EventBuffer.record()``, which only appends to
+an in-memory ring buffer (a bounded deque: if the writer ever falls far
+behind, the oldest events are dropped and counted instead of blocking a
+page).  A background thread drains the buffer every ``FLUSH_SECONDS`` (or
+as soon as ``FLUSH_SIZE`` events are waiting) and writes the whole batch in
+one transaction:
+
+* ``events`` -- append-only raw log,
+* ``event_rollups`` -- counts per song, hour and event type, upserted from
+  the batch's own pre-aggregated counts, which is what the admin view reads.
+
+Both the Streamlit app and media_server.py write to the same database
+(``ANALYTICS_DB``, WAL mode, so writers do not block readers).
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+
+EVENT_TYPES = ("play", "record_start", "record_complete", "download", "share_open")
+BUFFER_SIZE = 10000
+FLUSH_SIZE = 200
+FLUSH_SECONDS = 5.0
+
+
+def default_db_path(base_dir):
+    return os.getenv("ANALYTICS_DB", os.path.join(base_dir, "analytics.db"))
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS events
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     ts REAL,
+                     event TEXT,
+                     song_name TEXT,
+                     user TEXT,
+                     role TEXT,
+                     session_id TEXT,
+                     extra TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS event_rollups
+                    (song_name TEXT,
+                     hour INTEGER,
+                     event TEXT,
+                     count INTEGER,
+                     PRIMARY KEY (song_name, hour, event))''')
+    conn.execute('CREATE INDEX IF NOT EXISTS event_rollups_hour ON event_rollups(hour)')
+    return conn
+
+
+def hour_bucket(ts):
+    return int(ts // 3600) * 3600
+
+
+class EventBuffer:
+    def __init__(self, db_path, capacity=BUFFER_SIZE, flush_size=FLUSH_SIZE,
+                 flush_seconds=FLUSH_SECONDS):
+        self.db_path = db_path
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._events = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.dropped = 0
+        self.written = 0
+        self.last_error = None
+        connect(db_path).close()
+        self._thread = threading.Thread(target=self._run, name="analytics-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, event, song_name, user=None, role=None, session_id=None, extra=None, ts=None):
+        """Queue one event; never touches the database"""
+        if event not in EVENT_TYPES or not song_name:
+            return False
+        row = (ts or time.time(), event, song_name, user, role, session_id,
+               json.dumps(extra) if extra else None)
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(row)
+            pending = len(self._events)
+        if pending >= self.flush_size:
+            self._wake.set()
+        return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._events)
+
+    def flush(self):
+        """Write everything buffered so far in one transaction; returns the row count"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._events)
+                self._events.clear()
+            if not batch:
+                return 0
+            rollups = Counter((song, hour_bucket(ts), event) for ts, event, song, *_ in batch)
+            try:
+                conn = connect(self.db_path)
+                try:
+                    with conn:
+                        conn.executemany('''INSERT INTO events
+                                            (ts, event, song_name, user, role, session_id, extra)
+                                            VALUES (?, ?, ?, ?, ?, ?, ?)''', batch)
+                        conn.executemany('''INSERT INTO event_rollups (song_name, hour, event, count)
+                                            VALUES (?, ?, ?, ?)
+                                            ON CONFLICT(song_name, hour, event)
+                                            DO UPDATE SET count = count + excluded.count''',
+                                         [(song, hour, event, n) for (song, hour, event), n in rollups.items()])
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                # Put the batch back (oldest first) so a locked database only delays it
+                self.last_error = f"{type(e).__name__}: {e}"
+                with self._lock:
+                    self._events.extendleft(reversed(batch))
+                return 0
+            self.written += len(batch)
+            self.last_error = None
+            return len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+
+# =============== QUERIES (rollups only) ===============
+def song_totals(db_path, since):
+    """{song: {event: count}} since a timestamp"""
+    conn = connect(db_path)
+    try:
+        rows = conn.execute('''SELECT song_name, event, SUM(count) FROM event_rollups
+                               WHERE hour >= ? GROUP BY song_name, event''',
+                            (hour_bucket(since),)).fetchall()
+    finally:
+        conn.close()
+    totals = {}
+    for song_name, event, count in rows:
+        totals.setdefault(song_name, dict.fromkeys(EVENT_TYPES, 0))[event] = count
+    return totals
+
+
+def hourly_counts(db_path, since, song_name=None):
+    """[(hour, event, count)] since a timestamp, for one song or all"""
+    query = 'SELECT hour, event, SUM(count) FROM event_rollups WHERE hour >= ?'
+    params = [hour_bucket(since)]
+    if song_name:
+        query += ' AND song_name = ?'
+        params.append(song_name)
+    conn = connect(db_path)
+    try:
+        return conn.execute(query + ' GROUP BY hour, event ORDER BY hour', params).fetchall()
+    finally:
+        conn.close()
+
+
+def song_popularity(db_path, since):
+    """{song: plays + recordings} since a timestamp, for warm-up ordering"""
+    conn = connect(db_path)
+    try:
+        rows = conn.execute('''SELECT song_name, SUM(count) FROM event_rollups
+                               WHERE hour >= ? AND event IN ('play', 'record_start', 'share_open')
+                               GROUP BY song_name''', (hour_bucket(since),)).fetchall()
+    finally:
+        conn.close()
+    return dict(rows)
+
+
+def popular_renditions(db_path, song_name, since, limit=3):
+    """Most recorded non-default (key, tempo) pairs of a song, from record_start events"""
+    conn = connect(db_path)
+    try:
+        rows = conn.execute('''SELECT extra FROM events
+                               WHERE song_name = ? AND event = 'record_start' AND ts >= ?
+                                 AND extra IS NOT NULL''', (song_name, since)).fetchall()
+    finally:
+        conn.close()
+    counts = Counter()
+    for (extra,) in rows:
+        try:
+            data = json.loads(extra)
+            pair = (int(data.get("key", 0)), round(float(data.get("tempo", 1.0)), 2))
+        except (ValueError, TypeError, AttributeError):
+            continue
+        if pair != (0, 1.0):
+            counts[pair] += 1
+    return [pair for pair, _ in counts.most_common(limit)]
@@ -2,17 +2,46 @@ import streamlit as st
 import os
 import base64
 import json
-from streamlit.components.v1 import html
+import functools
+import inspect
+from streamlit.components.v1 import declare_component
 import hashlib
 from urllib.parse import unquote, quote
 import time
 import sqlite3
-from datetime import datetime
+import uuid
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+import media_lifecycle
+import media_storage
+import ingest
+import fingerprint
+import jobs
+import analytics
+import lyrics
+import preview
+import warmup
+import renditions
+import pcm_cache
+import sharing
+import shared_state
+import player
+import admission
+import segments
+import profiler
 
 st.set_page_config(page_title="𝄞 sing-along", layout="wide")
 
+# ⏱ Phase timings of this run, plus the admin's opt-in profiler (see profiler.py)
+run_phases = profiler.PhaseTimer()
+debug_capture = st.session_state.get("debug_capture")
+if debug_capture:
+    debug_capture.begin()
+
 # --------- CONFIG: set your deployed app URL here ----------
 APP_URL = "https://karaoke-project-production.up.railway.app/"
+# Standalone guest player (media_server.py /play); empty = share links open the app
+GUEST_PLAYER_URL = os.getenv("GUEST_PLAYER_URL", "").rstrip("/")
 
 # 🔒 SECURITY: Environment Variables for Password Hashes
 ADMIN_HASH = os.getenv("ADMIN_HASH", "")
@@ -26,14 +55,51 @@ songs_dir = os.path.join(media_dir, "songs")
 lyrics_dir = os.path.join(media_dir, "lyrics_images")
 logo_dir = os.path.join(media_dir, "logo")
 shared_links_dir = os.path.join(media_dir, "shared_links")
+temp_dir = os.path.join(media_dir, "temp")
+finals_dir = os.path.join(media_dir, "finals")
+renditions_dir = os.path.join(media_dir, "renditions")
 metadata_path = os.path.join(media_dir, "song_metadata.json")
 session_db_path = os.path.join(base_dir, "session_data.db")
+analytics_db_path = analytics.default_db_path(base_dir)
 
 # Create directories
 os.makedirs(songs_dir, exist_ok=True)
 os.makedirs(lyrics_dir, exist_ok=True)
 os.makedirs(logo_dir, exist_ok=True)
 os.makedirs(shared_links_dir, exist_ok=True)
+os.makedirs(temp_dir, exist_ok=True)
+os.makedirs(finals_dir, exist_ok=True)
+os.makedirs(renditions_dir, exist_ok=True)
+
+# 🧹 Retention for generated media (override via environment)
+TEMP_TTL_HOURS = float(os.getenv("TEMP_TTL_HOURS", "6"))
+TEMP_QUOTA_MB = float(os.getenv("TEMP_QUOTA_MB", "200"))
+FINALS_TTL_DAYS = float(os.getenv("FINALS_TTL_DAYS", "7"))
+FINALS_QUOTA_MB = float(os.getenv("FINALS_QUOTA_MB", "500"))
+RENDITION_CACHE_MB = float(os.getenv("RENDITION_CACHE_MB", "1000"))
+SWEEP_INTERVAL_SECONDS = int(os.getenv("SWEEP_INTERVAL_SECONDS", "900"))
+ACTIVE_SESSION_MINUTES = 30
+
+# 📦 Media storage backend (MEDIA_STORAGE=local|s3, see media_storage.py)
+storage = media_storage.storage_from_env(media_dir)
+MEDIA_URL_TTL_SECONDS = int(os.getenv("MEDIA_URL_TTL_SECONDS", "21600"))
+
+# 🎬 Server-side final render (media_server.py); empty = record video in the browser
+MEDIA_API_URL = os.getenv("MEDIA_API_URL", "").rstrip("/")
+MEDIA_URL_SECRET = os.getenv("MEDIA_URL_SECRET", "")
+# 🔑 Signed share links (sharing.py); empty = only plain ?song= links
+SHARE_TOKEN_SECRET = os.getenv("SHARE_TOKEN_SECRET", MEDIA_URL_SECRET)
+SHARE_EXPIRY_CHOICES = {"1 hour": 3600, "1 day": 86400, "1 week": 7 * 86400, "30 days": 30 * 86400,
+                        "Never": None}
+# 🚦 Song Player admission control, per worker process (see admission.py)
+ADMIT_MAX_RENDERS = int(os.getenv("ADMIT_MAX_RENDERS", "4"))
+ADMIT_MAX_INFLIGHT_MB = float(os.getenv("ADMIT_MAX_INFLIGHT_MB", "64"))
+ADMIT_ADMIN_RESERVE = int(os.getenv("ADMIT_ADMIN_RESERVE", "1"))
+ADMIT_MAX_WAITING = int(os.getenv("ADMIT_MAX_WAITING", "200"))
+ADMIT_RETRY_SECONDS = int(os.getenv("ADMIT_RETRY_SECONDS", "3"))
+# 🖥 Worker index when several app processes run behind cluster.py; 0 also runs maintenance
+WORKER_INDEX = int(os.getenv("KARAOKE_WORKER", "0"))
+PRIMARY_WORKER = WORKER_INDEX == 0
 
 # =============== PERSISTENT SESSION DATABASE ===============
 def init_session_db():
@@ -132,22 +198,6 @@ def delete_shared_link_from_db(song_name):
     except:
         pass
 
-def load_shared_links_from_db():
-    """Load shared links from database"""
-    links = {}
-    try:
-        conn = sqlite3.connect(session_db_path)
-        c = conn.cursor()
-        c.execute('SELECT song_name, shared_by FROM shared_links WHERE active = 1')
-        results = c.fetchall()
-        conn.close()
-        
-        for song_name, shared_by in results:
-            links[song_name] = {"shared_by": shared_by, "active": True}
-    except:
-        pass
-    return links
-
 def save_metadata_to_db(song_name, uploaded_by):
     """Save metadata to database"""
     try:
@@ -178,9 +228,227 @@ def load_metadata_from_db():
         pass
     return metadata
 
+def load_active_session_songs(minutes=ACTIVE_SESSION_MINUTES):
+    """Songs selected by sessions that were active in the last few minutes"""
+    songs = set()
+    try:
+        conn = sqlite3.connect(session_db_path)
+        c = conn.cursor()
+        c.execute('''SELECT DISTINCT selected_song FROM sessions
+                     WHERE selected_song IS NOT NULL AND last_active > ?''',
+                  (datetime.now() - timedelta(minutes=minutes),))
+        songs = {row[0] for row in c.fetchall() if row[0] and row[0] != 'None'}
+        conn.close()
+    except:
+        pass
+    return songs
+
 # Initialize database
 init_session_db()
 
+# =============== MEDIA RETENTION ===============
+retention_policies = [
+    media_lifecycle.RetentionPolicy(
+        "temp", temp_dir,
+        ttl_seconds=TEMP_TTL_HOURS * 3600,
+        max_bytes=int(TEMP_QUOTA_MB * 1024 * 1024),
+        prefixes=["rec_", "temp_play_"]),
+    media_lifecycle.RetentionPolicy(
+        "finals", finals_dir,
+        ttl_seconds=FINALS_TTL_DAYS * 86400,
+        max_bytes=int(FINALS_QUOTA_MB * 1024 * 1024),
+        prefixes=["final_"]),
+    # LRU cache of key/tempo renditions: quota only, hits are touched
+    media_lifecycle.RetentionPolicy(
+        "renditions", renditions_dir,
+        max_bytes=int(RENDITION_CACHE_MB * 1024 * 1024)),
+    # Decoded PCM shared by the jobs (PCM_CACHE_MB, LRU)
+    pcm_cache.retention_policy(media_dir),
+    # Local copies of S3 objects for ffmpeg & co. (S3_CACHE_MB, LRU; empty with local storage)
+    media_storage.s3_cache_policy(media_dir),
+]
+
+@st.cache_resource
+def start_media_sweeper():
+    """Start the background sweeper once per host (other workers only sweep on demand)"""
+    if not PRIMARY_WORKER:
+        return media_lifecycle.Sweeper(retention_policies, interval_seconds=SWEEP_INTERVAL_SECONDS,
+                                       protected_songs_provider=load_active_session_songs)
+    return media_lifecycle.start_sweeper(
+        retention_policies,
+        interval_seconds=SWEEP_INTERVAL_SECONDS,
+        protected_songs_provider=load_active_session_songs)
+
+media_sweeper = start_media_sweeper()
+
+@st.cache_resource
+def get_job_queue():
+    """Background worker pool shared by all sessions"""
+    return jobs.get_job_queue()
+
+job_queue = get_job_queue()
+
+@st.cache_resource
+def get_share_revocations():
+    """Revoked share tokens, shared by all sessions of this process"""
+    return sharing.RevocationSet(session_db_path)
+
+share_revocations = get_share_revocations()
+
+@st.cache_resource
+def get_event_buffer():
+    """Buffered analytics writer shared by all sessions"""
+    return analytics.EventBuffer(analytics_db_path)
+
+event_buffer = get_event_buffer()
+
+@st.cache_resource
+def get_render_admission():
+    """Limits on concurrent Song Player renders, shared by all sessions of this process"""
+    return admission.AdmissionController(
+        max_renders=ADMIT_MAX_RENDERS, max_bytes=int(ADMIT_MAX_INFLIGHT_MB * 1024 * 1024),
+        admin_reserve=ADMIT_ADMIN_RESERVE, max_waiting=ADMIT_MAX_WAITING,
+        retry_after=ADMIT_RETRY_SECONDS)
+
+render_admission = get_render_admission()
+
+@st.fragment(run_every=ADMIT_RETRY_SECONDS)
+def admission_line(ticket, cost, admin):
+    """Place in the Song Player line, polled without blocking; reruns the page on its turn"""
+    # Only the page run takes the slot (inside held()), so a tab closed now holds nothing
+    status, position = render_admission.poll(ticket, cost, admin=admin)
+    if status == admission.ADMITTED:
+        st.rerun()
+    if status == admission.REJECTED:
+        st.warning("🎤 The stage is full right now. Please try again in a few minutes.")
+    else:
+        st.info(f"🎤 Lots of singers right now: you're #{position} in line. "
+                f"The player opens automatically (checking again in {render_admission.retry_after} s).")
+
+def track_event(event, song_name, **extra):
+    """Queue an analytics event for the current session (no DB write here)"""
+    event_buffer.record(event, song_name, user=st.session_state.get("user"),
+                        role=st.session_state.get("role"),
+                        session_id=st.session_state.get("session_id"), extra=extra or None)
+
+# =============== SHARED CACHE (multi-worker) ===============
+epochs, shared_cache = shared_state.open_state(media_dir)
+
+def host_cache_data(namespace, ttl):
+    """st.cache_data backed by the host-wide shared cache, invalidated with invalidate(namespace)"""
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def compute(epoch, args):
+            return shared_cache.get_or_compute(namespace, f"{fn.__name__}{args!r}", lambda: fn(*args), ttl)
+        # Streamlit keys caches by qualified name: keep one cache per wrapped function
+        compute.__qualname__ = compute.__name__ = f"{fn.__qualname__}_shared"
+        local = st.cache_data(ttl=ttl, show_spinner=False)(compute)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return local(epochs.get(namespace), bound.args)
+        return wrapper
+    return decorator
+
+def invalidate(*namespaces):
+    """Drop cached data of these namespaces in every worker on this host"""
+    epochs.bump(*namespaces)
+
+def schedule_ingest(song_name):
+    """Run ingest analysis (waveform, duration...) for a song in the background"""
+    return job_queue.submit(f"ingest:{song_name}", ingest.ingest_song, media_dir, song_name)
+
+@host_cache_data("tracks", ttl=60)
+def get_track_info(song_name, kind="original"):
+    return ingest.load_track_info(storage, song_name, kind)
+
+@host_cache_data("tracks", ttl=300)
+def get_track_peaks(song_name, kind="original", width=600):
+    return ingest.load_peaks(storage, song_name, kind, width)
+
+@host_cache_data("tracks", ttl=300)
+def get_track_gains(song_name):
+    return ingest.load_gains(storage, song_name)
+
+@host_cache_data("tracks", ttl=300)
+def get_accompaniment_hash(song_name):
+    return renditions.content_hash(storage, song_key(song_name, "accompaniment"))
+
+def schedule_rendition(song_name, semitones, tempo):
+    """Render a key/tempo rendition in the background; returns the job key"""
+    job_key = f"rendition:{song_name}:{semitones:+d}:{tempo:.2f}"
+    job_queue.submit(job_key, renditions.render_rendition, media_dir, song_name, semitones, tempo)
+    return job_key
+
+def get_rendition_key(song_name, semitones, tempo):
+    """Storage key of the accompaniment at a key/tempo, or None while it is being rendered"""
+    if renditions.is_identity(semitones, tempo):
+        return song_key(song_name, "accompaniment")
+    key = renditions.cached_rendition(storage, get_accompaniment_hash(song_name), semitones, tempo)
+    if key:
+        return key
+    job = job_queue.get(f"rendition:{song_name}:{semitones:+d}:{tempo:.2f}")
+    if job and job["status"] == "done" and job["result"]:
+        return job["result"]
+    if job and job["status"] == "failed":
+        raise RuntimeError(job["error"])
+    schedule_rendition(song_name, semitones, tempo)
+    return None
+
+@st.fragment(run_every=2)
+def rendition_watch(song_name, semitones, tempo):
+    """Rerun the page once the rendition being prepared is ready (or failed)"""
+    job = job_queue.get(f"rendition:{song_name}:{semitones:+d}:{tempo:.2f}")
+    if not job or job["status"] in ("done", "failed"):
+        st.rerun()
+    st.info("🎚 Preparing the backing track in the selected key... "
+            "the original plays until it is ready.")
+
+@host_cache_data("lyrics", ttl=300)
+def get_lyrics_track(song_name):
+    return lyrics.load_lyrics(storage, song_name)
+
+def check_duplicate_upload(uploaded_file, song_name):
+    """Fingerprint an uploaded original and look it up in the library index"""
+    cache_key = f"dup_check_{uploaded_file.name}_{uploaded_file.size}"
+    if cache_key not in st.session_state:
+        tmp_path = os.path.join(temp_dir, f"upload_{uuid.uuid4().hex}.mp3")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(uploaded_file.getbuffer())
+            st.session_state[cache_key] = fingerprint.find_duplicates_of_file(
+                fingerprint.index_path(media_dir), tmp_path, exclude=(song_name,))
+        except Exception:
+            st.session_state[cache_key] = []
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return st.session_state[cache_key]
+
+@host_cache_data("tracks", ttl=60)
+def get_preview_key(song_name):
+    return ingest.preview_key(storage, song_name)
+
+def render_preview(song_name):
+    """Inline player for the song's preview clip; nothing is fetched until it is played"""
+    key = get_preview_key(song_name)
+    if not key:
+        return
+    mime = preview.codec_settings()["mime"]
+    url = storage.url_for(key, expires_in=MEDIA_URL_TTL_SECONDS)
+    if url:
+        st.markdown(f'<audio controls preload="none" src="{url}" type="{mime}" '
+                    f'style="width:100%;height:32px;"></audio>', unsafe_allow_html=True)
+    else:
+        st.audio(storage.get(key), format=mime)
+
+def song_duration_label(song_name):
+    info = get_track_info(song_name)
+    return f" · {ingest.format_duration(info['duration'])}" if info else ""
+
 # =============== HELPER FUNCTIONS ===============
 def file_to_base64(path):
     if os.path.exists(path):
@@ -188,6 +456,88 @@ def file_to_base64(path):
             return base64.b64encode(f.read()).decode()
     return ""
 
+def share_url_for(song_name, token=None):
+    """Public link for a shared song: the guest player when deployed, else the app"""
+    query = f"share={token}" if token else f"song={quote(song_name)}"
+    if GUEST_PLAYER_URL:
+        return f"{GUEST_PLAYER_URL}/play?{query}"
+    return f"{APP_URL}?{query}"
+
+def song_key(song_name, kind):
+    """Storage key of a song track, kind is 'original' or 'accompaniment'"""
+    return f"songs/{song_name}_{kind}.mp3"
+
+def find_lyrics_key(song_name):
+    for ext in [".jpg", ".jpeg", ".png"]:
+        key = f"lyrics_images/{song_name}_lyrics_bg{ext}"
+        if storage.exists(key):
+            return key
+    return ""
+
+def media_src(key, mime):
+    """Direct (signed) URL for a media key, or an inline data URI as fallback"""
+    if not key:
+        return ""
+    url = storage.url_for(key, expires_in=MEDIA_URL_TTL_SECONDS)
+    if url:
+        return url
+    try:
+        return f"data:{mime};base64,{base64.b64encode(storage.get(key)).decode()}"
+    except media_storage.StorageError:
+        return ""
+
+def inline_cost(*keys):
+    """Bytes of base64 a render allocates for keys served as data URIs (0 for URLs)"""
+    total = 0
+    for key in keys:
+        if key and not storage.url_for(key, expires_in=MEDIA_URL_TTL_SECONDS):
+            try:
+                total += storage.size(key) * 4 // 3
+            except media_storage.StorageError:
+                pass
+    return total
+
+@st.cache_data(ttl=max(60, MEDIA_URL_TTL_SECONDS // 2), max_entries=256, show_spinner=False)
+def cached_media_src(key, mime):
+    """media_src() reused while the signed URL is still comfortably valid"""
+    return media_src(key, mime)
+
+@host_cache_data("tracks", ttl=300)
+def get_segment_manifest(song_name, kind):
+    return ingest.load_segments(storage, song_name, kind)
+
+@st.cache_data(ttl=max(60, MEDIA_URL_TTL_SECONDS // 2), max_entries=256, show_spinner=False)
+def cached_segment_urls(song_name, kind, epoch):
+    """Signed segment URLs for the player, or None (not segmented / no URL backend)"""
+    return segments.signed_manifest(get_segment_manifest(song_name, kind),
+                                    lambda key: storage.url_for(key, expires_in=MEDIA_URL_TTL_SECONDS))
+
+def get_segment_urls(song_name, kind):
+    return cached_segment_urls(song_name, kind, epochs.get("tracks"))
+
+@host_cache_data("lyrics", ttl=300)
+def get_lyrics_image_key(song_name):
+    return find_lyrics_key(song_name)
+
+@st.cache_resource
+def get_player_component():
+    """Declare the persistent karaoke player component once per process"""
+    return declare_component("karaoke_player",
+                             path=player.build_component(os.path.join(media_dir, "player_component")))
+
+def server_render_config(song_name, scope="record"):
+    """media_server target + token of this scope for the player, or None without a media server"""
+    if not (MEDIA_API_URL and MEDIA_URL_SECRET):
+        return None
+    expires = int(time.time()) + MEDIA_URL_TTL_SECONDS
+    return {
+        "api": MEDIA_API_URL,
+        "song": song_name,
+        "expires": expires,
+        "scope": scope,
+        "token": media_storage.sign_media_url(MEDIA_URL_SECRET, sharing.take_token_key(song_name, scope), expires),
+    }
+
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
@@ -203,7 +553,9 @@ def load_metadata():
     
     # Merge with database metadata
     db_metadata = load_metadata_from_db()
-    file_metadata.update(db_metadata)
+    # Database rows win for uploader/timestamp; keep file-only fields such as "lyrics"
+    for song_name, info in db_metadata.items():
+        file_metadata.setdefault(song_name, {}).update(info)
     return file_metadata
 
 def save_metadata(data):
@@ -217,26 +569,10 @@ def save_metadata(data):
         uploaded_by = info.get("uploaded_by", "unknown")
         save_metadata_to_db(song_name, uploaded_by)
 
+@host_cache_data("shared_links", ttl=30)
 def load_shared_links():
     """Load shared links from both file and database"""
-    file_links = {}
-    if os.path.exists(shared_links_dir):
-        for filename in os.listdir(shared_links_dir):
-            if filename.endswith('.json'):
-                song_name = filename[:-5]
-                filepath = os.path.join(shared_links_dir, filename)
-                try:
-                    with open(filepath, 'r') as f:
-                        data = json.load(f)
-                        if data.get("active", True):
-                            file_links[song_name] = data
-                except:
-                    pass
-    
-    # Merge with database links
-    db_links = load_shared_links_from_db()
-    file_links.update(db_links)
-    return file_links
+    return sharing.load_shared_links(shared_links_dir, session_db_path)
 
 def save_shared_link(song_name, link_data):
     """Save shared link to both file and database"""
@@ -248,6 +584,8 @@ def save_shared_link(song_name, link_data):
     # Save to database
     shared_by = link_data.get("shared_by", "unknown")
     save_shared_link_to_db(song_name, shared_by)
+    invalidate("shared_links")
+    cache_warmer.enqueue([song_name])
 
 def delete_shared_link(song_name):
     """Delete shared link from both file and database"""
@@ -258,16 +596,56 @@ def delete_shared_link(song_name):
     
     # Delete from database
     delete_shared_link_from_db(song_name)
+    invalidate("shared_links")
+    # Signed links for the song stop working too
+    share_revocations.revoke_songs([song_name])
+
+def bulk_update_shared_links(song_names, share, shared_by="unknown"):
+    """Share or unshare many songs: one DB transaction, link files, one cache clear"""
+    song_names = list(song_names)
+    if not song_names:
+        return 0
+    conn = sqlite3.connect(session_db_path)
+    try:
+        with conn:
+            if share:
+                now = datetime.now()
+                conn.executemany('''INSERT OR REPLACE INTO shared_links
+                                    (song_name, shared_by, active, created_at)
+                                    VALUES (?, ?, ?, ?)''',
+                                 [(song_name, shared_by, True, now) for song_name in song_names])
+            else:
+                conn.executemany('DELETE FROM shared_links WHERE song_name = ?',
+                                 [(song_name,) for song_name in song_names])
+    finally:
+        conn.close()
+
+    link_data = json.dumps({"shared_by": shared_by, "active": True})
+    for song_name in song_names:
+        filepath = os.path.join(shared_links_dir, f"{song_name}.json")
+        if share:
+            with open(filepath, 'w') as f:
+                f.write(link_data)
+        elif os.path.exists(filepath):
+            os.remove(filepath)
+    invalidate("shared_links")
+    if share:
+        cache_warmer.enqueue(song_names)
+    else:
+        share_revocations.revoke_songs(song_names)
+    return len(song_names)
+
+@host_cache_data("catalog", ttl=300)
+def list_song_keys():
+    return list(storage.list("songs/"))
 
 def get_uploaded_songs(show_unshared=False):
     """Get list of uploaded songs"""
     songs = []
-    if not os.path.exists(songs_dir):
-        return songs
-    
     shared_links = load_shared_links()
     
-    for f in os.listdir(songs_dir):
+    for key in list_song_keys():
+        f = key[len("songs/"):]
         if f.endswith("_original.mp3"):
             song_name = f.replace("_original.mp3", "")
             if show_unshared or song_name in shared_links:
@@ -281,24 +659,96 @@ def check_and_create_session_id():
         st.session_state.session_id = str(uuid.uuid4())
 
 # =============== FIXED: QUERY PARAMETER PROCESSING ===============
+def share_claims():
+    """Claims of this session's share token, re-checked on every run (no I/O)"""
+    return sharing.verify_share_token(SHARE_TOKEN_SECRET, st.session_state.get("share_token"),
+                                      share_revocations)
+
 def process_query_params():
     query_params = st.query_params
 
-    if "song" in query_params:
+    if "share" in query_params:
+        # Signed link: the token names the song and stays in the URL for reloads
+        st.session_state.share_token = query_params["share"]
+        claims = share_claims()
+        if not claims:
+            st.session_state.share_token = None
+            st.error("❌ This link has expired or was revoked.")
+            st.stop()
+        song_from_url = claims["s"]
+    elif "song" in query_params:
         song_from_url = unquote(query_params["song"])
+    else:
+        return
 
-        # Always set song from URL
-        st.session_state.selected_song = song_from_url
-        st.session_state.page = "Song Player"
+    # Always set song from URL
+    st.session_state.selected_song = song_from_url
+    st.session_state.page = "Song Player"
 
-        # Auto guest if not logged in
-        if not st.session_state.get("user"):
-            st.session_state.user = "guest"
-            st.session_state.role = "guest"
+    # Auto guest if not logged in
+    if not st.session_state.get("user"):
+        st.session_state.user = "guest"
+        st.session_state.role = "guest"
 
-        save_session_to_db()
+    # Count each shared-link visit once per session
+    if st.session_state.get("share_open_logged") != song_from_url:
+        st.session_state.share_open_logged = song_from_url
+        track_event("share_open", song_from_url)
+
+    save_session_to_db()
 
 
+# =============== CACHE WARM-UP ===============
+WARMUP_LOOKBACK_DAYS = 7
+
+def warm_media_src(key, mime):
+    """Pre-sign a media URL; inline data URIs are never pre-built (megabytes per entry, per worker)"""
+    if key and storage.url_for(key, expires_in=MEDIA_URL_TTL_SECONDS):
+        cached_media_src(key, mime)
+
+def warm_song(song_name):
+    """Fill the caches a guest's first Song Player load would otherwise pay for"""
+    get_track_info(song_name)
+    get_track_peaks(song_name)
+    get_track_gains(song_name)
+    get_lyrics_track(song_name)
+    get_preview_key(song_name)
+    lyrics_key = get_lyrics_image_key(song_name)
+    if lyrics_key:
+        warm_media_src(lyrics_key, player.image_mime(lyrics_key))
+    warm_media_src(song_key(song_name, "original"), "audio/mpeg")
+    get_segment_urls(song_name, "original")
+    get_segment_urls(song_name, "accompaniment")
+    accompaniment = song_key(song_name, "accompaniment")
+    if not storage.exists(accompaniment):
+        return
+    warm_media_src(accompaniment, "audio/mpeg")
+
+    # Keys/tempos singers actually used recently: serve from cache, or render now
+    since = time.time() - WARMUP_LOOKBACK_DAYS * 86400
+    for semitones, tempo in analytics.popular_renditions(analytics_db_path, song_name, since):
+        try:
+            semitones, tempo = renditions.normalize(semitones, tempo)
+        except ValueError:
+            continue
+        key = renditions.cached_rendition(storage, get_accompaniment_hash(song_name), semitones, tempo)
+        if key:
+            warm_media_src(key, "audio/mpeg")
+        elif PRIMARY_WORKER:
+            schedule_rendition(song_name, semitones, tempo)
+
+def song_popularity():
+    return analytics.song_popularity(analytics_db_path, time.time() - WARMUP_LOOKBACK_DAYS * 86400)
+
+@st.cache_resource
+def start_cache_warmer():
+    """Warm every shared song once per process, in the background"""
+    return warmup.start_warmer(warm_song, song_popularity, initial=list(load_shared_links()))
+
+cache_warmer = start_cache_warmer()
+
+run_phases.mark("setup")
+
 # =============== INITIALIZE SESSION ===============
 check_and_create_session_id()
 
@@ -326,6 +776,7 @@ if not os.path.exists(default_logo_path):
     # Don't show uploader on login page to avoid rerun issues
     pass
 logo_b64 = file_to_base64(default_logo_path) if os.path.exists(default_logo_path) else ""
+run_phases.mark("session")
 
 # =============== RESPONSIVE LOGIN PAGE ===============
 if st.session_state.page == "Login":
@@ -477,41 +928,91 @@ elif st.session_state.page == "Admin Dashboard" and st.session_state.role == "ad
     
     st.title(f"👑 Admin Dashboard - {st.session_state.user}")
 
-    page_sidebar = st.sidebar.radio("Navigate", ["Upload Songs", "Songs List", "Share Links"], key="admin_nav")
+    page_sidebar = st.sidebar.radio("Navigate", ["Upload Songs", "Songs List", "Share Links", "Storage", "Analytics"], key="admin_nav")
 
     if page_sidebar == "Upload Songs":
         st.subheader("📤 Upload New Song")
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
         with col1:
             uploaded_original = st.file_uploader("Original Song (_original.mp3)", type=["mp3"], key="original_upload")
         with col2:
             uploaded_accompaniment = st.file_uploader("Accompaniment (_accompaniment.mp3)", type=["mp3"], key="acc_upload")
         with col3:
             uploaded_lyrics_image = st.file_uploader("Lyrics Image (_lyrics_bg.jpg/png)", type=["jpg", "jpeg", "png"], key="lyrics_upload")
-
-        if uploaded_original and uploaded_accompaniment and uploaded_lyrics_image:
+        with col4:
+            uploaded_lrc = st.file_uploader("Synced Lyrics (.lrc)", type=["lrc", "txt"], key="lrc_upload")
+
+        auto_extract = st.checkbox("🎛 No accompaniment? Extract an approximate backing track from the (stereo) original",
+                                   key="auto_extract")
+
+        lrc_text = None
+        if uploaded_lrc:
+            try:
+                lrc_text = lyrics.decode_upload(uploaded_lrc.getvalue())
+                st.caption(f"📝 {len(lyrics.parse_lrc(lrc_text))} timed lyric lines")
+            except lyrics.LyricsError as e:
+                st.error(f"❌ {e}")
+                lrc_text = None
+
+        if uploaded_original and (uploaded_accompaniment or auto_extract) and (uploaded_lyrics_image or lrc_text):
             song_name = uploaded_original.name.replace("_original.mp3", "").strip()
             if not song_name:
                 song_name = os.path.splitext(uploaded_original.name)[0]
 
-            original_path = os.path.join(songs_dir, f"{song_name}_original.mp3")
-            acc_path = os.path.join(songs_dir, f"{song_name}_accompaniment.mp3")
-            lyrics_ext = os.path.splitext(uploaded_lyrics_image.name)[1]
-            lyrics_path = os.path.join(lyrics_dir, f"{song_name}_lyrics_bg{lyrics_ext}")
-
-            with open(original_path, "wb") as f:
-                f.write(uploaded_original.getbuffer())
-            with open(acc_path, "wb") as f:
-                f.write(uploaded_accompaniment.getbuffer())
-            with open(lyrics_path, "wb") as f:
-                f.write(uploaded_lyrics_image.getbuffer())
-
-            metadata[song_name] = {"uploaded_by": st.session_state.user, "timestamp": str(time.time())}
-            save_metadata(metadata)
-            st.success(f"✅ Uploaded: {song_name}")
-            st.balloons()
-            time.sleep(1)
-            st.rerun()
+            with st.spinner("🔍 Checking the library for the same song..."):
+                duplicates = check_duplicate_upload(uploaded_original, song_name)
+            if duplicates and not st.session_state.get("confirm_duplicate_upload"):
+                for dup in duplicates:
+                    st.warning(f"⚠️ This sounds like **{dup['song']}**, which is already in the library "
+                               f"({dup['matches']} matching landmarks).")
+                if st.button("Upload anyway", key="upload_anyway"):
+                    st.session_state.confirm_duplicate_upload = True
+                    st.rerun()
+            else:
+                st.session_state.pop("confirm_duplicate_upload", None)
+
+                storage.put(song_key(song_name, "original"), uploaded_original.getbuffer(), "audio/mpeg")
+                if uploaded_accompaniment:
+                    storage.put(song_key(song_name, "accompaniment"), uploaded_accompaniment.getbuffer(), "audio/mpeg")
+                if uploaded_lyrics_image:
+                    lyrics_ext = os.path.splitext(uploaded_lyrics_image.name)[1]
+                    storage.put(f"lyrics_images/{song_name}_lyrics_bg{lyrics_ext}",
+                                uploaded_lyrics_image.getbuffer(), uploaded_lyrics_image.type)
+
+                metadata[song_name] = {"uploaded_by": st.session_state.user, "timestamp": str(time.time())}
+                if lrc_text:
+                    lyrics.save_lyrics(storage, song_name, lrc_text)
+                    metadata[song_name]["lyrics"] = lyrics.lyrics_key(song_name)
+                save_metadata(metadata)
+                invalidate("catalog", "tracks", "lyrics")
+                schedule_ingest(song_name)
+                st.success(f"✅ Uploaded: {song_name}")
+                if not uploaded_accompaniment:
+                    st.info("🎛 Backing track is being extracted in the background.")
+                st.balloons()
+                time.sleep(1)
+                st.rerun()
+
+        st.markdown("---")
+        st.subheader("📝 Timed Lyrics for an Existing Song")
+        lyric_songs = get_uploaded_songs(show_unshared=True)
+        if lyric_songs:
+            lrc_song = st.selectbox("Song", lyric_songs, key="lrc_song")
+            existing_lrc = get_lyrics_track(lrc_song)
+            if existing_lrc:
+                st.caption(f"Current: {len(existing_lrc)} timed lines")
+            lrc_file = st.file_uploader("LRC file", type=["lrc", "txt"], key="lrc_existing_upload")
+            if lrc_file and st.button("💾 Save Lyrics", key="save_lrc"):
+                try:
+                    count = lyrics.save_lyrics(storage, lrc_song, lyrics.decode_upload(lrc_file.getvalue()))
+                    metadata.setdefault(lrc_song, {"uploaded_by": st.session_state.user,
+                                                   "timestamp": str(time.time())})
+                    metadata[lrc_song]["lyrics"] = lyrics.lyrics_key(lrc_song)
+                    save_metadata(metadata)
+                    invalidate("lyrics")
+                    st.success(f"✅ Saved {count} timed lines for {lrc_song}")
+                except lyrics.LyricsError as e:
+                    st.error(f"❌ {e}")
 
     elif page_sidebar == "Songs List":
         st.subheader("🎵 All Songs List (Admin View)")
@@ -519,12 +1020,19 @@ elif st.session_state.page == "Admin Dashboard" and st.session_state.role == "ad
         if not uploaded_songs:
             st.warning("❌ No songs uploaded yet.")
         else:
+            missing = ingest.missing_analysis(storage, uploaded_songs)
+            if missing:
+                if st.button(f"🔬 Process {len(missing)} song(s) missing a backing track or analysis", key="analyze_missing"):
+                    for song_name in missing:
+                        schedule_ingest(song_name)
+                    st.success(f"✅ Queued {len(missing)} song(s) for analysis")
+
             for idx, s in enumerate(uploaded_songs):
                 col1, col2, col3 = st.columns([3, 1, 2])
-                safe_s = quote(s)
 
                 with col1:
-                    st.write(f"{s}** - by {metadata.get(s, {}).get('uploaded_by', 'Unknown')}")
+                    st.write(f"{s}** - by {metadata.get(s, {}).get('uploaded_by', 'Unknown')}{song_duration_label(s)}")
+                    render_preview(s)
                 with col2:
                     if st.button("▶ Play", key=f"play_{s}_{idx}"):
                         st.session_state.selected_song = s
@@ -535,7 +1043,7 @@ elif st.session_state.page == "Admin Dashboard" and st.session_state.role == "ad
                         st.rerun()
 
                 with col3:
-                    share_url = f"{APP_URL}?song={safe_s}"
+                    share_url = share_url_for(s)
                     st.markdown(f"[🔗 Share Link]({share_url})")
 
     elif page_sidebar == "Share Links":
@@ -543,9 +1051,89 @@ elif st.session_state.page == "Admin Dashboard" and st.session_state.role == "ad
         all_songs = get_uploaded_songs(show_unshared=True)
         shared_links_data = load_shared_links()
 
+        if st.session_state.get("share_flash"):
+            st.success(st.session_state.pop("share_flash"))
+
+        # ---- Bulk actions: one transaction + one rerun for any number of songs ----
+        with st.expander("📦 Bulk Share / Unshare", expanded=True):
+            col1, col2 = st.columns(2)
+            with col1:
+                share_filter = st.text_input("Search songs", key="share_filter").strip().lower()
+            with col2:
+                uploaders = sorted({info.get("uploaded_by", "unknown") for info in metadata.values()})
+                share_uploader = st.selectbox("Uploaded by", ["All"] + uploaders, key="share_uploader")
+
+            matching = [song for song in all_songs
+                        if share_filter in song.lower() and
+                        (share_uploader == "All" or metadata.get(song, {}).get("uploaded_by") == share_uploader)]
+            to_share = [song for song in matching if song not in shared_links_data]
+            to_unshare = [song for song in matching if song in shared_links_data]
+            scope = "all" if len(matching) == len(all_songs) else "matching"
+            st.caption(f"{len(matching)} {scope} song(s): {len(to_unshare)} shared, {len(to_share)} not shared")
+
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button(f"✅ Share {len(to_share)} {scope}", key="bulk_share", disabled=not to_share):
+                    count = bulk_update_shared_links(to_share, True, st.session_state.user)
+                    st.session_state.share_flash = f"✅ Shared {count} song(s)"
+                    st.rerun()
+            with col2:
+                if st.button(f"🚫 Unshare {len(to_unshare)} {scope}", key="bulk_unshare", disabled=not to_unshare):
+                    count = bulk_update_shared_links(to_unshare, False)
+                    st.session_state.share_flash = f"🚫 Unshared {count} song(s)"
+                    st.rerun()
+
+            picked = st.multiselect("Or pick songs", all_songs, key="share_picked")
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("✅ Share selected", key="share_picked_btn", disabled=not picked):
+                    count = bulk_update_shared_links(picked, True, st.session_state.user)
+                    st.session_state.share_flash = f"✅ Shared {count} song(s)"
+                    st.rerun()
+            with col2:
+                if st.button("🚫 Unshare selected", key="unshare_picked_btn", disabled=not picked):
+                    count = bulk_update_shared_links(picked, False)
+                    st.session_state.share_flash = f"🚫 Unshared {count} song(s)"
+                    st.rerun()
+
+        # ---- Signed links: expiring / listen-only, revocable one by one ----
+        with st.expander("⏳ Expiring Links (events)", expanded=False):
+            if not SHARE_TOKEN_SECRET:
+                st.info("Set SHARE_TOKEN_SECRET (or MEDIA_URL_SECRET) to create signed links.")
+            else:
+                col1, col2, col3 = st.columns([2, 1, 1])
+                with col1:
+                    token_song = st.selectbox("Song", all_songs, key="token_song")
+                with col2:
+                    token_expiry = st.selectbox("Expires after", list(SHARE_EXPIRY_CHOICES), key="token_expiry")
+                with col3:
+                    token_scope = st.selectbox("Guests can", ["record", "play"], key="token_scope",
+                                               format_func=lambda c: "Sing & record" if c == "record" else "Listen only")
+                token_label = st.text_input("Label (event or recipient)", key="token_label")
+                if st.button("🔑 Create link", key="mint_token", disabled=not token_song):
+                    token, claims = sharing.mint_share_token(SHARE_TOKEN_SECRET, token_song,
+                                                             SHARE_EXPIRY_CHOICES[token_expiry], token_scope)
+                    sharing.record_token(session_db_path, token, claims, token_label, st.session_state.user)
+                    st.session_state.share_flash = f"🔑 Link for {token_song}: {share_url_for(token_song, token)}"
+                    st.rerun()
+
+                for row in sharing.list_tokens(session_db_path):
+                    if share_revocations.is_revoked({"i": row["token_id"], "s": row["song_name"],
+                                                     "t": row["created_at"]}):
+                        continue
+                    col1, col2, col3 = st.columns([3, 1.5, 1])
+                    expires = (datetime.fromtimestamp(row["expires"]).strftime("%Y-%m-%d %H:%M")
+                               if row["expires"] else "never")
+                    col1.markdown(f"[{row['song_name']}]({share_url_for(row['song_name'], row['token'])}) · "
+                                  f"{row['label'] or '—'} · {row['scope']}")
+                    col2.caption(f"expires {expires}")
+                    if col3.button("Revoke", key=f"revoke_{row['token_id']}"):
+                        share_revocations.revoke_token(row["token_id"], row["expires"])
+                        st.session_state.share_flash = f"🚫 Revoked the {row['song_name']} link"
+                        st.rerun()
+
         for song in all_songs:
             col1, col2, col3, col4 = st.columns([2.5, 1, 1, 1.5])
-            safe_song = quote(song)
             is_shared = song in shared_links_data
 
             with col1:
@@ -556,27 +1144,98 @@ elif st.session_state.page == "Admin Dashboard" and st.session_state.role == "ad
                 if st.button("🔄 Toggle Share", key=f"toggle_share_{song}"):
                     if is_shared:
                         delete_shared_link(song)
-                        st.success(f"✅ {song} unshared! Users can no longer see this song.")
+                        st.session_state.share_flash = f"✅ {song} unshared! Users can no longer see this song."
                     else:
                         save_shared_link(song, {"shared_by": st.session_state.user, "active": True})
-                        share_url = f"{APP_URL}?song={safe_song}"
-                        st.success(f"✅ {song} shared! Link: {share_url}")
-                    time.sleep(0.5)
+                        share_url = share_url_for(song)
+                        st.session_state.share_flash = f"✅ {song} shared! Link: {share_url}"
                     st.rerun()
 
             with col3:
                 if is_shared:
                     if st.button("🚫 Unshare", key=f"unshare_{song}"):
                         delete_shared_link(song)
-                        st.success(f"✅ {song} unshared! Users cannot see this song anymore.")
-                        time.sleep(0.5)
+                        st.session_state.share_flash = f"✅ {song} unshared! Users cannot see this song anymore."
                         st.rerun()
 
             with col4:
                 if is_shared:
-                    share_url = f"{APP_URL}?song={safe_song}"
+                    share_url = share_url_for(song)
                     st.markdown(f"[📱 Open Link]({share_url})")
 
+    elif page_sidebar == "Storage":
+        st.header("🧹 Media Storage")
+        st.caption(f"temp: TTL {TEMP_TTL_HOURS:g} h, quota {TEMP_QUOTA_MB:g} MB · "
+                   f"finals: TTL {FINALS_TTL_DAYS:g} days, quota {FINALS_QUOTA_MB:g} MB · "
+                   f"sweep every {SWEEP_INTERVAL_SECONDS // 60} min")
+
+        report = media_lifecycle.sweep(retention_policies, dry_run=True,
+                                       protected_songs=load_active_session_songs())
+        for plan in report["policies"]:
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric(plan["policy"], f"{plan['files']} files")
+            col2.metric("Used", media_lifecycle.format_bytes(plan["total_bytes"]))
+            col3.metric("Would free", media_lifecycle.format_bytes(plan["freed_bytes"]))
+            col4.metric("Protected", plan["protected"])
+
+        rows = media_lifecycle.report_rows(report)
+        if rows:
+            st.write("**Dry run — files the next sweep would delete:**")
+            st.dataframe(rows, use_container_width=True)
+        else:
+            st.success("✅ Nothing to clean up.")
+
+        if media_sweeper.last_report:
+            last = media_sweeper.last_report
+            st.info(f"Last sweep: {datetime.fromtimestamp(last['started']).strftime('%Y-%m-%d %H:%M:%S')} · "
+                    f"freed {media_lifecycle.format_bytes(last['freed_bytes'])}")
+
+        if st.button("🧹 Run Cleanup Now", key="run_cleanup"):
+            result = media_sweeper.run_once(dry_run=False)
+            st.success(f"✅ Freed {media_lifecycle.format_bytes(result['freed_bytes'])}")
+            for err in result["errors"]:
+                st.warning(err)
+
+    elif page_sidebar == "Analytics":
+        st.header("📊 Plays & Recordings")
+        ranges = {"Last 24 hours": 1, "Last 7 days": 7, "Last 30 days": 30}
+        range_label = st.selectbox("Period", list(ranges), key="analytics_range")
+        since = time.time() - ranges[range_label] * 86400
+
+        totals = analytics.song_totals(analytics_db_path, since)
+        if not totals:
+            st.info("No events recorded in this period yet.")
+        else:
+            rows = [{"Song": song, **{event.replace("_", " ").title(): counts[event] for event in analytics.EVENT_TYPES}}
+                    for song, counts in totals.items()]
+            rows.sort(key=lambda r: (r["Play"], r["Record Complete"]), reverse=True)
+            st.dataframe(rows, use_container_width=True)
+
+            chart_song = st.selectbox("Hourly activity", ["All songs"] + sorted(totals), key="analytics_song")
+            hourly = analytics.hourly_counts(analytics_db_path, since,
+                                             None if chart_song == "All songs" else chart_song)
+            chart = {}
+            for hour, event, count in hourly:
+                chart.setdefault(hour, {"Hour": datetime.fromtimestamp(hour),
+                                        **dict.fromkeys(analytics.EVENT_TYPES, 0)})[event] = count
+            st.bar_chart([chart[h] for h in sorted(chart)], x="Hour", y=list(analytics.EVENT_TYPES))
+
+        st.caption(f"Buffered: {event_buffer.pending()} · written this process: {event_buffer.written} · "
+                   f"dropped: {event_buffer.dropped}")
+
+        st.subheader("🚦 Song Player Admission (this worker)")
+        load = render_admission.stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Rendering", f"{load['active']} / {load['max_renders']}",
+                    help=f"{load['admin_reserve']} slot(s) reserved for admins")
+        col2.metric("Inlined media in flight",
+                    f"{media_lifecycle.format_bytes(load['bytes_in_flight'])} / "
+                    f"{media_lifecycle.format_bytes(load['max_bytes'])}")
+        col3.metric("Waiting", f"{load['waiting']} / {load['max_waiting']}")
+        col4.metric("Turned away", load["rejected"])
+        st.caption(f"Admitted: {load['admitted']} · queued: {load['queued']} · "
+                   f"peak rendering: {load['peak_active']} · peak waiting: {load['peak_waiting']}")
+
     if st.sidebar.button("🚪 Logout", key="admin_logout"):
         for key in list(st.session_state.keys()):
             del st.session_state[key]
@@ -601,7 +1260,8 @@ elif st.session_state.page == "User Dashboard" and st.session_state.role == "use
         for idx, song in enumerate(uploaded_songs):
             col1, col2 = st.columns([3,1])
             with col1:
-                st.write(f"✅ {song} (Shared)")
+                st.write(f"✅ {song} (Shared){song_duration_label(song)}")
+                render_preview(song)
             with col2:
                 if st.button("▶ Play", key=f"user_play_{song}_{idx}"):
                     st.session_state.selected_song = song
@@ -656,9 +1316,10 @@ elif st.session_state.page == "Song Player" and st.session_state.get("selected_s
                 st.rerun()
         st.stop()
 
-    # Double-check access permission
-    shared_links = load_shared_links()
-    is_shared = selected_song in shared_links
+    # Double-check access permission: a valid share token needs no lookups
+    claims = share_claims()
+    token_ok = bool(claims) and claims["s"] == selected_song
+    is_shared = token_ok or selected_song in load_shared_links()
     is_admin = st.session_state.role == "admin"
     is_guest = st.session_state.role == "guest"
 
@@ -671,381 +1332,186 @@ elif st.session_state.page == "Song Player" and st.session_state.get("selected_s
     if not (is_admin or came_from_dashboard or is_shared):
         st.error("❌ Access denied!")
         st.stop()
+    run_phases.mark("player: access")
+
+    if not storage.exists(song_key(selected_song, "accompaniment")):
+        job = job_queue.get(f"ingest:{selected_song}")
+        if job is None:
+            # Nothing is preparing it (e.g. after a restart): start the ingest now
+            job = schedule_ingest(selected_song)
+        if job["status"] == "failed" or (job["status"] == "done" and not storage.exists(
+                song_key(selected_song, "accompaniment"))):
+            st.error("❌ The backing track for this song could not be prepared.")
+        else:
+            st.info("⏳ The backing track for this song is still being prepared. Please try again in a minute.")
+        st.stop()
 
-    original_path = os.path.join(songs_dir, f"{selected_song}_original.mp3")
-    accompaniment_path = os.path.join(songs_dir, f"{selected_song}_accompaniment.mp3")
-
-    lyrics_path = ""
-    for ext in [".jpg", ".jpeg", ".png"]:
-        p = os.path.join(lyrics_dir, f"{selected_song}_lyrics_bg{ext}")
-        if os.path.exists(p):
-            lyrics_path = p
-            break
-
-    original_b64 = file_to_base64(original_path)
-    accompaniment_b64 = file_to_base64(accompaniment_path)
-    lyrics_b64 = file_to_base64(lyrics_path)
-
-    # ✅ PERFECT IMAGE SIZE + LOGO POSITIONING LIKE DJANGO VERSION
-    karaoke_template = """
-<!doctype html>
-<html>
-<head>
-  <meta charset="utf-8" />
-  <title>🎤 Karaoke Reels</title>
-<style>
-* { margin: 0; padding: 0; box-sizing: border-box; }
-body { background: #000; font-family: 'Poppins', sans-serif; height: 100vh; width: 100vw; overflow: hidden; }
-.reel-container, .final-reel-container { width: 100%; height: 100%; position: absolute; background: #111; overflow: hidden; }
-#status { position: absolute; top: 20px; width: 100%; text-align: center; font-size: 14px; color: #ccc; z-index: 20; text-shadow: 1px 1px 6px rgba(0,0,0,0.9); }
-.reel-bg { position: absolute; top: 0; left: 0; width: 100%; height: 85vh; object-fit: contain; object-position: top; }
-.lyrics { position: absolute; bottom: 25%; width: 100%; text-align: center; font-size: 2vw; font-weight: bold; color: white; text-shadow: 2px 2px 10px black; }
-.controls { position: absolute; bottom: 20%; width: 100%; text-align: center; z-index: 30; }
-button { background: linear-gradient(135deg, #ff0066, #ff66cc); border: none; color: white; padding: 8px 20px; border-radius: 25px; font-size: 13px; margin: 4px; box-shadow: 0px 3px 15px rgba(255,0,128,0.4); cursor: pointer; }
-button:active { transform: scale(0.95); }
-.final-output { position: fixed; width: 100vw; height: 100vh; top: 0; left: 0; background: rgba(0,0,0,0.9); display: none; justify-content: center; align-items: center; z-index: 999; }
-#logoImg { position: absolute; top: 20px; left: 20px; width: 60px; z-index: 50; opacity: 0.6; }
-canvas { display: none; }
-.back-button { position: absolute; top: 20px; right: 20px; background: rgba(0,0,0,0.7); color: white; padding: 8px 16px; border-radius: 20px; text-decoration: none; font-size: 14px; z-index: 100; }
-</style>
-</head>
-<body>
-
-<div class="reel-container" id="reelContainer">
-    <img class="reel-bg" id="mainBg" src="data:image/jpeg;base64,%%LYRICS_B64%%">
-    <img id="logoImg" src="data:image/png;base64,%%LOGO_B64%%">
-    <div id="status">Ready 🎤</div>
-    <audio id="originalAudio" src="data:audio/mp3;base64,%%ORIGINAL_B64%%"></audio>
-    <audio id="accompaniment" src="data:audio/mp3;base64,%%ACCOMP_B64%%"></audio>
-    <div class="controls">
-      <button id="playBtn">▶ Play</button>
-      <button id="recordBtn">🎙 Record</button>
-      <button id="stopBtn" style="display:none;">⏹ Stop</button>
-    </div>
-</div>
-
-<div class="final-output" id="finalOutputDiv">
-  <div class="final-reel-container">
-    <img class="reel-bg" id="finalBg">
-    <div id="status"></div>
-    <div class="lyrics" id="finalLyrics"></div>
-    <div class="controls">
-      <button id="playRecordingBtn">▶ Play Recording</button>
-      <a id="downloadRecordingBtn" href="#" download>
-        <button>⬇ Download</button>
-      </a>
-      <button id="newRecordingBtn">🔄 New Recording</button>
-    </div>
-  </div>
-</div>
-
-<canvas id="recordingCanvas" width="1920" height="1080"></canvas>
-
-<script>
-/* ================== GLOBAL STATE ================== */
-let mediaRecorder;
-let recordedChunks = [];
-let playRecordingAudio = null;
-let lastRecordingURL = null;
-
-let audioContext, micSource, accSource;
-let canvasRafId = null;
-let isRecording = false;
-let isPlayingRecording = false;
-
-/* ================== ELEMENTS ================== */
-const playBtn = document.getElementById("playBtn");
-const recordBtn = document.getElementById("recordBtn");
-const stopBtn = document.getElementById("stopBtn");
-const status = document.getElementById("status");
-
-const originalAudio = document.getElementById("originalAudio");
-const accompanimentAudio = document.getElementById("accompaniment");
-
-const finalDiv = document.getElementById("finalOutputDiv");
-const mainBg = document.getElementById("mainBg");
-const finalBg = document.getElementById("finalBg");
-
-const playRecordingBtn = document.getElementById("playRecordingBtn");
-const downloadRecordingBtn = document.getElementById("downloadRecordingBtn");
-const newRecordingBtn = document.getElementById("newRecordingBtn");
-
-const canvas = document.getElementById("recordingCanvas");
-const ctx = canvas.getContext("2d");
-
-const logoImg = new Image();
-logoImg.src = document.getElementById("logoImg").src;
-
-/* ================== AUDIO CONTEXT FIX ================== */
-async function ensureAudioContext() {
-    if (!audioContext) {
-        audioContext = new (window.AudioContext || window.webkitAudioContext)();
-    }
-    if (audioContext.state === "suspended") {
-        await audioContext.resume();
-    }
-}
-
-async function safePlay(audio) {
-    try {
-        await ensureAudioContext();
-        await audio.play();
-    } catch (e) {
-        console.log("Autoplay blocked:", e);
-    }
-}
-
-document.addEventListener("visibilitychange", async () => {
-    if (!document.hidden) await ensureAudioContext();
-});
-
-/* ================== PLAY ORIGINAL ================== */
-playBtn.onclick = async () => {
-    await ensureAudioContext();
-    if (originalAudio.paused) {
-        originalAudio.currentTime = 0;
-        await safePlay(originalAudio);
-        playBtn.innerText = "⏸ Pause";
-        status.innerText = "🎵 Playing song...";
-    } else {
-        originalAudio.pause();
-        playBtn.innerText = "▶ Play";
-        status.innerText = "⏸ Paused";
-    }
-};
-
-/* ================== CANVAS DRAW (DJANGO MATCH) ================== */
-function drawCanvas() {
-    ctx.fillStyle = "#000";
-    ctx.fillRect(0, 0, canvas.width, canvas.height);
-
-    const canvasW = canvas.width;
-    const canvasH = canvas.height * 0.85;
-
-    const imgRatio = mainBg.naturalWidth / mainBg.naturalHeight;
-    const canvasRatio = canvasW / canvasH;
-
-    let drawW, drawH;
-    if (imgRatio > canvasRatio) {
-        drawW = canvasW;
-        drawH = canvasW / imgRatio;
-    } else {
-        drawH = canvasH;
-        drawW = canvasH * imgRatio;
-    }
-
-    const x = (canvasW - drawW) / 2;
-    const y = 0; // TOP aligned
-
-    ctx.drawImage(mainBg, x, y, drawW, drawH);
-
-    /* LOGO — exact Django feel */
-    ctx.globalAlpha = 0.6;
-    ctx.drawImage(logoImg, 20, 20, 60, 60);
-    ctx.globalAlpha = 1;
-
-    canvasRafId = requestAnimationFrame(drawCanvas);
-}
-
-/* ================== RECORD ================== */
-recordBtn.onclick = async () => {
-    if (isRecording) return;
-    isRecording = true;
-
-    await ensureAudioContext();
-    recordedChunks = [];
-
-    /* MIC */
-    const micStream = await navigator.mediaDevices.getUserMedia({ audio: true });
-    micSource = audioContext.createMediaStreamSource(micStream);
-
-    /* ACCOMPANIMENT */
-    const accRes = await fetch(accompanimentAudio.src);
-    const accBuf = await accRes.arrayBuffer();
-    const accDecoded = await audioContext.decodeAudioData(accBuf);
-
-    accSource = audioContext.createBufferSource();
-    accSource.buffer = accDecoded;
-
-    const destination = audioContext.createMediaStreamDestination();
-    micSource.connect(destination);
-    accSource.connect(destination);
-
-    accSource.start();
-
-    canvas.width = 1920;
-    canvas.height = 1080;
-    drawCanvas();
-
-    const stream = new MediaStream([
-        ...canvas.captureStream(30).getTracks(),
-        ...destination.stream.getTracks()
-    ]);
-
-    mediaRecorder = new MediaRecorder(stream);
-    mediaRecorder.ondataavailable = e => e.data.size && recordedChunks.push(e.data);
-
-    mediaRecorder.onstop = () => {
-        cancelAnimationFrame(canvasRafId);
-
-        const blob = new Blob(recordedChunks, { type: "video/webm" });
-        const url = URL.createObjectURL(blob);
-
-        if (lastRecordingURL) URL.revokeObjectURL(lastRecordingURL);
-        lastRecordingURL = url;
-
-        finalBg.src = mainBg.src;
-        finalDiv.style.display = "flex";
-
-        downloadRecordingBtn.href = url;
-        downloadRecordingBtn.download = "karaoke_" + Date.now() + ".webm";
-
-        playRecordingBtn.onclick = () => {
-            if (!isPlayingRecording) {
-                playRecordingAudio = new Audio(url);
-                playRecordingAudio.play();
-                playRecordingBtn.innerText = "⏹ Stop";
-                isPlayingRecording = true;
-                playRecordingAudio.onended = resetPlayBtn;
-            } else {
-                resetPlayBtn();
+    lyrics_key = get_lyrics_image_key(selected_song)
+    lyrics_mime = player.image_mime(lyrics_key)
+
+    # 🎚 Key / tempo of the backing track
+    key_col, tempo_col = st.columns(2)
+    with key_col:
+        key_shift = st.select_slider(
+            "Key", options=list(range(renditions.SEMITONE_RANGE[0], renditions.SEMITONE_RANGE[1] + 1)),
+            value=st.session_state.get("key_shift", 0), format_func=lambda v: f"{v:+d}" if v else "Original",
+            key="key_shift")
+    with tempo_col:
+        tempo = st.select_slider(
+            "Tempo", options=renditions.tempo_choices(), value=st.session_state.get("tempo", 1.0),
+            format_func=lambda v: f"{v:.2f}x", key="tempo")
+
+    # Always present, so the component below keeps its place (and its iframe) in the page
+    notice = st.container()
+    # Reported by the player component: playing / paused / recording / finished / idle
+    player_state = st.session_state.get("karaoke_player") or {}
+
+    # A key/tempo not rendered yet is prepared in the background; the original backing
+    # track plays meanwhile (no script thread blocked on the render, no admission slot held)
+    try:
+        accompaniment_key = get_rendition_key(selected_song, key_shift, tempo)
+    except Exception as e:
+        notice.warning(f"⚠️ Could not prepare that key/tempo, using the original backing track ({e})")
+        key_shift, tempo = 0, 1.0
+        accompaniment_key = song_key(selected_song, "accompaniment")
+    if accompaniment_key is None:
+        with notice:
+            rendition_watch(selected_song, key_shift, tempo)
+        key_shift, tempo = 0, 1.0
+        accompaniment_key = song_key(selected_song, "accompaniment")
+    run_phases.mark("player: rendition")
+
+    # 🚦 Heavy part of the page: wait for a slot when too many renders are in flight.
+    # Admission is once per player: the component's own state reports (every
+    # play/record/finish) and widget reruns of an admitted player skip the line.
+    player_id = f"{selected_song}|{key_shift:+d}|{tempo:.2f}"
+    mounted_props = st.session_state.get("player_props")
+    if mounted_props and mounted_props["player_id"].rsplit("|", 2)[0] != selected_song:
+        mounted_props = None
+    player_props = None
+    if player_state.get("state") == "recording" and mounted_props:
+        # Mid-take the mounted player stays exactly as it is; a new key/tempo waits for the take to end
+        slot, player_props = nullcontext(), mounted_props
+    elif st.session_state.get("admitted_player") == player_id and mounted_props:
+        slot = nullcontext()
+    else:
+        admission_ticket = st.session_state.session_id
+        cost = inline_cost(song_key(selected_song, "original"), song_key(selected_song, "accompaniment"),
+                           lyrics_key)
+        status, position = render_admission.try_acquire(admission_ticket, cost, admin=is_admin)
+        if status == admission.ADMITTED:
+            slot = render_admission.held(admission_ticket)
+        else:
+            with notice:
+                if status == admission.REJECTED:
+                    st.warning("🎤 The stage is full right now. Please try again in a few minutes.")
+                else:
+                    admission_line(admission_ticket, cost, is_admin)
+            if not mounted_props:
+                st.stop()
+            # A player already on the page (maybe mid-take) stays as it is until admitted
+            slot = nullcontext()
+            player_props = mounted_props
+
+    run_phases.mark("player: admission")
+    with slot:
+        if player_props is None:
+            # Data URIs are megabytes: the mounted player keeps the ones it was sent, so
+            # they are built and sent once per player_id (or when a remounted page asks again)
+            inline = not storage.url_for(accompaniment_key, expires_in=MEDIA_URL_TTL_SECONDS)
+            asked_again = (player_state.get("state") == "need_sources" and player_state.get("player_id") == player_id
+                           and player_state.get("at") != st.session_state.get("player_sources_asked"))
+            send_sources = not inline or asked_again or st.session_state.get("player_sources_sent") != player_id
+            sources = None
+            if send_sources:
+                sources = {
+                    "lyrics_src": cached_media_src(lyrics_key, lyrics_mime),
+                    "logo_src": f"data:image/png;base64,{logo_b64}" if logo_b64 else "",
+                    "original_src": cached_media_src(song_key(selected_song, "original"), "audio/mpeg"),
+                    "accomp_src": cached_media_src(accompaniment_key, "audio/mpeg"),
+                }
+            st.session_state.player_sources_sent = player_id
+            st.session_state.player_sources_asked = player_state.get("at")
+            run_phases.mark("player: media")
+
+            scope = claims["c"] if token_ok and not came_from_dashboard else "record"
+            server_config = server_render_config(selected_song, scope)
+            track_info = get_track_info(selected_song) or {}
+            track = {
+                "duration": track_info.get("duration"),
+                "key": key_shift,
+                "tempo": tempo,
+                "shifted": not renditions.is_identity(key_shift, tempo),
+                "peaks": get_track_peaks(selected_song),
+                "gains": get_track_gains(selected_song),
+                # Listen-only share links hide recording and get no upload token (analytics only)
+                "render": server_config if scope == "record" else None,
+                "events": server_config,
+                "scope": scope,
+                "lyrics": get_lyrics_track(selected_song),
+                # Streamed in chunks when segmented; renditions keep the progressive URL
+                "segments": {
+                    "original": get_segment_urls(selected_song, "original"),
+                    "accompaniment": (get_segment_urls(selected_song, "accompaniment")
+                                      if accompaniment_key == song_key(selected_song, "accompaniment") else None),
+                },
+                "session": {"user": st.session_state.get("user"), "role": st.session_state.get("role"),
+                            "id": st.session_state.get("session_id")},
             }
-        };
-    };
-
-    mediaRecorder.start();
+            player_props = {"player_id": player_id, "sources": sources, "track": track}
+            st.session_state.player_props = {**player_props, "sources": None if inline else sources}
+            st.session_state.admitted_player = player_id
+            st.session_state.last_player_payload_bytes = (sum(len(v) for v in (sources or {}).values()) +
+                                                          len(json.dumps(track)))
+
+        # ✅ BACK BUTTON LOGIC - ముఖ్యమైన మార్పులు ఇక్కడే
+        # Display back button ONLY for admin or user, NOT for guest
+        if st.session_state.role in ["admin", "user"]:
+            # Add back button ONLY for logged-in users
+            col1, col2 = st.columns([5, 1])
+            with col2:
+                if st.button("← Back to Dashboard", key="back_player"):
+                    if player_state.get("state") == "recording":
+                        # Stay on the page: the take is still running in the mounted player
+                        st.warning("🎙 Stop the recording before leaving the player.")
+                    else:
+                        if st.session_state.role == "admin":
+                            st.session_state.page = "Admin Dashboard"
+                            st.session_state.selected_song = None  # Clear song selection
+                        elif st.session_state.role == "user":
+                            st.session_state.page = "User Dashboard"
+                            st.session_state.selected_song = None  # Clear song selection
+
+                        # Clear song from query params when going back to dashboard
+                        if "song" in st.query_params:
+                            del st.query_params["song"]
+                        if "share" in st.query_params:
+                            del st.query_params["share"]
+
+                        # The player unmounts: send its sources again if the song is reopened
+                        st.session_state.player_sources_sent = None
+                        save_session_to_db()
+                        st.rerun()
+        else:
+            # For guest users, no back button - display empty space
+            st.empty()
 
-    originalAudio.currentTime = 0;
-    accompanimentAudio.currentTime = 0;
-    await safePlay(originalAudio);
-    await safePlay(accompanimentAudio);
+        # Stable key: reruns post new props to the mounted iframe instead of rebuilding it
+        karaoke_player = get_player_component()
+        karaoke_player(**player_props, height=800, key="karaoke_player", default=None)
+        run_phases.mark("player: component")
 
-    playBtn.style.display = "none";
-    recordBtn.style.display = "none";
-    stopBtn.style.display = "inline-block";
-    status.innerText = "🎙 Recording...";
-    
-    // ✅ AUTOMATIC STOP: Set timeout to stop recording when song ends
-    const songDuration = originalAudio.duration * 1000; // Convert to milliseconds
-    setTimeout(() => {
-        if (isRecording) {
-            stopBtn.click(); // Automatically click stop button
-        }
-    }, songDuration + 500); // Add 500ms buffer
-};
-
-/* ================== STOP ================== */
-stopBtn.onclick = () => {
-    if (!isRecording) return;
-    isRecording = false;
-
-    try { mediaRecorder.stop(); } catch {}
-    try { accSource.stop(); } catch {}
-
-    originalAudio.pause();
-    accompanimentAudio.pause();
-
-    stopBtn.style.display = "none";
-    status.innerText = "⏹ Processing...";
-};
-
-/* ================== HELPERS ================== */
-function resetPlayBtn() {
-    if (playRecordingAudio) {
-        playRecordingAudio.pause();
-        playRecordingAudio.currentTime = 0;
-    }
-    playRecordingBtn.innerText = "▶ Play Recording";
-    isPlayingRecording = false;
-}
-
-/* ================== NEW RECORDING ================== */
-newRecordingBtn.onclick = () => {
-    finalDiv.style.display = "none";
-
-    recordedChunks = [];
-    isRecording = false;
-    isPlayingRecording = false;
-
-    originalAudio.pause();
-    accompanimentAudio.pause();
-    originalAudio.currentTime = 0;
-    accompanimentAudio.currentTime = 0;
-
-    if (playRecordingAudio) {
-        playRecordingAudio.pause();
-        playRecordingAudio = null;
-    }
-
-    playBtn.style.display = "inline-block";
-    recordBtn.style.display = "inline-block";
-    stopBtn.style.display = "none";
-    playBtn.innerText = "▶ Play";
-    status.innerText = "Ready 🎤";
-};
-
-/* ================== SONG END DETECTION ================== */
-originalAudio.addEventListener('ended', () => {
-    if (isRecording) {
-        // If recording is still active when song ends, stop it
-        setTimeout(() => {
-            if (isRecording) {
-                stopBtn.click();
-            }
-        }, 100);
-    }
-});
-
-accompanimentAudio.addEventListener('ended', () => {
-    if (isRecording) {
-        // If recording is still active when accompaniment ends, stop it
-        setTimeout(() => {
-            if (isRecording) {
-                stopBtn.click();
-            }
-        }, 100);
-    }
-});
-</script>
-</body>
-</html>
-"""
-
-    karaoke_html = karaoke_template.replace("%%LYRICS_B64%%", lyrics_b64 or "")
-    karaoke_html = karaoke_html.replace("%%LOGO_B64%%", logo_b64 or "")
-    karaoke_html = karaoke_html.replace("%%ORIGINAL_B64%%", original_b64 or "")
-    karaoke_html = karaoke_html.replace("%%ACCOMP_B64%%", accompaniment_b64 or "")
-
-    # ✅ BACK BUTTON LOGIC - ముఖ్యమైన మార్పులు ఇక్కడే
-    # Display back button ONLY for admin or user, NOT for guest
-    if st.session_state.role in ["admin", "user"]:
-        # Add back button ONLY for logged-in users
-        col1, col2 = st.columns([5, 1])
-        with col2:
-            if st.button("← Back to Dashboard", key="back_player"):
-                if st.session_state.role == "admin":
-                    st.session_state.page = "Admin Dashboard"
-                    st.session_state.selected_song = None  # Clear song selection
-                elif st.session_state.role == "user":
-                    st.session_state.page = "User Dashboard"
-                    st.session_state.selected_song = None  # Clear song selection
-                
-                # Clear song from query params when going back to dashboard
-                if "song" in st.query_params:
-                    del st.query_params["song"]
-                
-                save_session_to_db()
-                st.rerun()
-    else:
-        # For guest users, no back button - display empty space
-        st.empty()
-
-    html(karaoke_html, height=800, width=1920, scrolling=False)
+    take = player_state.get("take") if player_state.get("state") == "finished" else None
+    if take and take.get("video_url"):
+        st.markdown(f"[🎬 Download your video]({take['video_url']})")
+    if take and take.get("score"):
+        st.caption(f"🎯 Last take: {take['score']['score']} "
+                   f"(pitch {take['score']['pitch']}, timing {take['score']['timing']})")
 
 # =============== FALLBACK ===============
 else:
     # If song exists in URL, NEVER redirect to login
-    if "song" in st.query_params:
+    if "song" in st.query_params or "share" in st.query_params:
         st.session_state.page = "Song Player"
     else:
         st.session_state.page = "Login"
@@ -1054,6 +1520,10 @@ else:
 
 
 # =============== DEBUG INFO (Hidden by default) ===============
+run_phases.mark(f"page: {st.session_state.get('page')}")
+if debug_capture:
+    debug_capture.end(run_phases)
+
 with st.sidebar:
     if st.session_state.get("role") == "admin":
         if st.checkbox("Show Debug Info", key="debug_toggle"):
@@ -1063,8 +1533,45 @@ with st.sidebar:
             st.write(f"Role: {st.session_state.get('role')}")
             st.write(f"Selected Song: {st.session_state.get('selected_song')}")
             st.write(f"Query Params: {dict(st.query_params)}")
-            
+
+            st.write(f"**⏱ This run: {run_phases.total() * 1000:.0f} ms**")
+            st.dataframe(run_phases.rows(), use_container_width=True, hide_index=True)
+            payload = st.session_state.get("last_player_payload_bytes")
+            if payload:
+                st.caption(f"Last player payload: {media_lifecycle.format_bytes(payload)}")
+
+            with st.expander("🔬 Profiler"):
+                capture_runs = st.number_input("Reruns to capture", min_value=1, max_value=50, value=5,
+                                               key="debug_capture_runs")
+                capture_allocations = st.checkbox("Track allocations (tracemalloc, slows the app down)",
+                                                  key="debug_capture_allocations")
+                if st.button("▶ Start Capture", key="debug_capture_start"):
+                    if debug_capture:
+                        debug_capture.cancel()
+                    st.session_state.debug_capture = profiler.Capture(int(capture_runs), capture_allocations)
+                    st.rerun()
+
+                if debug_capture:
+                    status = "done" if debug_capture.done else "keep using the app to capture the rest"
+                    st.caption(f"{len(debug_capture.runs)} / {debug_capture.requested} runs captured ({status})")
+                    st.dataframe([{k: v for k, v in run.items() if k != "phases"} for run in debug_capture.runs],
+                                 use_container_width=True, hide_index=True)
+                    sort = st.selectbox("Sort by", ["cumulative", "tottime", "calls"], key="debug_capture_sort")
+                    st.dataframe(debug_capture.top_functions(sort=sort), use_container_width=True, hide_index=True)
+                    if debug_capture.allocation_diff:
+                        st.write("**Largest allocations (net, across captured runs)**")
+                        st.dataframe(debug_capture.allocation_diff, use_container_width=True, hide_index=True)
+                    st.download_button("⬇ Download .pstats", debug_capture.pstats_bytes(),
+                                       file_name=f"karaoke-{datetime.now().strftime('%Y%m%d-%H%M%S')}.pstats",
+                                       mime="application/octet-stream", key="debug_capture_download")
+                    if st.button("🗑 Clear Capture", key="debug_capture_clear"):
+                        debug_capture.cancel()
+                        del st.session_state["debug_capture"]
+                        st.rerun()
+
             if st.button("Force Reset", key="debug_reset"):
+                if debug_capture:
+                    debug_capture.cancel()
                 for key in list(st.session_state.keys()):
                     del st.session_state[key]
                 st.session_state.page = "Login"
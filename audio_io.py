@@ -0,0 +1,107 @@
+"""Decoding helpers shared by the server-side audio stages.
+
+Everything goes through the ffmpeg binary (via ffmpeg-python), streaming raw
+float32 PCM over a pipe so a whole song never has to sit in memory at once.
+"""
+import numpy as np
+import ffmpeg
+
+DEFAULT_BLOCK_SECONDS = 10
+
+
+def probe(path):
+    """Basic stream info: duration, sample_rate, channels, bitrate"""
+    info = ffmpeg.probe(path)
+    stream = next((s for s in info.get("streams", []) if s.get("codec_type") == "audio"), {})
+    fmt = info.get("format", {})
+    return {
+        "duration": float(fmt.get("duration") or stream.get("duration") or 0.0),
+        "sample_rate": int(stream.get("sample_rate") or 44100),
+        "channels": int(stream.get("channels") or 2),
+        "bitrate": int(fmt.get("bit_rate") or stream.get("bit_rate") or 0),
+        "codec": stream.get("codec_name", ""),
+    }
+
+
+def iter_pcm(path, sample_rate=44100, channels=2, block_seconds=DEFAULT_BLOCK_SECONDS):
+    """Yield float32 arrays of shape (frames, channels) decoded from path"""
+    process = (
+        ffmpeg
+        .input(path)
+        .output("pipe:", format="f32le", acodec="pcm_f32le", ac=channels, ar=sample_rate)
+        .global_args("-nostdin", "-loglevel", "error")
+        .run_async(pipe_stdout=True)
+    )
+    frame_bytes = 4 * channels
+    block_bytes = int(block_seconds * sample_rate) * frame_bytes
+    pending = b""
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            data = pending + data
+            usable = len(data) - len(data) % frame_bytes
+            pending = data[usable:]
+            if usable:
+                yield np.frombuffer(data[:usable], dtype="<f4").reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        process.wait()
+    if process.returncode not in (0, None):
+        raise RuntimeError(f"ffmpeg failed to decode {path} (exit {process.returncode})")
+
+
+def decode_pcm(path, sample_rate=44100, channels=2):
+    """Decode a whole file to one float32 (frames, channels) array"""
+    blocks = list(iter_pcm(path, sample_rate, channels))
+    if not blocks:
+        return np.zeros((0, channels), dtype=np.float32)
+    return np.concatenate(blocks)
+
+
+class PcmWriter:
+    """Stream float32 (frames, channels) blocks into an encoded audio file"""
+
+    def __init__(self, path, sample_rate, channels, codec="libmp3lame", bitrate="192k",
+                 extra=None):
+        self.path = path
+        output_args = {"acodec": codec, "audio_bitrate": bitrate}
+        output_args.update(extra or {})
+        self.process = (
+            ffmpeg
+            .input("pipe:", format="f32le", ac=channels, ar=sample_rate)
+            .output(path, **output_args)
+            .global_args("-nostdin", "-loglevel", "error")
+            .overwrite_output()
+            .run_async(pipe_stdin=True)
+        )
+
+    def write(self, block):
+        block = np.ascontiguousarray(np.clip(block, -1.0, 1.0), dtype="<f4")
+        self.process.stdin.write(block.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+        if self.process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.path} (exit {self.process.returncode})")
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+def encode_pcm(samples, sample_rate, path, codec="libmp3lame", bitrate="192k", extra=None):
+    """Encode a float32 (frames, channels) array to an audio file"""
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    with PcmWriter(path, sample_rate, channels, codec, bitrate, extra) as writer:
+        writer.write(samples)
+    return path
@@ -0,0 +1,212 @@
+"""Throughput vs. worker count, measured on this host.
+
+    python bench_workers.py                       # media_server, 1/2/4 uvicorn workers
+    python bench_workers.py --song "My Song"      # the cached guest player page
+    python bench_workers.py --target app          # cluster.py + nginx, full script reruns
+    python bench_workers.py --target app --song "My Song"   # reruns of that song's player page
+    python bench_workers.py --url http://host:8501/_stcore/health   # something already running
+
+For each worker count it starts the server, waits until it answers, then
+runs ``--clients`` load processes (keep-alive HTTP/1.1) for ``--seconds``
+and prints requests/s and latency percentiles.  Client processes are
+separate so the load generator is not limited by one interpreter's GIL;
+keep ``--clients`` well above the largest worker count.
+
+A Streamlit page view is a websocket conversation, not a request, so for
+``--target app`` each client opens ``/_stcore/stream`` through nginx (with
+its own sticky cookie, like a separate browser), sends a ``rerun_script``
+back message for the page (``?song=`` with ``--song``) and waits for the
+``script_finished`` forward message, over and over: "req/s" there is
+complete script reruns per second, and latency is the time of one rerun.
+Needs streamlit (its protobufs and tornado) in this interpreter.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import uuid
+from urllib.parse import quote, urlsplit
+
+BENCH_PORT = 8790
+
+
+def _client(url, seconds, results):
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    conn.close()
+    results.put((latencies, errors))
+
+
+def _rerun_client(url, seconds, results):
+    import asyncio
+
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+    from tornado.httpclient import HTTPRequest
+    from tornado.websocket import websocket_connect
+
+    parts = urlsplit(url)
+    stream_url = f"ws://{parts.hostname}:{parts.port or 80}/_stcore/stream"
+    rerun = BackMsg()
+    rerun.rerun_script.query_string = parts.query
+    rerun.rerun_script.page_script_hash = ""
+    message = rerun.SerializeToString()
+
+    async def connect():
+        request = HTTPRequest(stream_url, headers={"Cookie": f"karaoke_worker={uuid.uuid4().hex}"})
+        return await websocket_connect(request, subprotocols=["streamlit"])
+
+    async def until_finished(ws):
+        while True:
+            data = await ws.read_message()
+            if data is None:
+                raise OSError("websocket closed")
+            msg = ForwardMsg()
+            msg.ParseFromString(data)
+            if msg.WhichOneof("type") == "script_finished":
+                return
+
+    async def run():
+        latencies, errors = [], 0
+        deadline = time.perf_counter() + seconds
+        ws = None
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                if ws is None:
+                    ws = await connect()
+                await ws.write_message(message, binary=True)
+                await asyncio.wait_for(until_finished(ws), timeout=30)
+                latencies.append(time.perf_counter() - start)
+            except Exception:  # refused, closed or timed out: reconnect
+                errors += 1
+                if ws is not None:
+                    ws.close()
+                ws = None
+        if ws is not None:
+            ws.close()
+        return latencies, errors
+
+    results.put(asyncio.run(run()))
+
+
+def run_load(url, clients, seconds, client=_client):
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=client, args=(url, seconds, results)) for _ in range(clients)]
+    for p in procs:
+        p.start()
+    latencies, errors = [], 0
+    for _ in procs:
+        lat, err = results.get()
+        latencies.extend(lat)
+        errors += err
+    for p in procs:
+        p.join()
+    latencies.sort()
+
+    def pct(q):
+        return 1000 * latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+    return {"rps": len(latencies) / seconds, "p50_ms": pct(0.5), "p99_ms": pct(0.99), "errors": errors}
+
+
+def wait_until_up(url, timeout=60):
+    parts = urlsplit(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=2)
+            conn.request("GET", parts.path or "/")
+            conn.getresponse().read()
+            conn.close()
+            return True
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.5)
+    return False
+
+
+def start_server(target, workers):
+    if target == "app":
+        env = dict(os.environ, WEB_CONCURRENCY=str(workers), PORT=str(BENCH_PORT))
+        command = [sys.executable, "cluster.py"]
+    else:
+        env = dict(os.environ)
+        env.setdefault("MEDIA_URL_SECRET", "bench")
+        command = [sys.executable, "-m", "uvicorn", "media_server:app", "--host", "127.0.0.1",
+                   "--port", str(BENCH_PORT), "--workers", str(workers), "--log-level", "warning",
+                   "--no-access-log"]
+    return subprocess.Popen(command, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests/s of the app or media server vs. worker count")
+    parser.add_argument("--target", choices=("media", "app"), default="media")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent load processes")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--song", help="page of this song: /play?song= (media) or the Song Player rerun (app)")
+    parser.add_argument("--url", help="benchmark this URL as is, without starting anything")
+    args = parser.parse_args()
+
+    if args.url:
+        result = run_load(args.url, args.clients, args.seconds)
+        print(f"{args.url}: {result['rps']:.0f} req/s  p50 {result['p50_ms']:.1f} ms  "
+              f"p99 {result['p99_ms']:.1f} ms  errors {result['errors']}")
+        return 0
+
+    client = _client
+    health = None
+    if args.target == "app":
+        # Health answers once a worker is up; the load itself is script reruns
+        path = f"/?song={quote(args.song)}" if args.song else "/"
+        client = _rerun_client
+        health = f"http://127.0.0.1:{BENCH_PORT}/_stcore/health"
+    elif args.song:
+        path = f"/play?song={quote(args.song)}"
+    else:
+        path = "/api/jobs/bench"
+    url = f"http://127.0.0.1:{BENCH_PORT}{path}"
+
+    baseline = None
+    print(f"{'workers':>7}  {'runs/s' if args.target == 'app' else 'req/s':>8}  {'speedup':>7}  {'p50 ms':>7}  {'p99 ms':>7}  errors")
+    for workers in [int(n) for n in args.workers.split(",")]:
+        server = start_server(args.target, workers)
+        try:
+            if not wait_until_up(health or url):
+                print(f"{workers:>7}  server did not come up")
+                continue
+            run_load(url, args.clients, 1, client)  # warm caches and connections
+            result = run_load(url, args.clients, args.seconds, client)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        baseline = baseline or result["rps"]
+        print(f"{workers:>7}  {result['rps']:>8.0f}  {result['rps'] / baseline:>6.2f}x  "
+              f"{result['p50_ms']:>7.1f}  {result['p99_ms']:>7.1f}  {result['errors']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""Bulk import of a song library, resumable.
+
+    python bulk_import.py SOURCE [--media-dir media] [--db session_data.db]
+                          [--workers N] [--uploaded-by admin] [--no-ingest] [--dry-run]
+
+SOURCE is either a directory, scanned recursively for the upload naming
+scheme -- ``<song>_original.mp3``, ``<song>_accompaniment.mp3``,
+``<song>_lyrics_bg.{jpg,jpeg,png}`` -- or a ``songs_db.json`` whose rows
+give a title and Windows-style file paths relative to the JSON file.
+
+For each song the original is hashed, and the song is skipped when the
+library (or an earlier song of the same import) already has the same audio.
+Otherwise its files are copied in through media_storage (local or S3),
+its metadata row is written as if uploaded from the Admin page, and the
+full ingest (backing track extraction when there is none, all analysis
+sidecars) runs on a spawned process pool.  Hashing and copying are I/O
+bound and run on threads.
+
+Progress is appended to a JSON-lines checkpoint
+(``media/import_checkpoint.jsonl`` by default), one line per song and
+stage -- ``copied``, ``ingested``, ``duplicate``, ``skipped``, ``failed``.
+Rerunning the same command after an interruption skips finished songs,
+resumes copied ones at ingest and retries failed ones: files missing from
+storage are copied again and the metadata row is rewritten before ingest.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import ingest
+import media_storage
+import shared_state
+
+TRACK_SUFFIXES = {"_original.mp3": "original", "_accompaniment.mp3": "accompaniment"}
+LYRICS_SUFFIX = "_lyrics_bg"
+LYRICS_EXTS = (".jpg", ".jpeg", ".png")
+HASH_CHUNK = 1024 * 1024
+METADATA_FLUSH_EVERY = 100
+DONE_STAGES = ("ingested", "duplicate")
+
+
+# =============== SOURCES ===============
+def scan_directory(root):
+    """{song: {"original": path, "accompaniment": path, "lyrics_image": path}}"""
+    found = defaultdict(dict)
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            lower = filename.lower()
+            for suffix, kind in TRACK_SUFFIXES.items():
+                if lower.endswith(suffix):
+                    found[filename[:-len(suffix)]][kind] = path
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() in LYRICS_EXTS and stem.endswith(LYRICS_SUFFIX):
+                found[stem[:-len(LYRICS_SUFFIX)]]["lyrics_image"] = path
+    return dict(found)
+
+
+def scan_songs_db(json_path):
+    """Same shape from a legacy songs_db.json; repeated titles get " (2)", " (3)"..."""
+    base_dir = os.path.dirname(os.path.abspath(json_path))
+    with open(json_path) as f:
+        rows = json.load(f)
+
+    def local(path):
+        return os.path.join(base_dir, *path.replace("\\", "/").split("/")) if path else None
+
+    found = {}
+    for row in rows:
+        title = (row.get("title") or "").strip()
+        if not title:
+            continue
+        name, n = title, 1
+        while name in found:
+            n += 1
+            name = f"{title} ({n})"
+        files = {"original": local(row.get("original_file")),
+                 "accompaniment": local(row.get("accompaniment_file")),
+                 "lyrics_image": local(row.get("lyrics_image"))}
+        found[name] = {kind: path for kind, path in files.items() if path}
+    return found
+
+
+def valid_song_name(song_name):
+    return bool(song_name) and "/" not in song_name and "\\" not in song_name and song_name not in (".", "..")
+
+
+# =============== CHECKPOINT ===============
+def load_checkpoint(path):
+    """{song: last record}; a torn last line from a crash is ignored"""
+    state = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                state[record["song"]] = record
+    except FileNotFoundError:
+        pass
+    return state
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.state = load_checkpoint(path)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, song_name, stage, **extra):
+        record = {"song": song_name, "stage": stage, "at": round(time.time(), 3), **extra}
+        self.state[song_name] = record
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+# =============== WORK ===============
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stored_hash(storage, key):
+    if isinstance(storage, media_storage.LocalStorage):
+        return file_hash(storage.local_path(key))
+    return hashlib.sha1(storage.get(key)).hexdigest()
+
+
+def library_hashes(storage, sizes, workers):
+    """{sha1: song} of library originals (local or S3) whose size matches a candidate's"""
+    keys = [k for k in storage.list("songs/") if k.endswith("_original.mp3")]
+
+    def size(key):
+        try:
+            return storage.size(key)
+        except media_storage.StorageError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        key_sizes = list(pool.map(size, keys))
+        keys = [k for k, size in zip(keys, key_sizes) if size in sizes]
+        return {digest: key[len("songs/"):-len("_original.mp3")]
+                for key, digest in zip(keys, pool.map(lambda k: stored_hash(storage, k), keys))}
+
+
+def copy_song(storage, song_name, files, only_missing=False):
+    copies = [(files["original"], f"songs/{song_name}_original.mp3", "audio/mpeg")]
+    if files.get("accompaniment"):
+        copies.append((files["accompaniment"], f"songs/{song_name}_accompaniment.mp3", "audio/mpeg"))
+    if files.get("lyrics_image"):
+        ext = os.path.splitext(files["lyrics_image"])[1].lower()
+        copies.append((files["lyrics_image"], f"lyrics_images/{song_name}{LYRICS_SUFFIX}{ext}",
+                       media_storage.guess_content_type(files["lyrics_image"])))
+    for path, key, content_type in copies:
+        if only_missing and storage.exists(key):
+            continue
+        with open(path, "rb") as f:
+            storage.put(key, f, content_type)
+
+
+def ingest_job(media_dir, song_name):
+    """Process-pool entry point; returns the ingest errors ({} when clean)"""
+    return ingest.ingest_song(media_dir, song_name)["errors"]
+
+
+def flush_metadata(media_dir, db_path, rows):
+    """Write uploaded_by/timestamp like the Admin upload form does"""
+    if not rows:
+        return
+    metadata_path = os.path.join(media_dir, "song_metadata.json")
+    try:
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        metadata = {}
+    for song_name, uploaded_by, timestamp in rows:
+        metadata[song_name] = {**metadata.get(song_name, {}), "uploaded_by": uploaded_by,
+                               "timestamp": str(timestamp)}
+    tmp_path = f"{metadata_path}.import"
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, metadata_path)
+    try:
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute('''CREATE TABLE IF NOT EXISTS metadata
+                        (song_name TEXT PRIMARY KEY,
+                         uploaded_by TEXT,
+                         timestamp REAL)''')
+        conn.executemany('INSERT OR REPLACE INTO metadata (song_name, uploaded_by, timestamp) VALUES (?, ?, ?)',
+                         rows)
+        conn.commit()
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"!! metadata table: {e}", file=sys.stderr)
+    rows.clear()
+    # Running app workers pick the new songs up on their next rerun
+    shared_state.invalidate(media_dir, "catalog", "tracks", "lyrics")
+
+
+def run_import(source, media_dir, db_path, checkpoint_path, workers=None, uploaded_by="import",
+               run_ingest=True, dry_run=False, out=sys.stdout):
+    started = time.time()
+    found = scan_songs_db(source) if os.path.isfile(source) else scan_directory(source)
+    checkpoint = Checkpoint(checkpoint_path)
+    state = checkpoint.state
+    counts = defaultdict(int)
+
+    todo = {}
+    for song_name, files in sorted(found.items()):
+        previous = state.get(song_name, {}).get("stage")
+        if previous in DONE_STAGES or (previous == "copied" and not run_ingest):
+            counts["already_done"] += 1
+        elif not valid_song_name(song_name) or not files.get("original"):
+            counts["skipped"] += 1
+            if not dry_run:
+                checkpoint.record(song_name, "skipped",
+                                  reason="no original" if valid_song_name(song_name) else "bad name")
+        else:
+            todo[song_name] = files
+    print(f"{len(found)} song(s) found, {counts['already_done']} already imported, "
+          f"{len(todo)} to do", file=out)
+
+    # Dedupe: hash the new originals, and only the library files of a matching size
+    thread_workers = min(32, (os.cpu_count() or 1) * 4)
+    to_hash = [s for s in todo if "hash" not in state.get(s, {})]
+    with ThreadPoolExecutor(max_workers=thread_workers) as pool:
+        hashes = dict(zip(to_hash, pool.map(lambda s: file_hash(todo[s]["original"]), to_hash)))
+    hashes.update({s: state[s]["hash"] for s in todo if "hash" in state.get(s, {})})
+    storage = media_storage.storage_from_env(media_dir)
+    library = library_hashes(storage, {os.path.getsize(f["original"]) for f in todo.values()},
+                             thread_workers)
+
+    copy_todo, ingest_todo = [], []
+    only_missing = set()
+    for song_name in todo:
+        digest = hashes[song_name]
+        owner = library.get(digest)
+        previous = state.get(song_name, {}).get("stage")
+        if previous == "copied":
+            ingest_todo.append(song_name)
+        elif previous == "failed" and owner in (song_name, None):
+            # An earlier run claimed this name and stopped partway (copy or ingest):
+            # finish the copy -- all of it when the stored original is not ours -- and the metadata
+            if owner == song_name:
+                only_missing.add(song_name)
+            library[digest] = song_name
+            copy_todo.append(song_name)
+        elif owner == song_name:
+            # Already in the library with this audio (e.g. a failed ingest): ingest only
+            ingest_todo.append(song_name)
+        elif owner is not None:
+            counts["duplicate"] += 1
+            print(f"= {song_name}: same audio as {owner}", file=out)
+            if not dry_run:
+                checkpoint.record(song_name, "duplicate", hash=digest, of=owner)
+        elif owner is None and storage.exists(f"songs/{song_name}_original.mp3"):
+            counts["skipped"] += 1
+            print(f"!! {song_name}: a different song already has this name", file=out)
+            if not dry_run:
+                checkpoint.record(song_name, "skipped", hash=digest, reason="name taken")
+        else:
+            library[digest] = song_name
+            copy_todo.append(song_name)
+
+    if dry_run:
+        print(f"dry run: would copy {len(copy_todo)}, ingest {len(copy_todo) + len(ingest_todo)}, "
+              f"skip {counts['duplicate']} duplicate(s)", file=out)
+        checkpoint.close()
+        return dict(counts)
+
+    # Copy on threads, ingest on processes; a song is queued for ingest as soon as it is in
+    metadata_rows = []
+    ingest_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    ingest_futures = {}
+
+    def queue_ingest(song_name):
+        if run_ingest:
+            ingest_futures[ingest_pool.submit(ingest_job, media_dir, song_name)] = song_name
+
+    try:
+        for song_name in ingest_todo:
+            queue_ingest(song_name)
+        with ThreadPoolExecutor(max_workers=thread_workers) as copy_pool:
+            copy_futures = {copy_pool.submit(copy_song, storage, s, todo[s], s in only_missing): s
+                            for s in copy_todo}
+            for future in as_completed(copy_futures):
+                song_name = copy_futures[future]
+                try:
+                    future.result()
+                except (OSError, media_storage.StorageError) as e:
+                    counts["failed"] += 1
+                    checkpoint.record(song_name, "failed", hash=hashes[song_name], error=f"copy: {e}")
+                    print(f"!! {song_name}: copy failed: {e}", file=out)
+                    continue
+                counts["copied"] += 1
+                checkpoint.record(song_name, "copied", hash=hashes[song_name])
+                metadata_rows.append((song_name, uploaded_by, time.time()))
+                if len(metadata_rows) >= METADATA_FLUSH_EVERY:
+                    flush_metadata(media_dir, db_path, metadata_rows)
+                queue_ingest(song_name)
+        flush_metadata(media_dir, db_path, metadata_rows)
+
+        total = len(ingest_futures)
+        for done, future in enumerate(as_completed(ingest_futures), 1):
+            song_name = ingest_futures[future]
+            try:
+                errors = future.result()
+            except Exception as e:
+                errors = {"ingest": f"{type(e).__name__}: {e}"}
+            if errors:
+                counts["failed"] += 1
+                checkpoint.record(song_name, "failed", hash=hashes[song_name], error=errors)
+                print(f"!! {song_name}: {errors}", file=out)
+            else:
+                counts["ingested"] += 1
+                checkpoint.record(song_name, "ingested", hash=hashes[song_name])
+            if done % 50 == 0 or done == total:
+                print(f"ingested {done}/{total} ({time.time() - started:.0f}s)", file=out)
+    finally:
+        flush_metadata(media_dir, db_path, metadata_rows)
+        ingest_pool.shutdown(wait=True, cancel_futures=True)
+        checkpoint.close()
+    shared_state.invalidate(media_dir, "catalog", "tracks", "lyrics")
+
+    print(f"done in {time.time() - started:.0f}s: " +
+          ", ".join(f"{n} {what}" for what, n in sorted(counts.items()) if n), file=out)
+    return dict(counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a directory of songs (or a songs_db.json)")
+    parser.add_argument("source", help="directory to scan, or a songs_db.json file")
+    parser.add_argument("--media-dir", default=os.path.join(os.getcwd(), "media"))
+    parser.add_argument("--db", default=os.path.join(os.getcwd(), "session_data.db"))
+    parser.add_argument("--checkpoint", default=None,
+                        help="progress file (default: <media-dir>/import_checkpoint.jsonl)")
+    parser.add_argument("--workers", type=int, default=None, help="ingest processes (default: CPU count)")
+    parser.add_argument("--uploaded-by", default="import")
+    parser.add_argument("--no-ingest", action="store_true", help="copy only; ingest later from the Admin page")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be imported")
+    args = parser.parse_args(argv)
+
+    checkpoint = args.checkpoint or os.path.join(args.media_dir, "import_checkpoint.jsonl")
+    os.makedirs(args.media_dir, exist_ok=True)
+    counts = run_import(args.source, args.media_dir, args.db, checkpoint, workers=args.workers,
+                        uploaded_by=args.uploaded_by, run_ingest=not args.no_ingest, dry_run=args.dry_run)
+    return 1 if counts.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
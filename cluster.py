@@ -0,0 +1,138 @@
+"""Run several Streamlit app workers on one host behind nginx.
+
+    python cluster.py            # WEB_CONCURRENCY workers (default 1) on $PORT
+
+One Streamlit process runs every script rerun of every session on one
+interpreter, so a busy night tops out at one core.  This starts N workers
+on ``127.0.0.1:WORKER_BASE_PORT+i`` (``KARAOKE_WORKER=i``) and an nginx in
+front on ``$PORT``.
+
+A Streamlit session lives in the worker that holds its websocket, so
+routing is sticky: nginx hashes a ``karaoke_worker`` cookie, which it sets
+on the first response (a fresh random value), and the page, its websocket
+and its reconnects all land on the same worker.  Workers share everything
+else through the host: the media directory, the SQLite databases, and
+shared_state.py for caches and invalidation.  Worker 0 runs the periodic
+sweeper and pre-renders renditions.
+
+With ``WEB_CONCURRENCY=1`` (or no nginx installed) this just execs the
+single Streamlit process the Procfile used to run.
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8700"))
+PORT = int(os.getenv("PORT", "8501"))
+
+NGINX_TEMPLATE = """
+worker_processes auto;
+pid %%STATE%%/nginx.pid;
+error_log stderr warn;
+events { worker_connections 4096; }
+
+http {
+    access_log off;
+    client_body_temp_path %%STATE%%/body;
+    proxy_temp_path %%STATE%%/proxy;
+    fastcgi_temp_path %%STATE%%/fastcgi;
+    uwsgi_temp_path %%STATE%%/uwsgi;
+    scgi_temp_path %%STATE%%/scgi;
+    client_max_body_size 200m;
+
+    map $http_upgrade $connection_upgrade {
+        default upgrade;
+        ""      close;
+    }
+    # First visit: a fresh random key, echoed back as the cookie below
+    map $cookie_karaoke_worker $karaoke_sticky {
+        ""      $request_id;
+        default $cookie_karaoke_worker;
+    }
+
+    upstream karaoke_workers {
+        hash $karaoke_sticky consistent;
+%%SERVERS%%
+    }
+
+    server {
+        listen %%PORT%%;
+        location / {
+            proxy_pass http://karaoke_workers;
+            proxy_http_version 1.1;
+            proxy_set_header Upgrade $http_upgrade;
+            proxy_set_header Connection $connection_upgrade;
+            proxy_set_header Host $host;
+            proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+            proxy_set_header X-Forwarded-Proto $scheme;
+            proxy_read_timeout 1d;
+            proxy_buffering off;
+            add_header Set-Cookie "karaoke_worker=$karaoke_sticky; Path=/; HttpOnly; SameSite=Lax" always;
+        }
+    }
+}
+"""
+
+
+def streamlit_command(port, address):
+    return [sys.executable, "-m", "streamlit", "run", "app.py",
+            f"--server.port={port}", f"--server.address={address}", "--server.headless=true"]
+
+
+def render_nginx_conf(state_dir, port, worker_ports):
+    servers = "\n".join(f"        server 127.0.0.1:{p} max_fails=0;" for p in worker_ports)
+    return (NGINX_TEMPLATE.replace("%%STATE%%", state_dir)
+            .replace("%%SERVERS%%", servers)
+            .replace("%%PORT%%", str(port)))
+
+
+def main():
+    nginx = shutil.which("nginx")
+    if WEB_CONCURRENCY <= 1 or not nginx:
+        if WEB_CONCURRENCY > 1:
+            print("cluster: nginx not found, running a single worker", file=sys.stderr)
+        command = streamlit_command(PORT, "0.0.0.0")
+        os.execv(command[0], command)
+
+    state_dir = tempfile.mkdtemp(prefix="karaoke-nginx-")
+    worker_ports = [WORKER_BASE_PORT + i for i in range(WEB_CONCURRENCY)]
+    conf_path = os.path.join(state_dir, "nginx.conf")
+    with open(conf_path, "w") as f:
+        f.write(render_nginx_conf(state_dir, PORT, worker_ports))
+
+    children = []
+    for i, port in enumerate(worker_ports):
+        env = dict(os.environ, KARAOKE_WORKER=str(i))
+        children.append(subprocess.Popen(streamlit_command(port, "127.0.0.1"), env=env))
+    children.append(subprocess.Popen([nginx, "-c", conf_path, "-g", "daemon off;"]))
+
+    def stop(signum, frame):
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        # Any child exiting takes the whole group down; the platform restarts us
+        while all(child.poll() is None for child in children):
+            time.sleep(1)
+    finally:
+        stop(None, None)
+        deadline = time.time() + 10
+        for child in children:
+            try:
+                child.wait(timeout=max(0.1, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                child.kill()
+        shutil.rmtree(state_dir, ignore_errors=True)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""Acoustic fingerprints for spotting re-uploads of the same song.
+
+A fingerprint is a set of landmark hashes: spectrogram peaks are picked
+with a 2-D maximum filter and every peak (anchor) is paired with the next
+few peaks after it.  Each pair hashes to ``(f1, f2, dt)`` and is stored with
+the anchor's time.  Hashes survive re-encoding, bitrate and sample-rate
+changes because they only depend on where the strongest partials sit in
+the time/frequency plane (~10.8 Hz x ~46 ms grid, independent of the
+source sample rate).
+
+The inverted index lives in SQLite (``hash -> song, offset``).  A lookup
+joins the query hashes against it and scores every candidate song by the
+largest number of hashes agreeing on one time offset.
+
+Batch mode scans the whole library for duplicates::
+
+    python fingerprint.py scan [--media-dir media]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import audio_io
+
+FREQ_STEP_HZ = 11025 / 1024        # frequency grid (~10.8 Hz)
+FRAME_SECONDS = 1024 / 11025       # analysis window (~93 ms), hop is half
+MAX_FREQ_HZ = 5000.0
+PEAK_TIME_RADIUS = 10              # frames
+PEAK_FREQ_RADIUS = 12              # grid steps
+PEAKS_PER_SECOND = 30
+FAN_OUT = 5
+MAX_DT = 63                        # frames between anchor and target
+MIN_MATCHES = 15
+MIN_MATCH_RATIO = 0.01
+
+
+class FingerprintAccumulator:
+    """Streaming log-magnitude spectrogram on a sample-rate independent grid"""
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.frame_size = int(round(sample_rate * FRAME_SECONDS))
+        self.hop = self.frame_size // 2
+        self.window = np.hanning(self.frame_size).astype(np.float32)
+        freqs = np.fft.rfftfreq(self.frame_size, 1.0 / sample_rate)
+        keep = freqs <= MAX_FREQ_HZ
+        self._bins = np.nonzero(keep)[0]
+        # Map native FFT bins onto the fixed frequency grid
+        grid = np.round(freqs[keep] / FREQ_STEP_HZ).astype(np.int32)
+        self.grid_size = int(grid.max()) + 1
+        self._grid_starts = np.searchsorted(grid, np.arange(self.grid_size))
+        self._grid_starts = np.minimum(self._grid_starts, len(grid) - 1)
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._frames = []
+
+    def add(self, block):
+        mono = block.mean(axis=1) if block.ndim == 2 else block
+        buf = np.concatenate([self._carry, mono.astype(np.float32, copy=False)])
+        if len(buf) < self.frame_size:
+            self._carry = buf
+            return
+        n = (len(buf) - self.frame_size) // self.hop + 1
+        frames = np.lib.stride_tricks.sliding_window_view(buf, self.frame_size)[::self.hop][:n]
+        mags = np.abs(np.fft.rfft(frames * self.window, axis=1))[:, self._bins]
+        grid = np.maximum.reduceat(mags, self._grid_starts, axis=1).astype(np.float32)
+        self._frames.append(np.log1p(grid * 100.0))
+        self._carry = buf[n * self.hop:]
+
+    def spectrogram(self):
+        if not self._frames:
+            return np.zeros((0, self.grid_size), np.float32)
+        return np.concatenate(self._frames)
+
+
+def _max_filter(a, radius, axis):
+    pad = [(0, 0)] * a.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(a, pad, mode="constant", constant_values=-np.inf)
+    return np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1, axis=axis).max(axis=-1)
+
+
+def find_peaks(spec):
+    """Return (frames, freqs) of spectrogram landmarks, sorted by time"""
+    if not len(spec):
+        return np.zeros(0, np.int32), np.zeros(0, np.int32)
+    local_max = _max_filter(_max_filter(spec, PEAK_FREQ_RADIUS, 1), PEAK_TIME_RADIUS, 0)
+    candidates = (spec == local_max) & (spec > spec.mean() + spec.std() * 0.5)
+    t, f = np.nonzero(candidates)
+    strength = spec[t, f]
+
+    # Keep the strongest peaks, about PEAKS_PER_SECOND on average
+    seconds = len(spec) * FRAME_SECONDS / 2
+    limit = max(1, int(seconds * PEAKS_PER_SECOND))
+    if len(t) > limit:
+        keep = np.argpartition(-strength, limit)[:limit]
+        t, f = t[keep], f[keep]
+    order = np.lexsort((f, t))
+    return t[order].astype(np.int32), f[order].astype(np.int32)
+
+
+def landmark_hashes(t, f):
+    """Pair each peak with the next FAN_OUT peaks: (hashes, anchor offsets)"""
+    hashes, offsets = [], []
+    for j in range(1, FAN_OUT + 1):
+        if len(t) <= j:
+            break
+        dt = t[j:] - t[:-j]
+        ok = (dt > 0) & (dt <= MAX_DT)
+        f1, f2 = f[:-j][ok], f[j:][ok]
+        hashes.append((f1.astype(np.int64) << 15) | (f2.astype(np.int64) << 6) | dt[ok])
+        offsets.append(t[:-j][ok])
+    if not hashes:
+        return np.zeros(0, np.int64), np.zeros(0, np.int32)
+    return np.concatenate(hashes), np.concatenate(offsets).astype(np.int32)
+
+
+def fingerprint_blocks(blocks, sample_rate):
+    acc = FingerprintAccumulator(sample_rate)
+    for block in blocks:
+        acc.add(block)
+    return landmark_hashes(*find_peaks(acc.spectrogram()))
+
+
+def fingerprint_file(path):
+    """Decode a file and fingerprint it: (hashes, offsets)"""
+    info = audio_io.probe(path)
+    blocks = audio_io.iter_pcm(path, sample_rate=info["sample_rate"], channels=1)
+    return fingerprint_blocks(blocks, info["sample_rate"])
+
+
+def encode_fingerprint(hashes, offsets):
+    return np.stack([hashes.astype(np.int64), offsets.astype(np.int64)]).astype("<i8").tobytes()
+
+
+def decode_fingerprint(data):
+    pairs = np.frombuffer(data, dtype="<i8").reshape(2, -1)
+    return pairs[0], pairs[1].astype(np.int32)
+
+
+# =============== INVERTED INDEX ===============
+def index_path(media_dir):
+    return os.path.join(media_dir, "fingerprints.db")
+
+
+def connect_index(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS fp_songs
+                    (song_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     song_name TEXT UNIQUE,
+                     hash_count INTEGER)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS fp_hashes
+                    (hash INTEGER, song_id INTEGER, offset INTEGER)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS fp_hashes_hash ON fp_hashes(hash)')
+    return conn
+
+
+def add_to_index(db_path, song_name, hashes, offsets):
+    """(Re)index a song's fingerprint"""
+    conn = connect_index(db_path)
+    try:
+        with conn:
+            remove_song(conn, song_name)
+            cur = conn.execute('INSERT INTO fp_songs (song_name, hash_count) VALUES (?, ?)',
+                               (song_name, int(len(hashes))))
+            song_id = cur.lastrowid
+            conn.executemany('INSERT INTO fp_hashes (hash, song_id, offset) VALUES (?, ?, ?)',
+                             zip(hashes.tolist(), [song_id] * len(hashes), offsets.tolist()))
+    finally:
+        conn.close()
+
+
+def remove_song(conn, song_name):
+    row = conn.execute('SELECT song_id FROM fp_songs WHERE song_name = ?', (song_name,)).fetchone()
+    if row:
+        conn.execute('DELETE FROM fp_hashes WHERE song_id = ?', (row[0],))
+        conn.execute('DELETE FROM fp_songs WHERE song_id = ?', (row[0],))
+
+
+def lookup(db_path, hashes, offsets, exclude=(), limit=3):
+    """Best matching indexed songs: [{'song', 'matches', 'ratio', 'offset_seconds'}]"""
+    if not len(hashes) or not os.path.exists(db_path):
+        return []
+    conn = connect_index(db_path)
+    try:
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS fp_query (hash INTEGER, offset INTEGER)')
+        conn.execute('DELETE FROM fp_query')
+        conn.executemany('INSERT INTO fp_query VALUES (?, ?)',
+                         zip(hashes.tolist(), offsets.tolist()))
+        rows = conn.execute('''SELECT h.song_id, h.offset - q.offset
+                               FROM fp_query q JOIN fp_hashes h ON h.hash = q.hash''').fetchall()
+        names = dict(conn.execute('SELECT song_id, song_name FROM fp_songs').fetchall())
+    finally:
+        conn.close()
+    if not rows:
+        return []
+
+    data = np.asarray(rows, dtype=np.int64)
+    # Count (song, offset delta) pairs; the best delta per song is its score
+    pairs, counts = np.unique(data, axis=0, return_counts=True)
+    results = {}
+    for (song_id, delta), count in zip(pairs.tolist(), counts.tolist()):
+        name = names.get(song_id)
+        if name is None or name in exclude:
+            continue
+        if count > results.get(name, (0, 0))[0]:
+            results[name] = (count, delta)
+
+    matches = []
+    for name, (count, delta) in sorted(results.items(), key=lambda kv: -kv[1][0]):
+        ratio = count / float(len(hashes))
+        if count >= MIN_MATCHES and ratio >= MIN_MATCH_RATIO:
+            matches.append({"song": name, "matches": count, "ratio": round(ratio, 3),
+                            "offset_seconds": round(delta * FRAME_SECONDS / 2, 2)})
+    return matches[:limit]
+
+
+def find_duplicates_of_file(db_path, path, exclude=()):
+    hashes, offsets = fingerprint_file(path)
+    return lookup(db_path, hashes, offsets, exclude=exclude)
+
+
+# =============== BATCH SCAN ===============
+def _fingerprint_job(path):
+    try:
+        return path, fingerprint_file(path), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def scan_library(media_dir, workers=None, out=sys.stdout):
+    """Fingerprint every mp3 under songs/, index catalog originals, report duplicates"""
+    songs_dir = os.path.join(media_dir, "songs")
+    db_path = index_path(media_dir)
+    paths = sorted(os.path.join(songs_dir, f) for f in os.listdir(songs_dir)
+                   if f.lower().endswith(".mp3"))
+
+    prints = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, fp, error in pool.map(_fingerprint_job, paths):
+            if error:
+                print(f"!! {os.path.basename(path)}: {error}", file=out)
+            else:
+                prints[path] = fp
+
+    # Catalog originals go into the persistent index
+    for path, (hashes, offsets) in prints.items():
+        name = os.path.basename(path)
+        if name.endswith("_original.mp3"):
+            add_to_index(db_path, name[:-len("_original.mp3")], hashes, offsets)
+
+    # Every file (catalog or loose) is matched against all others
+    tmp_db = db_path + ".scan"
+    if os.path.exists(tmp_db):
+        os.remove(tmp_db)
+    for path, (hashes, offsets) in prints.items():
+        add_to_index(tmp_db, os.path.basename(path), hashes, offsets)
+
+    groups = []
+    seen = set()
+    for path, (hashes, offsets) in prints.items():
+        name = os.path.basename(path)
+        if name in seen:
+            continue
+        matches = lookup(tmp_db, hashes, offsets, exclude=(name,), limit=50)
+        if matches:
+            group = [name] + [m["song"] for m in matches]
+            seen.update(group)
+            groups.append(group)
+    os.remove(tmp_db)
+
+    for group in groups:
+        print("Duplicates:", file=out)
+        for name in group:
+            print(f"  - {name}", file=out)
+    print(f"{len(prints)} files fingerprinted, {len(groups)} duplicate group(s)", file=out)
+    return groups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Acoustic fingerprint index tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    scan = sub.add_parser("scan", help="fingerprint the whole library and list duplicates")
+    scan.add_argument("--media-dir", default=os.path.join(os.getcwd(), "media"))
+    scan.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+    if args.command == "scan":
+        scan_library(args.media_dir, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""Catalog vs. disk consistency checker for the media tree.
+
+The catalog is implicit: a song exists when ``songs/<song>_original.mp3``
+does, and everything else (backing track, lyrics image or LRC, analysis
+sidecars, shared links, metadata rows in ``song_metadata.json`` and the
+session database) hangs off that name.  ``check`` walks all of it and
+reports:
+
+* ``unpaired_original`` / ``unpaired_accompaniment`` -- one half of a pair
+* ``unnamed_track`` -- audio in ``songs/`` outside the naming scheme
+* ``missing_lyrics`` -- a song with neither a lyrics image nor timed lyrics
+* ``orphan_lyrics`` / ``orphan_analysis`` / ``orphan_shared_link`` /
+  ``orphan_metadata`` -- files or rows for songs that do not exist
+* ``stale_legacy_entry`` -- ``songs_db.json`` rows whose files are gone
+* ``empty_file`` / ``corrupt_audio`` -- zero bytes, or ffprobe rejects it
+* ``duplicate_content`` -- byte-identical files
+
+Files are hashed and probed on a thread pool (hashing releases the GIL and
+probing is a subprocess).  Only files that share their size with another
+file are hashed at all, so a 50k-file library costs one ``stat`` per file
+plus the probes.
+
+``--repair`` only touches what is provably dead: orphan rows are deleted,
+orphan files and extra copies of duplicates are moved (never deleted) to
+``media/lost+found/<timestamp>/``, and ``songs_db.json`` /
+``song_metadata.json`` are backed up there before being rewritten.  Audio
+that belongs to a song is never moved::
+
+    python fsck.py [--media-dir media] [--db session_data.db] [--repair] [--json]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+
+import audio_io
+
+TRACK_SUFFIXES = ("_original.mp3", "_accompaniment.mp3")
+LYRICS_SUFFIX = "_lyrics_bg"
+LYRICS_EXTS = (".jpg", ".jpeg", ".png")
+AUDIO_EXTS = (".mp3", ".m4a", ".wav", ".ogg", ".webm", ".mp4")
+ANALYSIS_KINDS = ("_original.", "_accompaniment.")
+HASH_CHUNK = 1024 * 1024
+# Never hashed or moved: scratch, caches and derived media (segments)
+# Per-song sidecars: two live songs may well have identical ones, so never "duplicates" to move
+SIDECAR_DIRS = ("analysis", "lyrics", "previews", "shared_links")
+SKIP_DIRS = ("temp", "pcm_cache", "renditions", "segments", "player_component", "shared_state",
+             "lost+found")
+
+
+def _finding(kind, path=None, song=None, detail="", repair=None):
+    return {"kind": kind, "path": path, "song": song, "detail": detail, "repair": repair}
+
+
+def _list_files(directory):
+    """[(path, size)] of the regular files directly in a directory"""
+    files = []
+    if not os.path.isdir(directory):
+        return files
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False) and not entry.name.startswith("."):
+                try:
+                    files.append((entry.path, entry.stat(follow_symlinks=False).st_size))
+                except OSError:
+                    pass
+    return files
+
+
+def _walk(media_dir):
+    """[(path, size)] of every file under media_dir outside the SKIP_DIRS"""
+    files = []
+    for root, dirs, names in os.walk(media_dir):
+        if root == media_dir:
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in names:
+            if name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            try:
+                files.append((path, os.path.getsize(path)))
+            except OSError:
+                pass
+    return files
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def probe_file(path):
+    """None if ffprobe accepts the file, else the reason"""
+    try:
+        info = audio_io.probe(path)
+    except ffmpeg.Error as e:
+        lines = (e.stderr or b"").decode(errors="replace").strip().splitlines()
+        return lines[-1] if lines else "unreadable"
+    if not info["duration"]:
+        return "no audio duration"
+    return None
+
+
+# =============== CATALOG ===============
+def _catalog(songs_dir):
+    """(originals, accompaniments, unnamed paths) from the songs directory"""
+    originals, accompaniments, unnamed = set(), set(), []
+    for path, _ in _list_files(songs_dir):
+        name = os.path.basename(path)
+        if name.endswith("_original.mp3"):
+            originals.add(name[:-len("_original.mp3")])
+        elif name.endswith("_accompaniment.mp3"):
+            accompaniments.add(name[:-len("_accompaniment.mp3")])
+        elif name.lower().endswith(AUDIO_EXTS):
+            unnamed.append(path)
+    return originals, accompaniments, unnamed
+
+
+def _lyrics_song(filename):
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() in LYRICS_EXTS and stem.endswith(LYRICS_SUFFIX):
+        return stem[:-len(LYRICS_SUFFIX)]
+    return None
+
+
+def _analysis_song(filename):
+    for kind in ANALYSIS_KINDS:
+        if kind in filename:
+            return filename[:filename.rindex(kind)]
+    return None
+
+
+def _sidecar_song(media_dir, path):
+    """Song a file under one of SIDECAR_DIRS belongs to, by name, or None"""
+    parts = os.path.relpath(path, media_dir).split(os.sep)
+    if len(parts) < 2 or parts[0] not in SIDECAR_DIRS:
+        return None
+    if parts[0] in ("lyrics", "shared_links"):
+        return os.path.splitext(parts[-1])[0]
+    return _analysis_song(parts[-1])
+
+
+def _db_rows(db_path, query):
+    if not os.path.exists(db_path):
+        return []
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute(query).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return []
+
+
+def _legacy_path(base_dir, path):
+    """songs_db.json stores Windows-style relative paths"""
+    return os.path.join(base_dir, *path.replace("\\", "/").split("/")) if path else ""
+
+
+def check(media_dir, db_path, base_dir=None, workers=None, probe=True):
+    """Scan the media tree; returns {"findings": [...], "stats": {...}}"""
+    started = time.time()
+    base_dir = base_dir or os.path.dirname(os.path.abspath(media_dir))
+    songs_dir = os.path.join(media_dir, "songs")
+    findings = []
+
+    # The legacy songs_db.json catalog: stale rows, and files it still points at
+    legacy_path = os.path.join(base_dir, "songs_db.json")
+    try:
+        with open(legacy_path) as f:
+            legacy = json.load(f)
+    except (OSError, ValueError):
+        legacy = []
+    referenced = set()
+    for entry in legacy if isinstance(legacy, list) else []:
+        paths = [p for p in (entry.get("original_file"), entry.get("accompaniment_file"),
+                             entry.get("lyrics_image")) if p]
+        referenced.update(os.path.abspath(_legacy_path(base_dir, p)) for p in paths)
+        missing = [p for p in paths if not os.path.exists(_legacy_path(base_dir, p))]
+        if missing:
+            # Only entries with no files left at all are dropped on repair
+            findings.append(_finding("stale_legacy_entry", song=entry.get("title"),
+                                     detail=f"{entry.get('id')}: missing {', '.join(missing)}",
+                                     repair="drop_legacy_entry" if len(missing) == len(paths) else None))
+
+    def movable(path):
+        """Quarantine only files nothing points at"""
+        return "quarantine" if os.path.abspath(path) not in referenced else None
+
+    songs, accompaniments, unnamed = _catalog(songs_dir)
+    for song in sorted(songs - accompaniments):
+        findings.append(_finding("unpaired_original", song=song,
+                                 detail="no backing track yet; re-run ingest to extract one"))
+    for song in sorted(accompaniments - songs):
+        findings.append(_finding("unpaired_accompaniment", song=song,
+                                 path=os.path.join(songs_dir, f"{song}_accompaniment.mp3"),
+                                 detail="no original", repair="quarantine"))
+    for path in sorted(unnamed):
+        findings.append(_finding("unnamed_track", path=path,
+                                 detail="not <song>_original.mp3 / <song>_accompaniment.mp3"))
+
+    # Lyrics: an image or timed lyrics per song; images for unknown songs are orphans
+    lyrics_dir = os.path.join(media_dir, "lyrics_images")
+    with_image = set()
+    for path, _ in _list_files(lyrics_dir):
+        song = _lyrics_song(os.path.basename(path))
+        if song in songs:
+            with_image.add(song)
+        else:
+            findings.append(_finding("orphan_lyrics", path=path, song=song,
+                                     detail="no such song" if song else "not <song>_lyrics_bg.<ext>",
+                                     repair=movable(path)))
+    with_lrc = set()
+    for path, _ in _list_files(os.path.join(media_dir, "lyrics")):
+        song = os.path.basename(path)[:-len(".lrc")] if path.endswith(".lrc") else None
+        if song in songs:
+            with_lrc.add(song)
+        else:
+            findings.append(_finding("orphan_lyrics", path=path, song=song, detail="no such song",
+                                     repair="quarantine"))
+    for song in sorted(songs - with_image - with_lrc):
+        findings.append(_finding("missing_lyrics", song=song))
+
+    for path, _ in _list_files(os.path.join(media_dir, "analysis")):
+        song = _analysis_song(os.path.basename(path))
+        if song not in songs:
+            findings.append(_finding("orphan_analysis", path=path, song=song, detail="no such song",
+                                     repair="quarantine"))
+
+    # Shared links and metadata, on disk and in the session database
+    for path, _ in _list_files(os.path.join(media_dir, "shared_links")):
+        song = os.path.basename(path)[:-len(".json")] if path.endswith(".json") else None
+        if song not in songs:
+            findings.append(_finding("orphan_shared_link", path=path, song=song, detail="file",
+                                     repair="quarantine"))
+    for (song,) in _db_rows(db_path, "SELECT song_name FROM shared_links"):
+        if song not in songs:
+            findings.append(_finding("orphan_shared_link", song=song, detail="database row",
+                                     repair="delete_shared_row"))
+
+    metadata_path = os.path.join(media_dir, "song_metadata.json")
+    try:
+        with open(metadata_path) as f:
+            file_metadata = json.load(f)
+    except (OSError, ValueError):
+        file_metadata = {}
+    for song in sorted(set(file_metadata) - songs):
+        findings.append(_finding("orphan_metadata", song=song, detail="song_metadata.json",
+                                 repair="drop_metadata_entry"))
+    for (song,) in _db_rows(db_path, "SELECT song_name FROM metadata"):
+        if song not in songs:
+            findings.append(_finding("orphan_metadata", song=song, detail="database row",
+                                     repair="delete_metadata_row"))
+
+    # Content checks, in parallel
+    files = _walk(media_dir)
+    by_size = defaultdict(list)
+    for path, size in files:
+        if size == 0:
+            findings.append(_finding("empty_file", path=path))
+        else:
+            by_size[size].append(path)
+    to_hash = [p for paths in by_size.values() if len(paths) > 1 for p in paths]
+    audio = [p for p, size in files if size and p.lower().endswith(AUDIO_EXTS)]
+
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        hashes = dict(zip(to_hash, pool.map(file_sha1, to_hash)))
+        if probe:
+            try:
+                problems = dict(zip(audio, pool.map(probe_file, audio)))
+            except FileNotFoundError:
+                # No ffprobe on this machine: skip the audio check rather than flag everything
+                probe, problems = False, {}
+            for path, problem in problems.items():
+                if problem:
+                    findings.append(_finding("corrupt_audio", path=path, detail=str(problem)))
+
+    by_hash = defaultdict(list)
+    for path, digest in hashes.items():
+        by_hash[digest].append(path)
+    for digest, paths in by_hash.items():
+        if len(paths) < 2:
+            continue
+        keep = _keeper(paths)
+        for path in sorted(paths):
+            if path != keep:
+                # Catalog files, finals (their URLs may be out there) and sidecars of
+                # existing songs are only reported
+                fixable = (not _is_catalog_file(path) and os.path.basename(os.path.dirname(path)) != "finals"
+                           and _sidecar_song(media_dir, path) not in songs)
+                findings.append(_finding("duplicate_content", path=path, detail=f"same bytes as {keep}",
+                                         repair=movable(path) if fixable else None))
+
+    stats = {"songs": len(songs), "files": len(files), "hashed": len(hashes),
+             "probed": len(audio) if probe else 0, "seconds": round(time.time() - started, 2)}
+    return {"findings": findings, "stats": stats}
+
+
+def _is_catalog_file(path):
+    name = os.path.basename(path)
+    return name.endswith(TRACK_SUFFIXES) or _lyrics_song(name) is not None
+
+
+def _keeper(paths):
+    """The copy to keep: catalog-named first, then the shortest (least "- Copy") name"""
+    return min(paths, key=lambda p: (not _is_catalog_file(p), len(os.path.basename(p)), p))
+
+
+# =============== REPAIR ===============
+def repair(media_dir, db_path, report, base_dir=None):
+    """Apply the safe repairs of a report; returns the list of actions taken"""
+    base_dir = base_dir or os.path.dirname(os.path.abspath(media_dir))
+    quarantine = os.path.join(media_dir, "lost+found", time.strftime("%Y%m%d-%H%M%S"))
+    actions = []
+
+    def move(path):
+        rel = os.path.relpath(path, media_dir)
+        target = os.path.join(quarantine, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+        actions.append(f"moved {rel} -> {os.path.relpath(target, media_dir)}")
+
+    def backup(path):
+        os.makedirs(quarantine, exist_ok=True)
+        shutil.copy2(path, os.path.join(quarantine, os.path.basename(path)))
+
+    by_repair = defaultdict(list)
+    for f in report["findings"]:
+        if f["repair"]:
+            by_repair[f["repair"]].append(f)
+
+    for f in by_repair["quarantine"]:
+        if f["path"] and os.path.exists(f["path"]):
+            move(f["path"])
+
+    rows = [("shared_links", f["song"]) for f in by_repair["delete_shared_row"]] + \
+           [("metadata", f["song"]) for f in by_repair["delete_metadata_row"]]
+    if rows and os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                for table, song in rows:
+                    conn.execute(f"DELETE FROM {table} WHERE song_name = ?", (song,))
+                    actions.append(f"deleted {table} row {song!r}")
+        finally:
+            conn.close()
+
+    dropped = {f["song"] for f in by_repair["drop_metadata_entry"]}
+    metadata_path = os.path.join(media_dir, "song_metadata.json")
+    if dropped and os.path.exists(metadata_path):
+        backup(metadata_path)
+        with open(metadata_path) as f:
+            data = json.load(f)
+        with open(metadata_path, "w") as f:
+            json.dump({k: v for k, v in data.items() if k not in dropped}, f, indent=2)
+        actions.extend(f"dropped song_metadata.json entry {song!r}" for song in sorted(dropped))
+
+    stale_ids = {f["detail"].split(":", 1)[0] for f in by_repair["drop_legacy_entry"]}
+    legacy_path = os.path.join(base_dir, "songs_db.json")
+    if stale_ids and os.path.exists(legacy_path):
+        backup(legacy_path)
+        with open(legacy_path) as f:
+            legacy = json.load(f)
+        with open(legacy_path, "w") as f:
+            json.dump([e for e in legacy if str(e.get("id")) not in stale_ids], f, indent=2)
+        actions.append(f"dropped {len(stale_ids)} stale songs_db.json entries")
+    return actions
+
+
+def print_report(report, out=sys.stdout):
+    groups = defaultdict(list)
+    for f in report["findings"]:
+        groups[f["kind"]].append(f)
+    for kind in sorted(groups):
+        print(f"{kind} ({len(groups[kind])})", file=out)
+        for f in groups[kind]:
+            what = f["path"] or f["song"]
+            extra = f" -- {f['detail']}" if f["detail"] else ""
+            fix = f" [repair: {f['repair']}]" if f["repair"] else ""
+            print(f"  - {what}{extra}{fix}", file=out)
+    stats = report["stats"]
+    print(f"{stats['songs']} songs, {stats['files']} files, {stats['hashed']} hashed, "
+          f"{stats['probed']} probed in {stats['seconds']}s: {len(report['findings'])} finding(s)", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the media tree against the catalog")
+    parser.add_argument("--media-dir", default=os.path.join(os.getcwd(), "media"))
+    parser.add_argument("--db", default=os.path.join(os.getcwd(), "session_data.db"))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-probe", action="store_true", help="skip the ffprobe audio check")
+    parser.add_argument("--repair", action="store_true", help="apply the safe repairs")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = check(args.media_dir, args.db, workers=args.workers, probe=not args.no_probe)
+    if args.repair:
+        report["actions"] = repair(args.media_dir, args.db, report)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+        for action in report.get("actions", []):
+            print(f"repair: {action}")
+    return 1 if report["findings"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
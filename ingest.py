@@ -0,0 +1,323 @@
+"""Ingest-time analysis for uploaded songs.
+
+``ingest_song()`` runs once per upload (on the job queue).  Each track is
+decoded a single time and the PCM blocks are fed to every analyzer, which
+then writes a small derived artifact under ``analysis/`` so pages never
+have to decode audio themselves:
+
+* ``analysis/<song>_<kind>.peaks`` -- duration, sample rate, bitrate and a
+  multi-resolution waveform (see waveform.py)
+* ``analysis/<song>_<kind>.loudness.json`` -- integrated loudness, true
+  peak and ReplayGain-style gain (see loudness.py)
+* ``analysis/<song>_original.fp`` -- acoustic fingerprint, also added to
+  the duplicate-detection index (see fingerprint.py)
+* ``analysis/<song>_original.pitch`` -- pitch contour of the lead vocal,
+  the reference for take scoring (see pitch.py)
+* ``analysis/<song>_original.preview.<ext>`` -- short low-bitrate clip of
+  the chorus for the song listings (see preview.py)
+* ``analysis/<song>_<kind>.segments.json`` -- manifest of the fMP4 chunks
+  under ``segments/`` the player streams from (see segments.py)
+
+for kind in original/accompaniment.  Songs uploaded without a backing track
+first get an approximate ``songs/<song>_accompaniment.mp3`` extracted from
+the stereo original (see separation.py).  Extraction and analysis read
+the same decoded PCM from pcm_cache.py, so each track is decoded once.
+"""
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+import audio_io
+import fingerprint
+import loudness
+import media_storage
+import pcm_cache
+import pitch
+import preview
+import segments
+import separation
+import shared_state
+import waveform
+from spectral import StreamingStft
+
+TRACK_KINDS = ("original", "accompaniment")
+
+
+def track_key(song_name, kind):
+    return f"songs/{song_name}_{kind}.mp3"
+
+
+def sidecar_key(song_name, kind, ext):
+    return f"analysis/{song_name}_{kind}.{ext}"
+
+
+# =============== ANALYZERS ===============
+class WaveformAnalyzer:
+    """Peaks + exact duration sidecar"""
+    name = "waveform"
+    artifact = "peaks"
+    kinds = TRACK_KINDS
+
+    def __init__(self, info, channels):
+        self.info = info
+        self.acc = waveform.PeakAccumulator()
+
+    def add(self, block):
+        self.acc.add(block)
+
+    def finish(self, storage, song_name, kind, media_dir):
+        info, data = waveform.sidecar_from_accumulator(self.acc, self.info)
+        storage.put(sidecar_key(song_name, kind, self.artifact), data, "application/octet-stream")
+        return {"duration": round(info["duration"], 3), "sample_rate": info["sample_rate"],
+                "bitrate": info["bitrate"], "bytes": len(data)}
+
+
+class LoudnessAnalyzer:
+    """EBU R128 integrated loudness and true peak"""
+    name = "loudness"
+    artifact = "loudness.json"
+    kinds = TRACK_KINDS
+
+    def __init__(self, info, channels):
+        self.meter = loudness.LoudnessMeter(info["sample_rate"], channels)
+
+    def add(self, block):
+        self.meter.add(block)
+
+    def finish(self, storage, song_name, kind, media_dir):
+        stats = self.meter.result()
+        stats["gain_db"] = loudness.gain_db(stats)
+        storage.put(sidecar_key(song_name, kind, self.artifact),
+                    json.dumps(stats).encode(), "application/json")
+        return stats
+
+
+class FingerprintAnalyzer:
+    """Landmark fingerprint of the original, indexed for duplicate lookups"""
+    name = "fingerprint"
+    artifact = "fp"
+    kinds = ("original",)
+
+    def __init__(self, info, channels):
+        self.acc = fingerprint.FingerprintAccumulator(info["sample_rate"])
+
+    def add(self, block):
+        self.acc.add(block)
+
+    def finish(self, storage, song_name, kind, media_dir):
+        hashes, offsets = fingerprint.landmark_hashes(*fingerprint.find_peaks(self.acc.spectrogram()))
+        storage.put(sidecar_key(song_name, kind, self.artifact),
+                    fingerprint.encode_fingerprint(hashes, offsets), "application/octet-stream")
+        fingerprint.add_to_index(fingerprint.index_path(media_dir), song_name, hashes, offsets)
+        return {"hashes": int(len(hashes))}
+
+
+class PitchAnalyzer:
+    """Reference vocal pitch contour of the original"""
+    name = "pitch"
+    artifact = "pitch"
+    kinds = ("original",)
+    # Everything above this is removed by the isolation pass, so decimating is alias-free
+    max_hz = 3500.0
+
+    def __init__(self, info, channels):
+        sample_rate = info["sample_rate"]
+        # Largest factor down towards pitch.SAMPLE_RATE that keeps the hop a whole number of samples
+        hops_per_second = int(round(1 / pitch.HOP_SECONDS))
+        self.decimation = next((d for d in range(max(1, sample_rate // pitch.SAMPLE_RATE), 0, -1)
+                                if sample_rate % (d * hops_per_second) == 0), 1)
+        self.sample_rate = sample_rate / self.decimation
+        self.stft = None
+        if channels == 2:
+            self.stft = StreamingStft(separation.centre_isolation(sample_rate, self.max_hz), 2,
+                                      frame_size=separation.FRAME_SIZE, overlap=separation.OVERLAP)
+        self.parts = []
+        self._phase = 0
+
+    def _keep(self, mono):
+        # Decimate across block boundaries
+        self.parts.append(mono[self._phase::self.decimation])
+        self._phase = (self._phase - len(mono)) % self.decimation
+
+    def add(self, block):
+        if self.stft is None:
+            self._keep(block.mean(axis=1))
+        else:
+            self._keep(self.stft.process(block)[:, 0])
+
+    def finish(self, storage, song_name, kind, media_dir):
+        if self.stft is not None:
+            self._keep(self.stft.flush()[:, 0])
+        samples = np.concatenate(self.parts) if self.parts else np.zeros(0, np.float32)
+        f0, _ = pitch.yin(samples, self.sample_rate)
+        storage.put(sidecar_key(song_name, kind, self.artifact), pitch.encode_contour(f0),
+                    "application/octet-stream")
+        return {"frames": int(len(f0)), "voiced": round(float((f0 > 0).mean()) if len(f0) else 0.0, 3)}
+
+
+class PreviewAnalyzer:
+    """Chorus preview clip cut from the original"""
+    name = "preview"
+    artifact = f"preview.{preview.codec_settings()['ext']}"
+    kinds = ("original",)
+
+    def __init__(self, info, channels):
+        self.info = info
+        self.features = preview.PreviewFeatures(info["sample_rate"])
+
+    def add(self, block):
+        self.features.add(block)
+
+    def finish(self, storage, song_name, kind, media_dir):
+        start = preview.preview_start(self.features.features(), self.info["duration"])
+        fd, tmp_path = tempfile.mkstemp(suffix="." + self.artifact.rsplit(".", 1)[1])
+        os.close(fd)
+        try:
+            preview.cut_preview(storage.local_path(track_key(song_name, kind)), tmp_path, start)
+            with open(tmp_path, "rb") as f:
+                storage.put(sidecar_key(song_name, kind, self.artifact), f,
+                            preview.codec_settings()["mime"])
+            size = os.path.getsize(tmp_path)
+        finally:
+            os.remove(tmp_path)
+        return {"start": round(start, 1), "bytes": size}
+
+
+class SegmentAnalyzer:
+    """fMP4 chunks + playlist for streaming playback, encoded from the same PCM"""
+    name = "segments"
+    artifact = "segments.json"
+    kinds = TRACK_KINDS
+
+    def __init__(self, info, channels):
+        self.encoder = segments.SegmentEncoder(info["sample_rate"], channels)
+
+    def add(self, block):
+        self.encoder.add(block)
+
+    def finish(self, storage, song_name, kind, media_dir):
+        digest = pcm_cache.file_hash(storage.local_path(track_key(song_name, kind)))
+        manifest = self.encoder.finish(storage, digest)
+        storage.put(sidecar_key(song_name, kind, self.artifact),
+                    json.dumps(manifest).encode(), "application/json")
+        return {"segments": len(manifest["segments"]), "duration": manifest["duration"]}
+
+
+# Analyzers fed from the single decode pass of every track
+TRACK_ANALYZERS = [WaveformAnalyzer, LoudnessAnalyzer, FingerprintAnalyzer, PitchAnalyzer,
+                   PreviewAnalyzer, SegmentAnalyzer]
+
+
+def analyze_track(storage, song_name, kind, media_dir, analyzers=None):
+    """Decode one track once and run the analyzers over it"""
+    analyzers = [cls for cls in (analyzers or TRACK_ANALYZERS) if kind in cls.kinds]
+    if not analyzers:
+        return {}
+    path = storage.local_path(track_key(song_name, kind))
+    info = audio_io.probe(path)
+    channels = min(2, max(1, info["channels"]))
+    running = [cls(info, channels) for cls in analyzers]
+    for block in pcm_cache.iter_pcm(media_dir, path, info["sample_rate"], channels, info):
+        for analyzer in running:
+            analyzer.add(block)
+    return {analyzer.name: analyzer.finish(storage, song_name, kind, media_dir)
+            for analyzer in running}
+
+
+def ingest_song(media_dir, song_name, stages=None):
+    """Run all (or the named) ingest analyzers for a song; returns a report"""
+    storage = media_storage.storage_from_env(media_dir)
+    analyzers = [cls for cls in TRACK_ANALYZERS if not stages or cls.name in stages]
+    report = {"song": song_name, "stages": {}, "errors": {}}
+
+    if (not stages or "extract" in stages) and needs_extraction(storage, song_name):
+        try:
+            separation.extract_to_storage(storage, track_key(song_name, "original"),
+                                          track_key(song_name, "accompaniment"), media_dir)
+            report["stages"]["extract"] = track_key(song_name, "accompaniment")
+        except Exception as e:
+            report["errors"]["extract"] = f"{type(e).__name__}: {e}"
+
+    for kind in TRACK_KINDS:
+        if not analyzers or not storage.exists(track_key(song_name, kind)):
+            continue
+        try:
+            for name, result in analyze_track(storage, song_name, kind, media_dir, analyzers).items():
+                report["stages"][f"{name}:{kind}"] = result
+        except Exception as e:
+            report["errors"][kind] = f"{type(e).__name__}: {e}"
+    # New sidecars/backing track: drop cached track data in every app worker
+    shared_state.invalidate(media_dir, "tracks")
+    return report
+
+
+def needs_extraction(storage, song_name):
+    return storage.exists(track_key(song_name, "original")) and \
+        not storage.exists(track_key(song_name, "accompaniment"))
+
+
+def missing_analysis(storage, songs):
+    """Songs without a backing track or lacking one of the analyzer artifacts"""
+    missing = []
+    for song_name in songs:
+        if needs_extraction(storage, song_name):
+            missing.append(song_name)
+            continue
+        if any(storage.exists(track_key(song_name, kind)) and
+               not storage.exists(sidecar_key(song_name, kind, cls.artifact))
+               for cls in TRACK_ANALYZERS for kind in cls.kinds):
+            missing.append(song_name)
+    return missing
+
+
+# =============== READERS ===============
+def load_track_info(storage, song_name, kind="original"):
+    """Duration/sample rate/bitrate from the sidecar header, or None"""
+    key = sidecar_key(song_name, kind, "peaks")
+    try:
+        return waveform.decode_header(storage.open_range(key, 0, 4 + waveform.HEADER.size - 1))
+    except (media_storage.StorageError, ValueError, struct.error):
+        return None
+
+
+def load_peaks(storage, song_name, kind="original", width=600):
+    """Flat [min, max, ...] list of `width` peaks for drawing, or []"""
+    try:
+        _, levels = waveform.decode_sidecar(storage.get(sidecar_key(song_name, kind, "peaks")))
+    except (media_storage.StorageError, ValueError, struct.error):
+        return []
+    return waveform.peaks_for_width(levels, width)
+
+
+def load_loudness(storage, song_name, kind="original"):
+    try:
+        return json.loads(storage.get(sidecar_key(song_name, kind, "loudness.json")))
+    except (media_storage.StorageError, ValueError):
+        return None
+
+
+def load_gains(storage, song_name):
+    """Matched playback gains {'original': x, 'accompaniment': y} (linear)"""
+    return loudness.matched_gains(load_loudness(storage, song_name, "original"),
+                                  load_loudness(storage, song_name, "accompaniment"))
+
+
+def preview_key(storage, song_name):
+    """Storage key of the song's preview clip, or '' if it has none yet"""
+    key = sidecar_key(song_name, "original", PreviewAnalyzer.artifact)
+    return key if storage.exists(key) else ""
+
+
+def load_segments(storage, song_name, kind):
+    """Segment manifest of a track (keys, not URLs), or None before ingest"""
+    return segments.load_manifest(storage, sidecar_key(song_name, kind, SegmentAnalyzer.artifact))
+
+
+def format_duration(seconds):
+    if not seconds:
+        return ""
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
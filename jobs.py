@@ -0,0 +1,138 @@
+"""Background worker pool for ingest, analysis and render jobs.
+
+Jobs run in a process pool (spawned, so they never inherit Streamlit's
+threads) and are identified by a key such as ``ingest:<song>``; submitting a
+key that is already queued or running returns the existing job instead of
+doing the work twice.  Output files a job names in ``protect`` are shielded
+from the media sweeper until the job finishes.
+
+With a ``board`` (shared_state.JobBoard) every status change is also
+published host-wide, and ``get`` falls back to it for jobs submitted by
+another process -- needed when several media_server workers take polls.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import media_lifecycle
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_HISTORY = 200
+
+
+class JobQueue:
+    def __init__(self, max_workers=JOB_WORKERS, use_processes=True, board=None):
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.board = board
+        self.executor = self._make_executor()
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def _make_executor(self):
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.max_workers,
+                                       mp_context=multiprocessing.get_context("spawn"))
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+
+    def submit(self, key, fn, *args, protect=(), **kwargs):
+        """Queue fn(*args, **kwargs) under key; returns the job record"""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job and job["status"] in ("queued", "running"):
+                return job
+            job = {"key": key, "status": "queued", "submitted": time.time(),
+                   "finished": None, "result": None, "error": None,
+                   "protect": tuple(protect), "attached": threading.Event()}
+            self._jobs[key] = job
+            self._trim()
+
+        for path in job["protect"]:
+            media_lifecycle.protect_path(path)
+        try:
+            try:
+                future = self.executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed); start a fresh pool
+                self.executor = self._make_executor()
+                future = self.executor.submit(fn, *args, **kwargs)
+        except Exception as e:
+            job["error"] = f"{type(e).__name__}: {e}"
+            job["status"] = "failed"
+            job["finished"] = time.time()
+            self._publish(job)
+            job["attached"].set()
+            for path in job["protect"]:
+                media_lifecycle.release_path(path)
+            raise
+        job["future"] = future
+        job["status"] = "running"
+        job["attached"].set()
+        self._publish(job)
+        future.add_done_callback(lambda f, job=job: self._done(job, f))
+        return job
+
+    def _done(self, job, future):
+        try:
+            job["result"] = future.result()
+            job["status"] = "done"
+        except Exception as e:
+            job["error"] = f"{type(e).__name__}: {e}"
+            job["status"] = "failed"
+        job["finished"] = time.time()
+        self._publish(job)
+        for path in job["protect"]:
+            media_lifecycle.release_path(path)
+
+    def _publish(self, job):
+        if self.board:
+            self.board.publish(job)
+
+    def _trim(self):
+        finished = [k for k, j in self._jobs.items() if j["status"] in ("done", "failed")]
+        for k in finished[:max(0, len(self._jobs) - JOB_HISTORY)]:
+            del self._jobs[k]
+
+    def get(self, key):
+        job = self._jobs.get(key)
+        if job is None and self.board:
+            return self.board.get(key)
+        return job
+
+    def wait(self, key, timeout=None):
+        """Block until a job finishes and return its result (raises on failure)"""
+        job = self._jobs.get(key)
+        if not job:
+            return None
+        started = time.monotonic()
+        # A concurrent submit() may not have handed the job to the pool yet
+        if not job["attached"].wait(timeout):
+            raise TimeoutError(f"{key} was not started within {timeout}s")
+        if "future" not in job:
+            raise RuntimeError(job["error"])
+        remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+        return job["future"].result(timeout=remaining)
+
+    def jobs(self):
+        with self._lock:
+            return [{k: v for k, v in j.items() if k not in ("future", "attached")} for j in self._jobs.values()]
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j["status"] in ("queued", "running"))
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue(board=None):
+    """Process-wide job queue (board: only used when it is first created)"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(board=board)
+        return _queue
@@ -0,0 +1,175 @@
+"""EBU R128 / ITU-R BS.1770 loudness and true-peak measurement in numpy.
+
+The K-weighting filter is applied in the frequency domain: PCM is cut into
+100 ms sub-blocks, each is transformed with a batched rfft and its power
+spectrum is weighted by |H(f)|^2 of the BS.1770 pre-filter and RLB
+high-pass.  By Parseval that gives the K-weighted mean square of every
+sub-block without a sample-by-sample IIR loop.  Four consecutive sub-blocks
+form the 400 ms / 75 % overlap gating blocks of the standard.
+
+True peak uses 4x FFT oversampling over overlapping windows.
+"""
+import numpy as np
+
+SUB_BLOCK_SECONDS = 0.1
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+TARGET_LUFS = -18.0       # ReplayGain 2.0 reference level
+TRUE_PEAK_CEILING = -1.0  # dBTP headroom kept when boosting quiet tracks
+OVERSAMPLE = 4
+TP_WINDOW = 8192
+TP_MARGIN = 64
+
+
+def _biquad_power(b, a, freqs, sample_rate):
+    z = np.exp(-1j * 2 * np.pi * freqs / sample_rate)
+    num = b[0] + b[1] * z + b[2] * z * z
+    den = a[0] + a[1] * z + a[2] * z * z
+    return np.abs(num / den) ** 2
+
+
+def k_weighting_power(freqs, sample_rate):
+    """|H(f)|^2 of the BS.1770 K-weighting (shelf + RLB high-pass)"""
+    # High shelf, +4 dB above ~1.5 kHz
+    gain_db, q, fc = 4.0, 1 / np.sqrt(2), 1500.0
+    A = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    shelf_b = (A * ((A + 1) + (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha),
+               -2 * A * ((A - 1) + (A + 1) * cos_w0),
+               A * ((A + 1) + (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha))
+    shelf_a = ((A + 1) - (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha,
+               2 * ((A - 1) - (A + 1) * cos_w0),
+               (A + 1) - (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha)
+
+    # RLB high-pass at 38 Hz
+    q, fc = 0.5, 38.0
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    hp_b = ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2)
+    hp_a = (1 + alpha, -2 * cos_w0, 1 - alpha)
+
+    return (_biquad_power(shelf_b, shelf_a, freqs, sample_rate)
+            * _biquad_power(hp_b, hp_a, freqs, sample_rate))
+
+
+class LoudnessMeter:
+    """Streaming integrated loudness / true peak meter"""
+
+    def __init__(self, sample_rate, channels):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sub = int(round(sample_rate * SUB_BLOCK_SECONDS))
+
+        freqs = np.fft.rfftfreq(self.sub, 1.0 / sample_rate)
+        # Parseval weights for a one-sided spectrum, folded into the filter
+        parseval = np.full(len(freqs), 2.0)
+        parseval[0] = 1.0
+        if self.sub % 2 == 0:
+            parseval[-1] = 1.0
+        self._weights = (k_weighting_power(freqs, sample_rate) * parseval
+                         / float(self.sub) ** 2).astype(np.float64)
+
+        self._carry = np.zeros((0, channels), dtype=np.float32)
+        self._powers = []
+        self._tp_buffer = np.zeros((TP_MARGIN, channels), dtype=np.float32)
+        self.true_peak = 0.0
+        self.sample_peak = 0.0
+        self.frames = 0
+
+    def add(self, block):
+        if block.ndim == 1:
+            block = block[:, None]
+        block = block.astype(np.float32, copy=False)
+        self.frames += len(block)
+        if len(block):
+            self.sample_peak = max(self.sample_peak, float(np.abs(block).max()))
+
+        buf = np.concatenate([self._carry, block])
+        usable = len(buf) - len(buf) % self.sub
+        if usable:
+            frames = buf[:usable].reshape(-1, self.sub, self.channels)
+            spectrum = np.fft.rfft(frames, axis=1)
+            power = (np.abs(spectrum) ** 2 * self._weights[None, :, None]).sum(axis=1)
+            # Channel weights are 1.0 for L/R (and mono)
+            self._powers.append(power.sum(axis=1))
+        self._carry = buf[usable:]
+
+        self._true_peak_pass(block)
+
+    def _true_peak_pass(self, block, final=False):
+        buf = np.concatenate([self._tp_buffer, block])
+        span = TP_WINDOW + 2 * TP_MARGIN
+        if final:
+            pad = (-(len(buf) - 2 * TP_MARGIN)) % TP_WINDOW + TP_MARGIN
+            buf = np.concatenate([buf, np.zeros((pad, self.channels), np.float32)])
+        count = (len(buf) - 2 * TP_MARGIN) // TP_WINDOW
+        if count > 0:
+            windows = np.lib.stride_tricks.sliding_window_view(buf, span, axis=0)
+            windows = windows[::TP_WINDOW][:count]          # (count, channels, span)
+            spectrum = np.fft.rfft(windows, axis=-1)
+            upsampled = np.fft.irfft(spectrum, n=span * OVERSAMPLE, axis=-1) * OVERSAMPLE
+            core = upsampled[..., TP_MARGIN * OVERSAMPLE:(TP_MARGIN + TP_WINDOW) * OVERSAMPLE]
+            self.true_peak = max(self.true_peak, float(np.abs(core).max()))
+        self._tp_buffer = buf[count * TP_WINDOW:] if not final else buf[:0]
+
+    def result(self):
+        if len(self._tp_buffer) > TP_MARGIN:
+            self._true_peak_pass(np.zeros((0, self.channels), np.float32), final=True)
+        true_peak = max(self.true_peak, self.sample_peak)
+        powers = np.concatenate(self._powers) if self._powers else np.zeros(0)
+        return {
+            "integrated_lufs": integrated_loudness(powers),
+            "true_peak_dbtp": _to_db(true_peak),
+            "sample_peak_dbfs": _to_db(self.sample_peak),
+        }
+
+
+def _to_db(amplitude):
+    return round(float(20 * np.log10(amplitude)), 2) if amplitude > 0 else None
+
+
+def integrated_loudness(sub_block_powers):
+    """Gated integrated loudness (LUFS) from 100 ms sub-block mean squares"""
+    if len(sub_block_powers) < 4:
+        return None
+    # 400 ms gating blocks with 75 % overlap = mean of 4 consecutive sub-blocks
+    kernel = np.lib.stride_tricks.sliding_window_view(sub_block_powers, 4)
+    blocks = kernel.mean(axis=1)
+    with np.errstate(divide="ignore"):
+        block_lufs = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[block_lufs > ABSOLUTE_GATE_LUFS]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE_LU
+    gated = blocks[(block_lufs > ABSOLUTE_GATE_LUFS) & (block_lufs > relative_gate)]
+    if not len(gated):
+        return None
+    return round(float(-0.691 + 10 * np.log10(gated.mean())), 2)
+
+
+def gain_db(stats, target_lufs=TARGET_LUFS, ceiling_dbtp=TRUE_PEAK_CEILING):
+    """ReplayGain-style gain to bring a track to target without clipping"""
+    if not stats or stats.get("integrated_lufs") is None:
+        return 0.0
+    gain = target_lufs - stats["integrated_lufs"]
+    if stats.get("true_peak_dbtp") is not None:
+        gain = min(gain, ceiling_dbtp - stats["true_peak_dbtp"])
+    return round(gain, 2)
+
+
+def matched_gains(original_stats, accompaniment_stats, target_lufs=TARGET_LUFS):
+    """Linear gains (<= 1.0) for original and accompaniment playback.
+
+    Both tracks are brought to the same loudness, then shifted down together
+    so neither needs amplification (HTML media volume cannot exceed 1.0).
+    """
+    g_orig = gain_db(original_stats, target_lufs)
+    g_acc = gain_db(accompaniment_stats, target_lufs)
+    shift = max(g_orig, g_acc, 0.0)
+    return {
+        "original": round(10 ** ((g_orig - shift) / 20), 4),
+        "accompaniment": round(10 ** ((g_acc - shift) / 20), 4),
+    }
@@ -0,0 +1,115 @@
+"""Time-synced lyrics (LRC) for the Song Player.
+
+Supports plain LRC (``[mm:ss.xx] line``, several time tags per line,
+``[offset:+/-ms]``) and the enhanced word-timed form
+(``[mm:ss.xx] <mm:ss.xx> word <mm:ss.xx> word``).  A song's lyrics are kept
+as the uploaded text under ``lyrics/<song>.lrc``; the player gets a compact
+JSON track of ``[time, text, [[word_time, word], ...]]`` rows, a few KB
+instead of a full-size lyrics image.
+"""
+import re
+
+import media_storage
+
+TIME_TAG = re.compile(r"\[(\d{1,3}):(\d{1,2}(?:[.:]\d{1,3})?)\]")
+WORD_TAG = re.compile(r"<(\d{1,3}):(\d{1,2}(?:[.:]\d{1,3})?)>")
+OFFSET_TAG = re.compile(r"^\[offset:\s*([+-]?\d+)\]", re.IGNORECASE)
+MAX_LRC_BYTES = 256 * 1024
+
+
+class LyricsError(ValueError):
+    pass
+
+
+def lyrics_key(song_name):
+    return f"lyrics/{song_name}.lrc"
+
+
+def _seconds(minutes, seconds):
+    return int(minutes) * 60 + float(seconds.replace(":", "."))
+
+
+def _words(body, offset):
+    """Split an enhanced-LRC body into [[time, word], ...] (empty if untimed)"""
+    parts = WORD_TAG.split(body)
+    words = []
+    # parts = [before, m, s, text, m, s, text, ...]
+    for i in range(1, len(parts) - 2, 3):
+        text = parts[i + 2].strip()
+        if text:
+            words.append([round(_seconds(parts[i], parts[i + 1]) + offset, 3), text])
+    return words
+
+
+def parse_lrc(text):
+    """Parse LRC text into sorted [time, line, words] rows"""
+    offset = 0.0
+    rows = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        match = OFFSET_TAG.match(line)
+        if match:
+            # Positive offsets make lyrics appear sooner
+            offset = -int(match.group(1)) / 1000.0
+            continue
+        times = []
+        pos = 0
+        while True:
+            tag = TIME_TAG.match(line, pos)
+            if not tag:
+                break
+            times.append(_seconds(tag.group(1), tag.group(2)))
+            pos = tag.end()
+        if not times:
+            continue
+        body = line[pos:]
+        words = _words(body, offset)
+        display = " ".join(w for _, w in words) if words else body.strip()
+        for t in times:
+            rows.append([round(max(0.0, t + offset), 3), display, words])
+    if not rows:
+        raise LyricsError("No timed lines found; expected LRC lines like [01:23.45] lyrics")
+    rows.sort(key=lambda r: r[0])
+    return rows
+
+
+def decode_upload(data):
+    """Uploaded bytes -> LRC text (UTF-8, with a cp1252 fallback)"""
+    if len(data) > MAX_LRC_BYTES:
+        raise LyricsError("Lyrics file is too large")
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1252", errors="replace")
+
+
+def save_lyrics(storage, song_name, text):
+    """Validate and store LRC text; returns the number of timed lines"""
+    rows = parse_lrc(text)
+    storage.put(lyrics_key(song_name), text.encode("utf-8"), "text/plain; charset=utf-8")
+    return len(rows)
+
+
+def load_lyrics(storage, song_name):
+    """Parsed rows for a song, or [] when it has no (valid) timed lyrics"""
+    try:
+        return parse_lrc(storage.get(lyrics_key(song_name)).decode("utf-8"))
+    except (media_storage.StorageError, LyricsError, UnicodeDecodeError):
+        return []
+
+
+def _srt_time(seconds):
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def to_srt(rows, tempo=1.0, hold_seconds=6.0):
+    """SRT subtitles for the rows (times divided by the playback tempo)"""
+    out = []
+    for i, (start, text, _) in enumerate(rows):
+        if not text:
+            continue
+        end = rows[i + 1][0] if i + 1 < len(rows) else start + hold_seconds
+        end = min(end, start + hold_seconds)
+        out.append(f"{len(out) + 1}\n{_srt_time(start / tempo)} --> {_srt_time(end / tempo)}\n{text}\n")
+    return "\n".join(out)
@@ -0,0 +1,304 @@
+"""Retention and garbage collection for generated media.
+
+`media/temp` (recording scratch files, ``rec_*`` / ``temp_play_*``) and
+`media/finals` (``final_*`` renders) only ever grow.  This module applies a
+per-directory retention policy to them:
+
+* files older than the policy TTL are removed,
+* if the directory is still over its byte quota, the least recently used
+  files (by access time) are evicted until it fits,
+* files that are protected -- held by a running job or belonging to a song
+  that an active session is on -- are never touched.
+
+Which song a file belongs to is recorded when it is written
+(``record_owner``, a hidden ``.<name>.owner`` file next to it), since
+neither ``final_<uuid>`` renders nor sanitized take names reliably contain
+the song name.
+
+Every sweep produces a report; ``dry_run=True`` only builds the report.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class RetentionPolicy:
+    """Retention rules for a single directory"""
+
+    def __init__(self, name, directory, ttl_seconds=None, max_bytes=None, prefixes=None):
+        self.name = name
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # Only files whose name starts with one of these prefixes are managed
+        self.prefixes = tuple(prefixes) if prefixes else None
+
+    def manages(self, filename):
+        if filename.startswith("."):
+            return False
+        return self.prefixes is None or filename.startswith(self.prefixes)
+
+
+# =============== PROTECTION REGISTRY ===============
+_protect_lock = threading.Lock()
+_protected = {}
+
+
+def protect_path(path):
+    """Mark a file as in use so sweeps skip it (reference counted)"""
+    path = os.path.abspath(path)
+    with _protect_lock:
+        _protected[path] = _protected.get(path, 0) + 1
+
+
+def release_path(path):
+    """Drop one protection reference taken with protect_path()"""
+    path = os.path.abspath(path)
+    with _protect_lock:
+        count = _protected.get(path, 0) - 1
+        if count > 0:
+            _protected[path] = count
+        else:
+            _protected.pop(path, None)
+
+
+@contextmanager
+def protected(*paths):
+    """Protect files for the duration of a with-block (e.g. a render job)"""
+    for p in paths:
+        protect_path(p)
+    try:
+        yield
+    finally:
+        for p in paths:
+            release_path(p)
+
+
+def protected_paths():
+    with _protect_lock:
+        return set(_protected)
+
+
+def _owner_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.owner")
+
+
+def record_owner(path, song_name):
+    """Remember which song a generated file belongs to"""
+    try:
+        with open(_owner_path(path), "w", encoding="utf-8") as f:
+            f.write(song_name)
+    except OSError:
+        pass
+
+
+def read_owner(path):
+    try:
+        with open(_owner_path(path), encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def touch(path):
+    """Record an access so LRU eviction sees the file as recently used"""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+# =============== PLANNING ===============
+def scan_directory(policy):
+    """Return [(path, size, last_used)] for the files a policy manages"""
+    entries = []
+    if not os.path.isdir(policy.directory):
+        return entries
+    with os.scandir(policy.directory) as it:
+        for entry in it:
+            if not entry.is_file(follow_symlinks=False) or not policy.manages(entry.name):
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            # Many mounts use relatime, so atime alone can lag behind a write
+            last_used = max(st.st_atime, st.st_mtime)
+            entries.append((entry.path, st.st_size, last_used))
+    return entries
+
+
+def _is_protected(path, protected_set, protected_songs):
+    if os.path.abspath(path) in protected_set:
+        return True
+    return bool(protected_songs) and read_owner(path) in protected_songs
+
+
+def plan_policy(policy, now=None, protected_set=None, protected_songs=()):
+    """Decide which files of one directory to delete, without touching disk"""
+    now = time.time() if now is None else now
+    protected_set = protected_paths() if protected_set is None else protected_set
+
+    entries = scan_directory(policy)
+    total_bytes = sum(size for _, size, _ in entries)
+    deletions = []
+    kept = []
+    skipped = 0
+
+    for path, size, last_used in entries:
+        if _is_protected(path, protected_set, protected_songs):
+            skipped += 1
+            continue
+        age = now - last_used
+        if policy.ttl_seconds is not None and age > policy.ttl_seconds:
+            deletions.append({"path": path, "bytes": size, "age": age, "reason": "ttl"})
+        else:
+            kept.append((path, size, last_used))
+
+    remaining = total_bytes - sum(d["bytes"] for d in deletions)
+    if policy.max_bytes is not None and remaining > policy.max_bytes:
+        # Least recently used first
+        kept.sort(key=lambda e: e[2])
+        for path, size, last_used in kept:
+            if remaining <= policy.max_bytes:
+                break
+            deletions.append({"path": path, "bytes": size, "age": now - last_used, "reason": "quota"})
+            remaining -= size
+
+    return {
+        "policy": policy.name,
+        "directory": policy.directory,
+        "files": len(entries),
+        "total_bytes": total_bytes,
+        "protected": skipped,
+        "deletions": deletions,
+        "freed_bytes": sum(d["bytes"] for d in deletions),
+        "remaining_bytes": remaining,
+        "quota_bytes": policy.max_bytes,
+    }
+
+
+def _drop_orphan_owners(directory):
+    """Owner records of files that were removed some other way"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(".") and name.endswith(".owner") and name[1:-len(".owner")] not in names:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def sweep(policies, dry_run=True, protected_songs=()):
+    """Plan (and unless dry_run, apply) all policies; returns a report"""
+    started = time.time()
+    protected_set = protected_paths()
+    protected_songs = set(protected_songs)
+    report = {"dry_run": dry_run, "started": started, "policies": [], "errors": []}
+
+    for policy in policies:
+        plan = plan_policy(policy, now=started, protected_set=protected_set,
+                           protected_songs=protected_songs)
+        if not dry_run:
+            for d in plan["deletions"]:
+                # A job may have picked the file up since the plan was made
+                if os.path.abspath(d["path"]) in protected_paths():
+                    d["reason"] = "skipped"
+                    continue
+                try:
+                    os.remove(d["path"])
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    d["reason"] = "error"
+                    report["errors"].append(f"{d['path']}: {e}")
+                    continue
+                try:
+                    os.remove(_owner_path(d["path"]))
+                except OSError:
+                    pass
+            plan["freed_bytes"] = sum(d["bytes"] for d in plan["deletions"]
+                                      if d["reason"] in ("ttl", "quota"))
+            _drop_orphan_owners(policy.directory)
+        report["policies"].append(plan)
+
+    report["freed_bytes"] = sum(p["freed_bytes"] for p in report["policies"])
+    report["duration"] = time.time() - started
+    return report
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024.0
+
+
+def report_rows(report):
+    """Flatten a sweep report into table rows for display"""
+    rows = []
+    for plan in report["policies"]:
+        for d in plan["deletions"]:
+            rows.append({
+                "directory": plan["policy"],
+                "file": os.path.basename(d["path"]),
+                "size": format_bytes(d["bytes"]),
+                "age_hours": round(d["age"] / 3600, 1),
+                "reason": d["reason"],
+            })
+    return rows
+
+
+# =============== BACKGROUND SWEEPER ===============
+class Sweeper(threading.Thread):
+    """Daemon thread that applies the retention policies periodically"""
+
+    def __init__(self, policies, interval_seconds=900, protected_songs_provider=None):
+        super().__init__(name="media-sweeper", daemon=True)
+        self.policies = policies
+        self.interval_seconds = interval_seconds
+        self.protected_songs_provider = protected_songs_provider
+        self.last_report = None
+        self._stop_event = threading.Event()
+
+    def run_once(self, dry_run=False):
+        songs = ()
+        if self.protected_songs_provider:
+            try:
+                songs = tuple(self.protected_songs_provider())
+            except Exception:
+                songs = ()
+        report = sweep(self.policies, dry_run=dry_run, protected_songs=songs)
+        if not dry_run:
+            self.last_report = report
+        return report
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once(dry_run=False)
+            except Exception:
+                pass
+            self._stop_event.wait(self.interval_seconds)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start_sweeper(policies, interval_seconds=900, protected_songs_provider=None):
+    """Start the process-wide sweeper once; later calls return the same thread"""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None or not _sweeper.is_alive():
+            _sweeper = Sweeper(policies, interval_seconds, protected_songs_provider)
+            _sweeper.start()
+        return _sweeper
@@ -0,0 +1,371 @@
+"""Small HTTP side-car for the Streamlit app (Starlette).
+
+Streamlit cannot serve arbitrary files or accept uploads from inside the
+player iframe, so this process handles the byte-heavy traffic:
+
+* ``GET  /media/{key}``      -- song media from LocalStorage (only the
+                               ``MEDIA_PREFIXES`` keys) streamed with HTTP
+                               Range support; every URL must carry a valid
+                               ``expires``/``sig`` from ``LocalStorage.url_for``
+* ``POST /api/takes``        -- raw audio body of a finished take
+                               (``?song=&expires=&token=&tempo=``, a
+                               ``record``-scope token); queues the MP4
+                               render and returns the job id
+* ``POST /api/scores``       -- raw mic-only recording of the same take
+                               (same token, plus ``key``/``tempo`` of the
+                               backing track); queues the pitch/timing score
+* ``GET  /api/jobs/{job_id}`` -- job status, plus the final video URL or the
+                               score
+* ``POST /api/events``        -- player analytics beacon (JSON body with a
+                               token of either scope), buffered by analytics.py
+* ``GET  /play?song=|share=`` -- standalone guest player for shared songs
+                               (or a signed share token, see sharing.py):
+                               the same page as the Streamlit Song Player,
+                               as plain cacheable HTML with media by URL, so
+                               share-link guests never start a Streamlit
+                               session (point ``GUEST_PLAYER_URL`` here)
+
+Run with::
+
+    uvicorn media_server:app --host 0.0.0.0 --port 8600 --workers 4
+
+Each worker runs its own job pool; job status is published to the shared
+``JobBoard`` (shared_state.py) so ``/api/jobs/{job_id}`` answers from any
+worker.  Workers must therefore share ``SHARED_STATE_DIR`` (one host).
+
+Point the app at it with ``MEDIA_API_URL`` (and ``MEDIA_BASE_URL`` for
+direct media URLs).  Both processes must share ``MEDIA_URL_SECRET``; the
+server refuses to start without it, since every media URL and take token
+it accepts is signed with it.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import threading
+import time
+import uuid
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, Response
+from starlette.routing import Route
+
+import analytics
+import ingest
+import jobs
+import lyrics
+import media_lifecycle
+import media_storage
+import pitch
+import segments
+import player
+import shared_state
+import sharing
+import video_render
+
+base_dir = os.getcwd()
+media_dir = os.path.join(base_dir, "media")
+temp_dir = os.path.join(media_dir, "temp")
+logo_path = os.path.join(media_dir, "logo", "branks3_logo.png")
+shared_links_dir = os.path.join(media_dir, "shared_links")
+session_db_path = os.path.join(base_dir, "session_data.db")
+os.makedirs(temp_dir, exist_ok=True)
+
+MEDIA_URL_SECRET = os.getenv("MEDIA_URL_SECRET", "")
+if not MEDIA_URL_SECRET:
+    raise RuntimeError("media_server needs MEDIA_URL_SECRET (the same value as the app's)")
+SHARE_TOKEN_SECRET = os.getenv("SHARE_TOKEN_SECRET", MEDIA_URL_SECRET)
+CORS_ORIGINS = [o.strip() for o in os.getenv("MEDIA_CORS_ORIGINS", "*").split(",") if o.strip()]
+MAX_TAKE_BYTES = int(os.getenv("MAX_TAKE_MB", "60")) * 1024 * 1024
+MEDIA_CACHE_SECONDS = 3600
+SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# What /media serves; databases, metadata, analysis sidecars and temp files never leave the host
+MEDIA_PREFIXES = ("songs/", "lyrics_images/", "renditions/", "segments/", "finals/")
+MEDIA_URL_TTL_SECONDS = int(os.getenv("MEDIA_URL_TTL_SECONDS", "21600"))
+MEDIA_API_URL = os.getenv("MEDIA_API_URL", "").rstrip("/")
+# Guest pages embed signed URLs, so keep this well below MEDIA_URL_TTL_SECONDS
+GUEST_PAGE_CACHE_SECONDS = int(os.getenv("GUEST_PAGE_CACHE_SECONDS", "60"))
+TAKE_EXTS = {"audio/webm": "webm", "audio/ogg": "ogg", "audio/mp4": "m4a", "audio/mpeg": "mp3",
+             "audio/wav": "wav"}
+
+storage = media_storage.storage_from_env(media_dir)
+events = analytics.EventBuffer(analytics.default_db_path(base_dir))
+share_revocations = sharing.RevocationSet(session_db_path)
+# Bumped by the app and ingest jobs on upload/lyrics/analysis changes (shared_state.py)
+epochs, _ = shared_state.open_state(media_dir)
+# Job status is published host-wide: a poll may reach another uvicorn worker
+job_queue = jobs.get_job_queue(board=shared_state.open_job_board(media_dir))
+
+
+def verify_take_token(song_name, expires, token, scopes=("record",)):
+    """Tokens are signed for sharing.take_token_key(song, scope); uploads take only record ones"""
+    return any(media_storage.verify_media_url(MEDIA_URL_SECRET, sharing.take_token_key(song_name, scope),
+                                              expires, token)
+               for scope in scopes)
+
+
+def _parse_range(header, size):
+    """'bytes=a-b' -> (start, end) inclusive, or None if unsatisfiable"""
+    try:
+        unit, _, spec = header.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            return None
+        start, _, end = spec.strip().partition("-")
+        if start == "":
+            length = int(end)
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        if start > end or start >= size:
+            return None
+        return start, end
+    except ValueError:
+        return None
+
+
+# =============== MEDIA ===============
+def media_url(request, key, expires_in=86400):
+    """Direct URL for a stored object, falling back to this server's /media route"""
+    url = storage.url_for(key, expires_in=expires_in)
+    if url:
+        return url
+    url = str(request.url_for("media", key=key))
+    expires = int(time.time()) + expires_in
+    return url + f"?expires={expires}&sig={media_storage.sign_media_url(MEDIA_URL_SECRET, key, expires)}"
+
+
+def servable(key):
+    """Only media keys, and only in their normal form (no ../ tricks)"""
+    if posixpath.normpath(key) != key:
+        return False
+    # Preview clips live next to the analysis sidecars (ingest.PreviewAnalyzer)
+    return key.startswith(MEDIA_PREFIXES) or (
+        key.startswith("analysis/") and key.endswith(f"_original.{ingest.PreviewAnalyzer.artifact}"))
+
+
+def serve_media(request):
+    key = request.path_params["key"]
+    if not servable(key) or not media_storage.verify_media_url(
+            MEDIA_URL_SECRET, key, request.query_params.get("expires"),
+            request.query_params.get("sig")):
+        return Response("Forbidden", status_code=403)
+    headers = {
+        # Segments are content-addressed: the bytes behind a key never change
+        "Cache-Control": (SEGMENT_CACHE_CONTROL if key.startswith(segments.SEGMENT_PREFIX)
+                          else f"private, max-age={MEDIA_CACHE_SECONDS}"),
+    }
+    if isinstance(storage, media_storage.LocalStorage):
+        # Streamed from disk in chunks; FileResponse answers Range requests itself
+        path = storage.local_path(key)
+        if not os.path.isfile(path):
+            return Response("Not found", status_code=404)
+        return FileResponse(path, media_type=media_storage.guess_content_type(key), headers=headers)
+
+    try:
+        size = storage.size(key)
+    except media_storage.StorageError:
+        return Response("Not found", status_code=404)
+    headers.update({"Accept-Ranges": "bytes", "Content-Type": media_storage.guess_content_type(key)})
+    range_header = request.headers.get("range")
+    if range_header:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return Response(storage.open_range(key, start, end), status_code=206, headers=headers)
+    return Response(storage.get(key), headers=headers)
+
+
+# =============== TAKES ===============
+async def _receive_take(request, name):
+    """Check the token and stream the body to temp/rec_<name>_<song>; returns (song, path) or (None, error)"""
+    song_name = request.query_params.get("song", "")
+    if not song_name or not verify_take_token(song_name, request.query_params.get("expires"),
+                                              request.query_params.get("token")):
+        return None, JSONResponse({"error": "invalid token"}, status_code=403)
+    if int(request.headers.get("content-length") or 0) > MAX_TAKE_BYTES:
+        return None, JSONResponse({"error": "take too large"}, status_code=413)
+
+    content_type = request.headers.get("content-type", "audio/webm").split(";")[0].strip()
+    ext = TAKE_EXTS.get(content_type, "webm")
+    # rec_ prefix: the retention sweeper cleans these up once the job is done
+    safe_name = song_name.replace("/", "_").replace("\\", "_")
+    audio_path = os.path.join(temp_dir, f"rec_{name}_{safe_name}.{ext}")
+
+    received = 0
+    with open(audio_path, "wb") as f:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_TAKE_BYTES:
+                f.close()
+                os.remove(audio_path)
+                return None, JSONResponse({"error": "take too large"}, status_code=413)
+            f.write(chunk)
+    media_lifecycle.record_owner(audio_path, song_name)
+    return song_name, audio_path
+
+
+async def upload_take(request):
+    try:
+        tempo = float(request.query_params.get("tempo", "1"))
+    except ValueError:
+        return JSONResponse({"error": "invalid tempo"}, status_code=400)
+    take_id = uuid.uuid4().hex
+    song_name, audio_path = await _receive_take(request, take_id)
+    if song_name is None:
+        return audio_path
+    job_id = f"render:{take_id}"
+    job_queue.submit(job_id, video_render.render_final, media_dir, song_name,
+                     audio_path, logo_path, tempo, protect=(audio_path,))
+    return JSONResponse({"job_id": job_id, "status": "queued"}, status_code=202)
+
+
+async def upload_vocal(request):
+    try:
+        semitones = int(request.query_params.get("key", "0"))
+        tempo = float(request.query_params.get("tempo", "1"))
+    except ValueError:
+        return JSONResponse({"error": "invalid key/tempo"}, status_code=400)
+    take_id = uuid.uuid4().hex
+    song_name, audio_path = await _receive_take(request, f"vocal_{take_id}")
+    if song_name is None:
+        return audio_path
+    job_id = f"score:{take_id}"
+    job_queue.submit(job_id, pitch.score_recording, media_dir, song_name,
+                     audio_path, semitones, tempo, protect=(audio_path,))
+    return JSONResponse({"job_id": job_id, "status": "queued"}, status_code=202)
+
+
+# =============== ANALYTICS ===============
+async def post_event(request):
+    # sendBeacon posts text/plain to stay a "simple" CORS request
+    try:
+        body = json.loads(await request.body())
+    except ValueError:
+        return JSONResponse({"error": "invalid body"}, status_code=400)
+    song_name = body.get("song", "")
+    if not song_name or not verify_take_token(song_name, body.get("expires"), body.get("token"),
+                                              scopes=sharing.SHARE_SCOPES):
+        return JSONResponse({"error": "invalid token"}, status_code=403)
+    extra = body.get("extra") if isinstance(body.get("extra"), dict) else None
+    if not events.record(body.get("event"), song_name, user=body.get("user"), role=body.get("role"),
+                         session_id=body.get("session"), extra=extra):
+        return JSONResponse({"error": "unknown event"}, status_code=400)
+    return Response(status_code=204)
+
+
+# =============== GUEST PLAYER ===============
+_guest_pages = {}
+_guest_pages_lock = threading.Lock()
+
+
+def _guest_page(request, song_name, scope="record"):
+    """(html, etag) of the guest player, rebuilt at most every GUEST_PAGE_CACHE_SECONDS"""
+    now = time.time()
+    epoch = (epochs.get("tracks"), epochs.get("lyrics"))
+    with _guest_pages_lock:
+        cached = _guest_pages.get((song_name, scope))
+    if cached and cached[0] > now and cached[3] == epoch:
+        return cached[1], cached[2]
+
+    lyrics_key = video_render.find_lyrics_key(storage, song_name)
+    expires = int(now) + MEDIA_URL_TTL_SECONDS
+    # The token carries the link's scope: a listen-only page can send analytics, never takes
+    beacon = {"api": MEDIA_API_URL or str(request.base_url).rstrip("/"), "song": song_name,
+              "expires": expires, "scope": scope,
+              "token": media_storage.sign_media_url(MEDIA_URL_SECRET, sharing.take_token_key(song_name, scope),
+                                                    expires)}
+    track_info = ingest.load_track_info(storage, song_name) or {}
+    track = {
+        "duration": track_info.get("duration"),
+        "key": 0,
+        "tempo": 1.0,
+        "shifted": False,
+        "peaks": ingest.load_peaks(storage, song_name),
+        "gains": ingest.load_gains(storage, song_name),
+        "render": beacon if scope == "record" else None,
+        "events": beacon,
+        "lyrics": lyrics.load_lyrics(storage, song_name),
+        "segments": {kind: segments.signed_manifest(ingest.load_segments(storage, song_name, kind),
+                                                    lambda key: media_url(request, key, MEDIA_URL_TTL_SECONDS))
+                     for kind in ingest.TRACK_KINDS},
+        "session": {"user": "guest", "role": "guest", "id": None},
+        "scope": scope,
+    }
+    html = player.render_player(
+        media_url(request, lyrics_key, MEDIA_URL_TTL_SECONDS) if lyrics_key else "",
+        str(request.url_for("player_logo")) if os.path.exists(logo_path) else "",
+        media_url(request, f"songs/{song_name}_original.mp3", MEDIA_URL_TTL_SECONDS),
+        media_url(request, f"songs/{song_name}_accompaniment.mp3", MEDIA_URL_TTL_SECONDS),
+        track)
+    etag = '"%s"' % hashlib.sha1(html.encode()).hexdigest()[:16]
+    with _guest_pages_lock:
+        _guest_pages[(song_name, scope)] = (now + GUEST_PAGE_CACHE_SECONDS, html, etag, epoch)
+    return html, etag
+
+
+def guest_player(request):
+    token = request.query_params.get("share")
+    if token:
+        # Signed link: HMAC + in-memory revocation check, no lookups
+        claims = sharing.verify_share_token(SHARE_TOKEN_SECRET, token, share_revocations)
+        if not claims:
+            return HTMLResponse("<h3>❌ This link has expired or was revoked.</h3>", status_code=403)
+        song_name, scope = claims["s"], claims["c"]
+    else:
+        song_name, scope = request.query_params.get("song", ""), "record"
+        # Same rule as the Song Player: guests only get songs that are shared right now
+        if not sharing.is_shared(shared_links_dir, session_db_path, song_name):
+            return HTMLResponse("<h3>❌ This song is not shared.</h3>", status_code=404)
+    if not storage.exists(f"songs/{song_name}_accompaniment.mp3"):
+        return HTMLResponse("<h3>⏳ This song is still being prepared. Please try again in a minute.</h3>",
+                            status_code=503, headers={"Retry-After": "60"})
+
+    html, etag = _guest_page(request, song_name, scope)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={GUEST_PAGE_CACHE_SECONDS}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    events.record("share_open", song_name, user="guest", role="guest")
+    return HTMLResponse(html, headers=headers)
+
+
+def player_logo(request):
+    if not os.path.exists(logo_path):
+        return Response("Not found", status_code=404)
+    return FileResponse(logo_path, media_type="image/png",
+                        headers={"Cache-Control": f"public, max-age={MEDIA_CACHE_SECONDS}"})
+
+
+def job_status(request):
+    job = job_queue.get(request.path_params["job_id"])
+    if not job:
+        return JSONResponse({"error": "unknown job"}, status_code=404)
+    body = {"job_id": job["key"], "status": job["status"], "error": job["error"],
+            "elapsed": round((job["finished"] or time.time()) - job["submitted"], 2)}
+    if job["status"] == "done" and isinstance(job["result"], dict):
+        body["result"] = job["result"]
+    elif job["status"] == "done":
+        key = job["result"]
+        body["key"] = key
+        body["url"] = media_url(request, key)
+    return JSONResponse(body)
+
+
+routes = [
+    Route("/media/{key:path}", serve_media, methods=["GET"], name="media"),
+    Route("/api/takes", upload_take, methods=["POST"]),
+    Route("/api/scores", upload_vocal, methods=["POST"]),
+    Route("/api/jobs/{job_id}", job_status, methods=["GET"]),
+    Route("/api/events", post_event, methods=["POST"]),
+    Route("/play", guest_player, methods=["GET"]),
+    Route("/player/logo.png", player_logo, methods=["GET"], name="player_logo"),
+]
+
+app = Starlette(routes=routes, middleware=[
+    Middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=["GET", "POST"],
+               allow_headers=["Range", "Content-Type"], expose_headers=["Content-Range"]),
+])
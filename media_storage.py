@@ -0,0 +1,413 @@
+"""Storage backends for song media.
+
+All media is addressed by a key relative to the media root, e.g.
+``songs/<song>_original.mp3``, ``lyrics_images/<song>_lyrics_bg.jpg`` or
+``finals/final_<id>.mp4``.  Two backends implement the same interface:
+
+* ``LocalStorage`` -- files under ``media/`` on local disk (the default).
+* ``S3Storage``    -- any S3-compatible object store (AWS, MinIO, R2, a
+  local stand-in server...).  Requests are signed with AWS SigV4 using only
+  the standard library, and ``url_for`` returns presigned GET URLs so
+  browsers can fetch media without going through the Streamlit process.
+
+``storage_from_env()`` picks the backend from environment variables.  The
+S3 backend keeps local copies of objects that tools need as files
+(``local_path``) under ``media/cache/s3``; ``s3_cache_policy()`` is the
+LRU quota (``S3_CACHE_MB``) the media sweeper applies to them.
+"""
+import datetime
+import hashlib
+import hmac
+import mimetypes
+import os
+import shutil
+import time
+import urllib.error
+import urllib.request
+import uuid
+import xml.etree.ElementTree as ET
+from urllib.parse import quote, urlsplit
+
+import media_lifecycle
+
+S3_CACHE_MB = float(os.getenv("S3_CACHE_MB", "2000"))
+
+
+class StorageError(Exception):
+    pass
+
+
+def guess_content_type(key):
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+def new_final_key(ext):
+    """Key for a new finished take/render in finals/"""
+    return f"finals/final_{uuid.uuid4().hex}.{ext.lstrip('.')}"
+
+
+def _read_data(data):
+    if hasattr(data, "read"):
+        return data.read()
+    return bytes(data)
+
+
+# =============== SIGNED LOCAL URLS ===============
+def sign_media_url(secret, key, expires):
+    msg = f"{key}\n{int(expires)}".encode()
+    return hmac.new(secret.encode(), msg, hashlib.sha256).hexdigest()
+
+
+def verify_media_url(secret, key, expires, signature):
+    """Check a signature produced by LocalStorage.url_for()"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sign_media_url(secret, key, expires), signature or "")
+
+
+class MediaStorage:
+    """Interface shared by all storage backends"""
+
+    def put(self, key, data, content_type=None):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def open_range(self, key, start, end=None):
+        """Bytes [start, end] (inclusive, like an HTTP Range) of an object"""
+        raise NotImplementedError
+
+    def url_for(self, key, expires_in=3600):
+        """A URL clients can fetch directly, or None if there is none"""
+        return None
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def list(self, prefix=""):
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Filesystem path for tools that need one (ffmpeg); may download"""
+        raise NotImplementedError
+
+
+# =============== LOCAL DISK ===============
+class LocalStorage(MediaStorage):
+    def __init__(self, root, base_url=None, url_secret=None):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.url_secret = url_secret
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise StorageError(f"Invalid media key: {key}")
+        return path
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        with open(tmp_path, "wb") as f:
+            if hasattr(data, "read"):
+                shutil.copyfileobj(data, f)
+            else:
+                f.write(data)
+        os.replace(tmp_path, path)
+        return key
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise StorageError(f"Not found: {key}")
+
+    def open_range(self, key, start, end=None):
+        try:
+            with open(self._path(key), "rb") as f:
+                f.seek(start)
+                if end is None:
+                    return f.read()
+                return f.read(max(0, end - start + 1))
+        except FileNotFoundError:
+            raise StorageError(f"Not found: {key}")
+
+    def url_for(self, key, expires_in=3600):
+        if not self.base_url:
+            return None
+        url = f"{self.base_url}/media/{quote(key)}"
+        if self.url_secret:
+            expires = int(time.time()) + int(expires_in)
+            url += f"?expires={expires}&sig={sign_media_url(self.url_secret, key, expires)}"
+        return url
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self._path(key))
+        except OSError:
+            raise StorageError(f"Not found: {key}")
+
+    def list(self, prefix=""):
+        directory, _, name_prefix = prefix.rpartition("/")
+        folder = self._path(directory) if directory else self.root
+        if not os.path.isdir(folder):
+            return []
+        keys = []
+        for name in os.listdir(folder):
+            if name.startswith(name_prefix) and not name.endswith(".part") \
+                    and os.path.isfile(os.path.join(folder, name)):
+                keys.append(f"{directory}/{name}" if directory else name)
+        return sorted(keys)
+
+    def local_path(self, key):
+        return self._path(key)
+
+
+# =============== S3-COMPATIBLE ===============
+def _hmac_sha256(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+class S3Storage(MediaStorage):
+    """Path-style S3 client signed with SigV4 (works with MinIO and friends).
+
+    ``python s3_standin.py`` checks every operation against an in-process
+    stand-in that verifies the signatures; ``--endpoint env`` runs the same
+    checks against a real bucket.
+    """
+
+    def __init__(self, bucket, endpoint_url, access_key, secret_key,
+                 region="us-east-1", prefix="", cache_dir=None, timeout=30):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.host = urlsplit(self.endpoint_url).netloc
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix.strip("/")
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+
+    def _object_path(self, key):
+        full_key = f"{self.prefix}/{key}" if self.prefix else key
+        return f"/{self.bucket}/{quote(full_key, safe='/~')}"
+
+    def _signing_key(self, datestamp):
+        k = _hmac_sha256(f"AWS4{self.secret_key}".encode(), datestamp)
+        k = _hmac_sha256(k, self.region)
+        k = _hmac_sha256(k, "s3")
+        return _hmac_sha256(k, "aws4_request")
+
+    def _sign(self, method, path, query, headers, payload_hash, now):
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        datestamp = now.strftime("%Y%m%d")
+        scope = f"{datestamp}/{self.region}/s3/aws4_request"
+
+        canonical_query = "&".join(
+            f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items()))
+        names = sorted(h.lower() for h in headers)
+        lowered = {k.lower(): str(v).strip() for k, v in headers.items()}
+        canonical_headers = "".join(f"{n}:{lowered[n]}\n" for n in names)
+        signed_headers = ";".join(names)
+
+        canonical_request = "\n".join([method, path, canonical_query, canonical_headers,
+                                       signed_headers, payload_hash])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest()])
+        signature = hmac.new(self._signing_key(datestamp), string_to_sign.encode(),
+                             hashlib.sha256).hexdigest()
+        return scope, signed_headers, signature
+
+    def _request(self, method, path, query=None, body=b"", headers=None):
+        query = query or {}
+        headers = dict(headers or {})
+        now = datetime.datetime.now(datetime.timezone.utc)
+        payload_hash = hashlib.sha256(body).hexdigest()
+        headers["Host"] = self.host
+        headers["x-amz-date"] = now.strftime("%Y%m%dT%H%M%SZ")
+        headers["x-amz-content-sha256"] = payload_hash
+        scope, signed_headers, signature = self._sign(method, path, query, headers,
+                                                      payload_hash, now)
+        headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}")
+
+        url = self.endpoint_url + path
+        if query:
+            url += "?" + "&".join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}"
+                                  for k, v in sorted(query.items()))
+        req = urllib.request.Request(url, data=body if method in ("PUT", "POST") else None,
+                                     headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return resp.status, dict(resp.headers), resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, dict(e.headers), e.read()
+        except urllib.error.URLError as e:
+            raise StorageError(f"S3 request failed: {e.reason}")
+
+    def put(self, key, data, content_type=None):
+        body = _read_data(data)
+        status, _, resp = self._request(
+            "PUT", self._object_path(key), body=body,
+            headers={"Content-Type": content_type or guess_content_type(key),
+                     "Content-Length": str(len(body))})
+        if status not in (200, 201, 204):
+            raise StorageError(f"PUT {key} failed ({status}): {resp[:200]!r}")
+        self._drop_cached(key)
+        return key
+
+    def get(self, key):
+        status, _, body = self._request("GET", self._object_path(key))
+        if status == 404:
+            raise StorageError(f"Not found: {key}")
+        if status != 200:
+            raise StorageError(f"GET {key} failed ({status})")
+        return body
+
+    def open_range(self, key, start, end=None):
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        status, _, body = self._request("GET", self._object_path(key),
+                                        headers={"Range": byte_range})
+        if status == 404:
+            raise StorageError(f"Not found: {key}")
+        if status == 200:
+            # Server ignored the Range header
+            return body[start:] if end is None else body[start:end + 1]
+        if status != 206:
+            raise StorageError(f"GET {key} failed ({status})")
+        return body
+
+    def url_for(self, key, expires_in=3600):
+        """Presigned GET URL (query-string SigV4)"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        path = self._object_path(key)
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "X-Amz-Expires": str(int(expires_in)),
+            "X-Amz-SignedHeaders": "host",
+        }
+        _, _, signature = self._sign("GET", path, query, {"host": self.host},
+                                     "UNSIGNED-PAYLOAD", now)
+        query["X-Amz-Signature"] = signature
+        return self.endpoint_url + path + "?" + "&".join(
+            f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items()))
+
+    def delete(self, key):
+        status, _, _ = self._request("DELETE", self._object_path(key))
+        if status not in (200, 204, 404):
+            raise StorageError(f"DELETE {key} failed ({status})")
+        self._drop_cached(key)
+
+    def exists(self, key):
+        status, _, _ = self._request("HEAD", self._object_path(key))
+        return status == 200
+
+    def size(self, key):
+        status, headers, _ = self._request("HEAD", self._object_path(key))
+        if status != 200:
+            raise StorageError(f"Not found: {key}")
+        return int({k.lower(): v for k, v in headers.items()}.get("content-length", 0))
+
+    def list(self, prefix=""):
+        full_prefix = f"{self.prefix}/{prefix}" if self.prefix else prefix
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        keys = []
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": full_prefix}
+            if token:
+                query["continuation-token"] = token
+            status, _, body = self._request("GET", f"/{self.bucket}", query=query)
+            if status != 200:
+                raise StorageError(f"LIST {prefix} failed ({status})")
+            root = ET.fromstring(body)
+            ns = root.tag[:root.tag.index("}") + 1] if root.tag.startswith("{") else ""
+            for item in root.iter(f"{ns}Contents"):
+                keys.append(item.find(f"{ns}Key").text[strip:])
+            truncated = root.find(f"{ns}IsTruncated")
+            if truncated is None or truncated.text != "true":
+                break
+            token = root.find(f"{ns}NextContinuationToken").text
+        return sorted(keys)
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest()
+                            + os.path.splitext(key)[1])
+
+    def _drop_cached(self, key):
+        if self.cache_dir:
+            try:
+                os.remove(self._cache_path(key))
+            except FileNotFoundError:
+                pass
+
+    def local_path(self, key):
+        if not self.cache_dir:
+            raise StorageError("S3Storage.local_path needs a cache_dir")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(key)
+        if os.path.exists(path):
+            # LRU eviction by the sweeper (s3_cache_policy) sees the hit
+            media_lifecycle.touch(path)
+        else:
+            # Dot-named while downloading, so the sweeper never evicts a partial copy
+            tmp_path = os.path.join(self.cache_dir, f".{os.path.basename(path)}.{uuid.uuid4().hex}.part")
+            with open(tmp_path, "wb") as f:
+                f.write(self.get(key))
+            os.replace(tmp_path, path)
+        return path
+
+
+def s3_cache_dir(media_dir):
+    return os.path.join(media_dir, "cache", "s3")
+
+
+def s3_cache_policy(media_dir, max_bytes=None):
+    max_bytes = int(S3_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+    return media_lifecycle.RetentionPolicy("s3_cache", s3_cache_dir(media_dir), max_bytes=max_bytes)
+
+
+def storage_from_env(media_dir):
+    """Build the configured backend (MEDIA_STORAGE=local|s3)"""
+    backend = os.getenv("MEDIA_STORAGE", "local").lower()
+    if backend == "s3":
+        return S3Storage(
+            bucket=os.environ["S3_BUCKET"],
+            endpoint_url=os.getenv("S3_ENDPOINT_URL", "https://s3.amazonaws.com"),
+            access_key=os.getenv("S3_ACCESS_KEY_ID", os.getenv("AWS_ACCESS_KEY_ID", "")),
+            secret_key=os.getenv("S3_SECRET_ACCESS_KEY", os.getenv("AWS_SECRET_ACCESS_KEY", "")),
+            region=os.getenv("S3_REGION", "us-east-1"),
+            prefix=os.getenv("S3_PREFIX", ""),
+            cache_dir=s3_cache_dir(media_dir),
+        )
+    url_secret = os.getenv("MEDIA_URL_SECRET") or None
+    # media_server only accepts signed URLs: without a secret, media stays inline
+    return LocalStorage(media_dir,
+                        base_url=(os.getenv("MEDIA_BASE_URL") or None) if url_secret else None,
+                        url_secret=url_secret)
@@ -0,0 +1,160 @@
+"""Microphone processing for the recording graph, shared by both players.
+
+``MIC_CHAIN_JS`` is pasted into the player page.  It defines an
+AudioWorklet processor (loaded from a Blob URL, since the component iframe
+has no static files) that runs on the audio rendering thread:
+
+* input gain, an optional soft-knee compressor and a brick-wall limiter,
+* a ring buffer of per-quantum peak / sum-of-squares values, from which
+  peak and RMS over the last ``METER_WINDOW`` seconds are posted to the
+  page every ``METER_INTERVAL`` seconds (not every 128-sample quantum),
+
+and ``createMicChain(ctx, micStream, onMeter)`` which wires
+``MediaStreamSource -> worklet -> (recording destinations, monitor gain)``.
+Main-thread work (canvas drawing, DOM updates) can no longer starve the mic
+path, and browsers without AudioWorklet fall back to the plain source node.
+"""
+
+METER_INTERVAL = 0.05
+METER_WINDOW = 0.3
+
+MIC_CHAIN_JS = """
+/* ================== MIC CHAIN (AudioWorklet, mic_processing.py) ================== */
+const MIC_WORKLET_SOURCE = `
+class MicProcessor extends AudioWorkletProcessor {
+    static get parameterDescriptors() {
+        return [
+            { name: "inputGain", defaultValue: 1, minValue: 0, maxValue: 8, automationRate: "k-rate" },
+            { name: "threshold", defaultValue: -18, minValue: -60, maxValue: 0, automationRate: "k-rate" },
+            { name: "ratio", defaultValue: 3, minValue: 1, maxValue: 20, automationRate: "k-rate" },
+            { name: "ceiling", defaultValue: -1, minValue: -12, maxValue: 0, automationRate: "k-rate" }
+        ];
+    }
+
+    constructor(options) {
+        super();
+        const opts = (options && options.processorOptions) || {};
+        this.compressor = opts.compressor !== false;
+        this.limiter = opts.limiter !== false;
+        this.meterEvery = Math.max(1, Math.round((opts.meterInterval || %(interval)s) * sampleRate / 128));
+        const slots = Math.max(1, Math.round((opts.meterWindow || %(window)s) * sampleRate / 128));
+        this.ringPeak = new Float32Array(slots);
+        this.ringSquares = new Float32Array(slots);
+        this.ringPos = 0;
+        this.quanta = 0;
+        this.clipped = false;
+        this.env = 0;
+        this.limitGain = 1;
+        this.attack = Math.exp(-1 / (0.005 * sampleRate));
+        this.release = Math.exp(-1 / (0.15 * sampleRate));
+        this.limitRelease = Math.exp(-1 / (0.05 * sampleRate));
+        this.port.onmessage = (e) => {
+            if ("compressor" in e.data) this.compressor = !!e.data.compressor;
+            if ("limiter" in e.data) this.limiter = !!e.data.limiter;
+        };
+    }
+
+    process(inputs, outputs, parameters) {
+        const input = inputs[0];
+        const output = outputs[0];
+        if (!input || !input.length) return true;
+        const inCh = input[0];
+        const out = output[0];
+        const gain = parameters.inputGain[0];
+        const threshold = parameters.threshold[0];
+        const slope = 1 - 1 / parameters.ratio[0];
+        const ceiling = Math.pow(10, parameters.ceiling[0] / 20);
+        let peak = 0, squares = 0;
+
+        for (let i = 0; i < inCh.length; i++) {
+            let x = inCh[i] * gain;
+            if (input.length > 1) x = 0.5 * (x + input[1][i] * gain);
+            const level = Math.abs(x);
+            if (this.compressor) {
+                this.env = level > this.env ? this.attack * this.env + (1 - this.attack) * level
+                                            : this.release * this.env + (1 - this.release) * level;
+                const envDb = 20 * Math.log10(this.env + 1e-9);
+                if (envDb > threshold) x *= Math.pow(10, -slope * (envDb - threshold) / 20);
+            }
+            if (this.limiter) {
+                // Instant attack, smooth release back towards unity
+                const target = Math.min(1, ceiling / (Math.abs(x) + 1e-9));
+                this.limitGain = target < this.limitGain ? target
+                    : target + this.limitRelease * (this.limitGain - target);
+                x *= this.limitGain;
+            }
+            for (let c = 0; c < output.length; c++) output[c][i] = x;
+            const ax = Math.abs(x);
+            if (ax > peak) peak = ax;
+            squares += x * x;
+            if (ax >= 0.999) this.clipped = true;
+        }
+
+        this.ringPeak[this.ringPos] = peak;
+        this.ringSquares[this.ringPos] = squares / inCh.length;
+        this.ringPos = (this.ringPos + 1) %% this.ringPeak.length;
+
+        if (++this.quanta >= this.meterEvery) {
+            this.quanta = 0;
+            let p = 0, s = 0;
+            for (let k = 0; k < this.ringPeak.length; k++) {
+                if (this.ringPeak[k] > p) p = this.ringPeak[k];
+                s += this.ringSquares[k];
+            }
+            this.port.postMessage({ peak: p, rms: Math.sqrt(s / this.ringPeak.length), clip: this.clipped });
+            this.clipped = false;
+        }
+        return true;
+    }
+}
+registerProcessor("mic-processor", MicProcessor);
+`;
+
+const micWorkletContexts = new WeakSet();
+
+async function createMicChain(ctx, micStream, onMeter, options) {
+    const source = ctx.createMediaStreamSource(micStream);
+    const monitor = ctx.createGain();
+    monitor.gain.value = 0;
+    monitor.connect(ctx.destination);
+    let node = null;
+    if (ctx.audioWorklet && window.AudioWorkletNode) {
+        try {
+            if (!micWorkletContexts.has(ctx)) {
+                const url = URL.createObjectURL(new Blob([MIC_WORKLET_SOURCE], { type: "application/javascript" }));
+                await ctx.audioWorklet.addModule(url);
+                URL.revokeObjectURL(url);
+                micWorkletContexts.add(ctx);
+            }
+            node = new AudioWorkletNode(ctx, "mic-processor", {
+                numberOfInputs: 1, numberOfOutputs: 1, outputChannelCount: [1],
+                processorOptions: options || {}
+            });
+            node.port.onmessage = (e) => onMeter && onMeter(e.data);
+            source.connect(node);
+        } catch (e) {
+            console.log("AudioWorklet unavailable, using the raw mic:", e);
+            node = null;
+        }
+    }
+    const output = node || source;
+    output.connect(monitor);
+    return {
+        output: output,
+        processed: !!node,
+        setOption(name, value) { if (node) node.port.postMessage({ [name]: value }); },
+        setMonitor(on) { monitor.gain.setTargetAtTime(on ? 1 : 0, ctx.currentTime, 0.02); },
+        disconnect() {
+            try { source.disconnect(); } catch (e) {}
+            try { output.disconnect(); } catch (e) {}
+            try { monitor.disconnect(); } catch (e) {}
+        }
+    };
+}
+
+// Map a linear level to a 0-100 %% meter width (-60 dBFS .. 0 dBFS)
+function meterPercent(level) {
+    const db = 20 * Math.log10(level + 1e-9);
+    return Math.max(0, Math.min(100, (db + 60) / 60 * 100));
+}
+""" % {"interval": METER_INTERVAL, "window": METER_WINDOW}
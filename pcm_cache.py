@@ -0,0 +1,126 @@
+"""Decoded PCM cache shared by the analysis and render jobs.
+
+Extraction, ingest analysis and every key/tempo rendition each used to run
+their own ffmpeg decode of the same MP3.  ``iter_pcm`` here decodes a track
+once into ``media/pcm_cache/<sha1[:16]>_<rate>_<channels>.f32`` -- raw
+little-endian float32, interleaved; the shape follows from the name and the
+file size -- and then serves blocks straight out of a read-only
+``numpy.memmap``.  Worker processes mapping the same file share its pages
+through the OS page cache, so the next job on that song costs neither a
+decode nor a copy.
+
+Entries are keyed by the content hash of the source, so a re-uploaded song
+never reads stale samples.  The directory has a byte budget
+(``PCM_CACHE_MB``) enforced least-recently-used by media_lifecycle after
+each insert (and by the app's sweeper); hits are touched.  Removing a file
+that another process still has mapped is safe: its pages live until that
+process unmaps them.
+"""
+import hashlib
+import os
+import threading
+import uuid
+
+import numpy as np
+
+import audio_io
+import media_lifecycle
+
+PCM_CACHE_MB = float(os.getenv("PCM_CACHE_MB", "2000"))
+CACHE_SUBDIR = "pcm_cache"
+
+_hash_lock = threading.Lock()
+_hashes = {}
+
+
+def cache_dir(media_dir):
+    return os.path.join(media_dir, CACHE_SUBDIR)
+
+
+def retention_policy(media_dir, max_bytes=None):
+    max_bytes = int(PCM_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+    return media_lifecycle.RetentionPolicy("pcm", cache_dir(media_dir), max_bytes=max_bytes)
+
+
+def file_hash(path):
+    """sha1 of a file, remembered per (path, size, mtime) for this process"""
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _hash_lock:
+        digest = _hashes.get(stamp)
+    if digest:
+        return digest
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _hash_lock:
+        _hashes[stamp] = digest
+    return digest
+
+
+def cache_path(media_dir, digest, sample_rate, channels):
+    return os.path.join(cache_dir(media_dir), f"{digest[:16]}_{sample_rate}_{channels}.f32")
+
+
+def _decode_to(path, target, sample_rate, channels):
+    # Dot prefix: retention policies never manage a half-written entry
+    tmp_path = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.{uuid.uuid4().hex}.part")
+    try:
+        with open(tmp_path, "wb") as f:
+            for block in audio_io.iter_pcm(path, sample_rate=sample_rate, channels=channels):
+                f.write(block.tobytes())
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _map(target, channels):
+    frames = os.path.getsize(target) // (4 * channels)
+    if not frames:
+        return np.zeros((0, channels), dtype=np.float32)
+    return np.memmap(target, dtype="<f4", mode="r", shape=(frames, channels))
+
+
+def open_pcm(media_dir, path, sample_rate, channels):
+    """Read-only (frames, channels) float32 memmap of path, decoding it on a miss"""
+    os.makedirs(cache_dir(media_dir), exist_ok=True)
+    target = cache_path(media_dir, file_hash(path), sample_rate, channels)
+    try:
+        samples = _map(target, channels)
+        media_lifecycle.touch(target)
+        return samples
+    except FileNotFoundError:
+        pass
+
+    _decode_to(path, target, sample_rate, channels)
+    samples = _map(target, channels)
+    policy = retention_policy(media_dir)
+    with media_lifecycle.protected(target):
+        media_lifecycle.sweep([policy], dry_run=False)
+    return samples
+
+
+def iter_pcm(media_dir, path, sample_rate, channels, info=None,
+             block_seconds=audio_io.DEFAULT_BLOCK_SECONDS):
+    """Drop-in for audio_io.iter_pcm backed by the cache (media_dir=None: no cache)"""
+    if not media_dir:
+        yield from audio_io.iter_pcm(path, sample_rate=sample_rate, channels=channels,
+                                     block_seconds=block_seconds)
+        return
+    info = info or audio_io.probe(path)
+    # One entry per track: stereo (or mono) at the native layout, remixed per block
+    stored = min(2, max(channels, info["channels"]))
+    samples = open_pcm(media_dir, path, sample_rate, stored)
+    block = int(block_seconds * sample_rate)
+    for start in range(0, len(samples), block):
+        chunk = samples[start:start + block]
+        if channels == stored:
+            yield chunk
+        elif channels == 1:
+            yield chunk.mean(axis=1, keepdims=True, dtype=np.float32)
+        else:
+            yield np.repeat(chunk, channels, axis=1)
@@ -0,0 +1,910 @@
+"""The karaoke player page, shared by the Streamlit Song Player and the
+guest fast path in media_server.py.
+
+``render_player`` fills ``PLAYER_TEMPLATE``: media and logo sources are
+URLs (or data URIs when there is no URL-capable backend), everything the
+page needs about the track travels in one ``TRACK`` JSON object, and the
+page needs no server round trip to start, so the same HTML works inside
+Streamlit and as a standalone, cacheable document.
+
+Inside Streamlit the page runs as the ``karaoke_player`` custom component
+(``build_component``): a static index.html whose player script starts on
+the first render message, with sources and TRACK taken from the props.
+Reruns only post new props to the mounted iframe, so decoded audio, the
+mic graph and a take in progress survive them; the player is restarted
+only when ``player_id`` (song, key, tempo) changes.  Inlined (data URI)
+sources are sent only with the first props of a ``player_id``; a page
+that starts without them asks for them again with a ``need_sources``
+state.  State changes (playing / paused / recording / finished take /
+idle) come back to Python as the component value.
+
+Tracks with ingest segments (``TRACK.segments``, see segments.py) are
+streamed through MediaSource instead of their progressive URL, and a take
+records the accompaniment from the playing element rather than decoding
+the whole file.
+"""
+import json
+import os
+import re
+
+import mic_processing
+
+PLAYER_TEMPLATE = """
+<!doctype html>
+<html>
+<head>
+  <meta charset="utf-8" />
+  <title>🎤 Karaoke Reels</title>
+<style>
+* { margin: 0; padding: 0; box-sizing: border-box; }
+body { background: #000; font-family: 'Poppins', sans-serif; height: 100vh; width: 100vw; overflow: hidden; }
+.reel-container, .final-reel-container { width: 100%; height: 100%; position: absolute; background: #111; overflow: hidden; }
+#status { position: absolute; top: 20px; width: 100%; text-align: center; font-size: 14px; color: #ccc; z-index: 20; text-shadow: 1px 1px 6px rgba(0,0,0,0.9); }
+.reel-bg { position: absolute; top: 0; left: 0; width: 100%; height: 85vh; object-fit: contain; object-position: top; }
+.lyrics { position: absolute; bottom: 25%; width: 100%; text-align: center; font-size: 2vw; font-weight: bold; color: white; text-shadow: 2px 2px 10px black; }
+.controls { position: absolute; bottom: 20%; width: 100%; text-align: center; z-index: 30; }
+button { background: linear-gradient(135deg, #ff0066, #ff66cc); border: none; color: white; padding: 8px 20px; border-radius: 25px; font-size: 13px; margin: 4px; box-shadow: 0px 3px 15px rgba(255,0,128,0.4); cursor: pointer; }
+button:active { transform: scale(0.95); }
+.final-output { position: fixed; width: 100vw; height: 100vh; top: 0; left: 0; background: rgba(0,0,0,0.9); display: none; justify-content: center; align-items: center; z-index: 999; }
+#logoImg { position: absolute; top: 20px; left: 20px; width: 60px; z-index: 50; opacity: 0.6; }
+canvas { display: none; }
+.mic-meter { display: none; position: absolute; bottom: 9%; left: 10%; width: 80%; height: 6px; background: rgba(255,255,255,0.15); border-radius: 3px; overflow: hidden; z-index: 25; }
+.mic-meter .rms { position: absolute; left: 0; top: 0; height: 100%; width: 0; background: linear-gradient(90deg, #33cc66, #ffcc00); }
+.mic-meter .peak { position: absolute; top: 0; height: 100%; width: 3px; left: 0; background: #fff; }
+.mic-meter.clip .peak { background: #ff3333; }
+.toggle { color: #ddd; font-size: 12px; margin: 0 6px; text-shadow: 1px 1px 4px black; }
+.lyrics-track { position: absolute; bottom: 30%; width: 100%; text-align: center; padding: 0 6%; z-index: 20; text-shadow: 2px 2px 10px black; }
+.lyrics-track .current { font-size: 3.2vw; font-weight: bold; color: #fff; }
+.lyrics-track .current .sung { color: #ff66cc; }
+.lyrics-track .next { font-size: 2vw; color: rgba(255,255,255,0.55); margin-top: 8px; }
+#waveCanvas { display: block; position: absolute; bottom: 12%; left: 10%; width: 80%; height: 48px; z-index: 25; cursor: pointer; }
+.score-display { position: absolute; top: 12%; width: 100%; text-align: center; font-size: 22px; font-weight: bold; color: #fff; text-shadow: 2px 2px 10px black; z-index: 40; }
+.score-display small { display: block; font-size: 13px; font-weight: normal; color: #ddd; }
+.render-status { position: absolute; bottom: 28%; width: 100%; text-align: center; font-size: 15px; color: #eee; text-shadow: 1px 1px 6px rgba(0,0,0,0.9); }
+.back-button { position: absolute; top: 20px; right: 20px; background: rgba(0,0,0,0.7); color: white; padding: 8px 16px; border-radius: 20px; text-decoration: none; font-size: 14px; z-index: 100; }
+</style>
+</head>
+<body>
+
+<div class="reel-container" id="reelContainer">
+    <img class="reel-bg" id="mainBg" src="%%LYRICS_SRC%%" crossorigin="anonymous">
+    <img id="logoImg" src="%%LOGO_SRC%%">
+    <div id="status">Ready 🎤</div>
+    <div class="lyrics-track" id="lyricsTrack"><div class="current" id="lyricsCurrent"></div><div class="next" id="lyricsNext"></div></div>
+    <audio id="originalAudio" src="%%ORIGINAL_SRC%%" crossorigin="anonymous" preload="none"></audio>
+    <audio id="accompaniment" src="%%ACCOMP_SRC%%" crossorigin="anonymous" preload="none"></audio>
+    <canvas id="waveCanvas" width="1200" height="96"></canvas>
+    <div class="mic-meter" id="micMeter"><div class="rms" id="micRms"></div><div class="peak" id="micPeak"></div></div>
+    <div class="controls">
+      <label class="toggle"><input type="checkbox" id="levelerToggle" checked> Leveler</label>
+      <label class="toggle"><input type="checkbox" id="monitorToggle"> 🎧 Monitor</label>
+      <button id="playBtn">▶ Play</button>
+      <button id="recordBtn">🎙 Record</button>
+      <button id="stopBtn" style="display:none;">⏹ Stop</button>
+    </div>
+</div>
+
+<div class="final-output" id="finalOutputDiv">
+  <div class="final-reel-container">
+    <img class="reel-bg" id="finalBg">
+    <div id="status"></div>
+    <div class="lyrics" id="finalLyrics"></div>
+    <div class="score-display" id="scoreDisplay"></div>
+    <div class="render-status" id="renderStatus"></div>
+    <div class="controls">
+      <button id="playRecordingBtn">▶ Play Recording</button>
+      <a id="downloadRecordingBtn" href="#" download>
+        <button>⬇ Download</button>
+      </a>
+      <button id="newRecordingBtn">🔄 New Recording</button>
+    </div>
+  </div>
+</div>
+
+<canvas id="recordingCanvas" width="1920" height="1080"></canvas>
+
+<script>
+%%MIC_CHAIN_JS%%
+
+/* ================== TRACK INFO (precomputed at ingest) ================== */
+const TRACK = %%TRACK_INFO%%;
+
+/* ================== GLOBAL STATE ================== */
+let mediaRecorder;
+let recordedChunks = [];
+let vocalRecorder = null;
+let vocalChunks = [];
+let playRecordingAudio = null;
+let lastRecordingURL = null;
+let currentTake = null;
+
+let audioContext, micChain, accSource, accTap;
+let canvasRafId = null;
+let isRecording = false;
+let isPlayingRecording = false;
+
+/* ================== ELEMENTS ================== */
+const playBtn = document.getElementById("playBtn");
+const recordBtn = document.getElementById("recordBtn");
+const stopBtn = document.getElementById("stopBtn");
+const status = document.getElementById("status");
+
+const originalAudio = document.getElementById("originalAudio");
+const accompanimentAudio = document.getElementById("accompaniment");
+
+const finalDiv = document.getElementById("finalOutputDiv");
+const mainBg = document.getElementById("mainBg");
+const finalBg = document.getElementById("finalBg");
+
+const renderStatus = document.getElementById("renderStatus");
+const micMeter = document.getElementById("micMeter");
+const micRms = document.getElementById("micRms");
+const micPeak = document.getElementById("micPeak");
+const levelerToggle = document.getElementById("levelerToggle");
+const monitorToggle = document.getElementById("monitorToggle");
+const scoreDisplay = document.getElementById("scoreDisplay");
+const playRecordingBtn = document.getElementById("playRecordingBtn");
+const downloadRecordingBtn = document.getElementById("downloadRecordingBtn");
+const newRecordingBtn = document.getElementById("newRecordingBtn");
+
+const canvas = document.getElementById("recordingCanvas");
+const ctx = canvas.getContext("2d");
+
+const logoImg = new Image();
+logoImg.src = document.getElementById("logoImg").src;
+
+// Listen-only share links (sharing.py scope "play")
+const LISTEN_ONLY = TRACK.scope === "play";
+if (LISTEN_ONLY) recordBtn.style.display = "none";
+
+/* ================== LOUDNESS MATCHING (precomputed at ingest) ================== */
+const GAINS = TRACK.gains || { original: 1, accompaniment: 1 };
+originalAudio.volume = GAINS.original;
+accompanimentAudio.volume = GAINS.accompaniment;
+
+/* ================== SEGMENTED STREAMING (segments.py) ================== */
+// Tracks with ingest segments are fed to a MediaSource a little ahead of the
+// playhead; played segments are removed again, so memory stays flat.
+const SEGMENTS = TRACK.segments || {};
+const MediaSourceImpl = window.ManagedMediaSource || window.MediaSource;
+const PREFETCH_SECONDS = 20;
+const BACK_BUFFER_SECONDS = 10;
+
+function streamSegments(audio, manifest) {
+    const mediaSource = new MediaSourceImpl();
+    const starts = [];
+    let total = 0;
+    for (const [, seconds] of manifest.segments) { starts.push(total); total += seconds; }
+    let buffer = null, next = 0, busy = false;
+
+    function indexAt(time) {
+        let i = 0;
+        while (i + 1 < starts.length && starts[i + 1] <= time) i++;
+        return i;
+    }
+    function isBuffered(time) {
+        for (let i = 0; i < buffer.buffered.length; i++) {
+            if (buffer.buffered.start(i) <= time + 0.1 && time < buffer.buffered.end(i)) return true;
+        }
+        return false;
+    }
+    function settle(action) {
+        return new Promise((resolve, reject) => {
+            buffer.addEventListener("updateend", resolve, { once: true });
+            buffer.addEventListener("error", reject, { once: true });
+            action();
+        });
+    }
+    async function append(url) {
+        const res = await fetch(url);
+        if (!res.ok) throw new Error("segment " + res.status);
+        const data = await res.arrayBuffer();
+        await settle(() => buffer.appendBuffer(data));
+    }
+    async function pump() {
+        if (busy || !buffer || mediaSource.readyState === "closed") return;
+        busy = true;
+        try {
+            const now = audio.currentTime;
+            // Drop what has been played
+            if (buffer.buffered.length && now - BACK_BUFFER_SECONDS > buffer.buffered.start(0) + 1) {
+                await settle(() => buffer.remove(0, now - BACK_BUFFER_SECONDS));
+            }
+            // After a seek out of the buffer, continue from the segment under the playhead
+            if (!isBuffered(now)) next = indexAt(now);
+            while (next < starts.length && starts[next] < audio.currentTime + PREFETCH_SECONDS) {
+                await append(manifest.segments[next][0]);
+                next++;
+            }
+            if (next >= starts.length && mediaSource.readyState === "open") mediaSource.endOfStream();
+        } catch (e) {
+            console.log("Segment streaming:", e);
+        } finally {
+            busy = false;
+        }
+    }
+
+    mediaSource.addEventListener("sourceopen", async () => {
+        if (buffer) return;
+        buffer = mediaSource.addSourceBuffer(manifest.mime);
+        mediaSource.duration = total;
+        try {
+            await append(manifest.init);
+        } catch (e) {
+            console.log("Segment streaming:", e);
+            return;
+        }
+        pump();
+    });
+    ["timeupdate", "seeking", "play"].forEach(name => audio.addEventListener(name, pump));
+    if (window.ManagedMediaSource) audio.disableRemotePlayback = true;
+    audio.src = URL.createObjectURL(mediaSource);
+}
+
+for (const [audio, kind] of [[originalAudio, "original"], [accompanimentAudio, "accompaniment"]]) {
+    const manifest = SEGMENTS[kind];
+    if (manifest && MediaSourceImpl && MediaSourceImpl.isTypeSupported(manifest.mime)) {
+        streamSegments(audio, manifest);
+    } else if (audio.getAttribute("src")) {
+        audio.preload = "auto";
+        audio.load();
+    }
+}
+
+/* ================== AUDIO CONTEXT FIX ================== */
+async function ensureAudioContext() {
+    if (!audioContext) {
+        audioContext = new (window.AudioContext || window.webkitAudioContext)();
+    }
+    if (audioContext.state === "suspended") {
+        await audioContext.resume();
+    }
+}
+
+async function safePlay(audio) {
+    try {
+        await ensureAudioContext();
+        await audio.play();
+    } catch (e) {
+        console.log("Autoplay blocked:", e);
+    }
+}
+
+document.addEventListener("visibilitychange", async () => {
+    if (!document.hidden) await ensureAudioContext();
+});
+
+/* ================== MIC METER ================== */
+// Meter messages arrive from the worklet ~20 times a second; no per-frame work here
+function showMicLevel(level) {
+    micRms.style.width = meterPercent(level.rms) + "%";
+    micPeak.style.left = meterPercent(level.peak) + "%";
+    micMeter.classList.toggle("clip", level.clip);
+}
+
+levelerToggle.onchange = () => { if (micChain) micChain.setOption("compressor", levelerToggle.checked); };
+monitorToggle.onchange = () => { if (micChain) micChain.setMonitor(monitorToggle.checked); };
+
+/* ================== PLAY ORIGINAL ================== */
+playBtn.onclick = async () => {
+    await ensureAudioContext();
+    if (originalAudio.paused) {
+        originalAudio.currentTime = 0;
+        await safePlay(originalAudio);
+        trackEvent("play");
+        reportState("playing");
+        playBtn.innerText = "⏸ Pause";
+        status.innerText = "🎵 Playing song...";
+    } else {
+        originalAudio.pause();
+        reportState("paused");
+        playBtn.innerText = "▶ Play";
+        status.innerText = "⏸ Paused";
+    }
+};
+
+/* ================== WAVEFORM / PROGRESS ================== */
+const waveCanvas = document.getElementById("waveCanvas");
+const waveCtx = waveCanvas.getContext("2d");
+
+function songDuration() {
+    return TRACK.duration || originalAudio.duration || 0;
+}
+
+function drawWaveform() {
+    const w = waveCanvas.width, h = waveCanvas.height, mid = h / 2;
+    waveCtx.clearRect(0, 0, w, h);
+    const peaks = TRACK.peaks || [];
+    const n = peaks.length / 2;
+    const duration = songDuration();
+    const progress = duration ? Math.min(1, originalAudio.currentTime / duration) : 0;
+    if (!n) {
+        waveCtx.fillStyle = "rgba(255,255,255,0.25)";
+        waveCtx.fillRect(0, mid - 2, w, 4);
+        waveCtx.fillStyle = "#ff0066";
+        waveCtx.fillRect(0, mid - 2, w * progress, 4);
+        return;
+    }
+    const barW = w / n;
+    for (let i = 0; i < n; i++) {
+        const lo = peaks[2 * i], hi = peaks[2 * i + 1];
+        waveCtx.fillStyle = (i / n) < progress ? "#ff0066" : "rgba(255,255,255,0.35)";
+        waveCtx.fillRect(i * barW, mid - hi * mid, Math.max(1, barW - 0.5), Math.max(1, (hi - lo) * mid));
+    }
+}
+
+originalAudio.addEventListener("timeupdate", drawWaveform);
+originalAudio.addEventListener("loadedmetadata", drawWaveform);
+waveCanvas.onclick = (e) => {
+    const duration = songDuration();
+    if (!duration || isRecording) return;
+    const rect = waveCanvas.getBoundingClientRect();
+    originalAudio.currentTime = duration * (e.clientX - rect.left) / rect.width;
+    drawWaveform();
+};
+drawWaveform();
+
+/* ================== TIMED LYRICS (LRC) ================== */
+const LYRICS = TRACK.lyrics || [];
+const lyricsCurrent = document.getElementById("lyricsCurrent");
+const lyricsNext = document.getElementById("lyricsNext");
+let lyricsRafId = null;
+let shownLine = -2, shownWord = -2;
+
+// Position in song time: the backing track may be a tempo-shifted rendition
+function songTime() {
+    if (isRecording) return accompanimentAudio.currentTime * (TRACK.tempo || 1);
+    return originalAudio.currentTime;
+}
+
+function lineAt(t) {
+    let lo = 0, hi = LYRICS.length - 1, found = -1;
+    while (lo <= hi) {
+        const mid = (lo + hi) >> 1;
+        if (LYRICS[mid][0] <= t) { found = mid; lo = mid + 1; } else { hi = mid - 1; }
+    }
+    return found;
+}
+
+function wordAt(line, t) {
+    const words = line ? line[2] : [];
+    let n = -1;
+    while (n + 1 < words.length && words[n + 1][0] <= t) n++;
+    return n;
+}
+
+function escapeHtml(text) {
+    return text.replace(/[&<>"]/g, c => ({ "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;" }[c]));
+}
+
+// Only touches the DOM when the line (or sung word) changes
+function updateLyrics() {
+    const t = songTime();
+    const i = lineAt(t);
+    const w = wordAt(LYRICS[i], t);
+    if (i === shownLine && w === shownWord) return false;
+    shownLine = i;
+    shownWord = w;
+    const line = LYRICS[i];
+    if (line && line[2].length) {
+        lyricsCurrent.innerHTML = line[2].map((word, k) =>
+            k <= w ? '<span class="sung">' + escapeHtml(word[1]) + '</span>' : escapeHtml(word[1])).join(" ");
+    } else {
+        lyricsCurrent.textContent = line ? line[1] : "";
+    }
+    lyricsNext.textContent = LYRICS[i + 1] ? LYRICS[i + 1][1] : "";
+    return true;
+}
+
+function lyricsLoop() {
+    updateLyrics();
+    lyricsRafId = requestAnimationFrame(lyricsLoop);
+}
+
+function startLyrics() {
+    if (LYRICS.length && lyricsRafId === null) lyricsLoop();
+}
+
+function stopLyrics() {
+    if (lyricsRafId !== null) cancelAnimationFrame(lyricsRafId);
+    lyricsRafId = null;
+    if (LYRICS.length) updateLyrics();
+}
+
+if (LYRICS.length) {
+    originalAudio.addEventListener("play", startLyrics);
+    originalAudio.addEventListener("pause", stopLyrics);
+    originalAudio.addEventListener("seeked", updateLyrics);
+    accompanimentAudio.addEventListener("play", startLyrics);
+    updateLyrics();
+}
+
+/* ================== CANVAS DRAW (DJANGO MATCH) ================== */
+// Background + logo are painted once into a layer; each frame only the lyric line changes
+let canvasLayer = null;
+let canvasLine = -2, canvasWord = -2, canvasPaintedAt = 0;
+
+function paintCanvasLayer() {
+    canvasLayer = document.createElement("canvas");
+    canvasLayer.width = canvas.width;
+    canvasLayer.height = canvas.height;
+    const lctx = canvasLayer.getContext("2d");
+    lctx.fillStyle = "#000";
+    lctx.fillRect(0, 0, canvas.width, canvas.height);
+
+    if (mainBg.complete && mainBg.naturalWidth) {
+        const canvasW = canvas.width;
+        const canvasH = canvas.height * 0.85;
+
+        const imgRatio = mainBg.naturalWidth / mainBg.naturalHeight;
+        const canvasRatio = canvasW / canvasH;
+
+        let drawW, drawH;
+        if (imgRatio > canvasRatio) {
+            drawW = canvasW;
+            drawH = canvasW / imgRatio;
+        } else {
+            drawH = canvasH;
+            drawW = canvasH * imgRatio;
+        }
+
+        const x = (canvasW - drawW) / 2;
+        const y = 0; // TOP aligned
+
+        lctx.drawImage(mainBg, x, y, drawW, drawH);
+    }
+
+    /* LOGO — exact Django feel */
+    lctx.globalAlpha = 0.6;
+    lctx.drawImage(logoImg, 20, 20, 60, 60);
+    lctx.globalAlpha = 1;
+}
+
+function drawLyricLine() {
+    const t = songTime();
+    const i = lineAt(t);
+    const line = LYRICS[i];
+    if (!line) return;
+    const w = wordAt(line, t);
+    ctx.font = "bold 64px Poppins, sans-serif";
+    ctx.textAlign = "left";
+    ctx.textBaseline = "middle";
+    ctx.shadowColor = "black";
+    ctx.shadowBlur = 12;
+    const words = line[2].length ? line[2].map(x => x[1]) : [line[1]];
+    const text = words.join(" ");
+    let x = (canvas.width - ctx.measureText(text).width) / 2;
+    const y = canvas.height * 0.72;
+    words.forEach((word, k) => {
+        ctx.fillStyle = line[2].length && k <= w ? "#ff66cc" : "#fff";
+        ctx.fillText(word, x, y);
+        x += ctx.measureText(word + " ").width;
+    });
+    if (LYRICS[i + 1]) {
+        ctx.font = "40px Poppins, sans-serif";
+        ctx.textAlign = "center";
+        ctx.fillStyle = "rgba(255,255,255,0.55)";
+        ctx.fillText(LYRICS[i + 1][1], canvas.width / 2, y + 80);
+    }
+    ctx.shadowBlur = 0;
+}
+
+function drawCanvas() {
+    if (!canvasLayer) paintCanvasLayer();
+    const t = songTime();
+    const i = lineAt(t);
+    const w = wordAt(LYRICS[i], t);
+    const now = performance.now();
+    // Repaint on a lyric change, plus once a second so the captured stream keeps producing frames
+    if (i !== canvasLine || w !== canvasWord || now - canvasPaintedAt > 1000) {
+        canvasLine = i;
+        canvasWord = w;
+        canvasPaintedAt = now;
+        ctx.drawImage(canvasLayer, 0, 0);
+        if (LYRICS.length) drawLyricLine();
+    }
+    canvasRafId = requestAnimationFrame(drawCanvas);
+}
+
+/* ================== SERVER RENDER (media_server.py) ================== */
+const RENDER = TRACK.render;
+
+function takeParams(extra) {
+    return new URLSearchParams({ song: RENDER.song, expires: RENDER.expires, token: RENDER.token, ...extra });
+}
+
+async function postTake(path, blob, extra) {
+    const res = await fetch(RENDER.api + path + "?" + takeParams(extra), {
+        method: "POST",
+        headers: { "Content-Type": blob.type || "audio/webm" },
+        body: blob
+    });
+    if (!res.ok) throw new Error("upload failed (" + res.status + ")");
+    return (await res.json()).job_id;
+}
+
+async function pollJob(jobId, onDone, onFail) {
+    try {
+        const res = await fetch(RENDER.api + "/api/jobs/" + encodeURIComponent(jobId));
+        const job = await res.json();
+        if (job.status === "done") return onDone(job);
+        if (job.status === "failed" || !res.ok) return onFail(job);
+    } catch (e) {
+        console.log("Job poll failed:", e);
+    }
+    setTimeout(() => pollJob(jobId, onDone, onFail), 1500);
+}
+
+async function uploadTakeForRender(blob) {
+    renderStatus.innerText = "⏳ Uploading your take...";
+    downloadRecordingBtn.style.display = "none";
+    const audioOnly = () => {
+        renderStatus.innerText = "⚠️ Video render unavailable, audio download only";
+        downloadRecordingBtn.style.display = "inline-block";
+    };
+    try {
+        const jobId = await postTake("/api/takes", blob, { tempo: TRACK.tempo || 1 });
+        renderStatus.innerText = "🎬 Rendering video...";
+        pollJob(jobId, job => {
+            renderStatus.innerText = "✅ Video ready";
+            if (currentTake) {
+                currentTake.video_url = job.url;
+                reportState("finished", { take: currentTake });
+            }
+            downloadRecordingBtn.href = job.url;
+            downloadRecordingBtn.download = "karaoke_" + Date.now() + ".mp4";
+            downloadRecordingBtn.style.display = "inline-block";
+        }, audioOnly);
+    } catch (e) {
+        console.log("Render upload failed:", e);
+        audioOnly();
+    }
+}
+
+/* ================== ANALYTICS (analytics.py via media_server.py) ================== */
+// Fire-and-forget beacons; the server buffers them and writes in batches.
+// Listen-only pages have no RENDER, only this analytics-only token
+const EVENTS = TRACK.events || RENDER;
+function trackEvent(event, extra) {
+    if (!EVENTS || !navigator.sendBeacon) return;
+    const session = TRACK.session || {};
+    navigator.sendBeacon(EVENTS.api + "/api/events", JSON.stringify({
+        event: event, song: EVENTS.song, expires: EVENTS.expires, token: EVENTS.token,
+        user: session.user, role: session.role, session: session.id, extra: extra || null
+    }));
+}
+
+/* ================== HOST STATE (persistent Streamlit component) ================== */
+// The component bootstrap defines window.onPlayerState; the standalone guest page does not
+function reportState(state, extra) {
+    if (window.onPlayerState) window.onPlayerState(state, extra || {});
+}
+
+/* ================== SINGING SCORE (pitch.py) ================== */
+async function uploadVocalForScore(blob) {
+    scoreDisplay.innerText = "🎯 Scoring...";
+    try {
+        const jobId = await postTake("/api/scores", blob, { key: TRACK.key || 0, tempo: TRACK.tempo || 1 });
+        pollJob(jobId, job => showScore(job.result), () => { scoreDisplay.innerText = ""; });
+    } catch (e) {
+        console.log("Score upload failed:", e);
+        scoreDisplay.innerText = "";
+    }
+}
+
+function showScore(result) {
+    if (!result || !result.phrases.length) {
+        scoreDisplay.innerText = "";
+        return;
+    }
+    if (currentTake) {
+        currentTake.score = { score: result.score, pitch: result.pitch, timing: result.timing };
+        reportState("finished", { take: currentTake });
+    }
+    const best = result.phrases.reduce((a, b) => (b.score > a.score ? b : a));
+    scoreDisplay.innerHTML = "🎯 Score " + result.score +
+        "<small>Pitch " + result.pitch + " · Timing " + result.timing +
+        " · Best phrase at " + Math.floor(best.start / 60) + ":" + String(Math.floor(best.start % 60)).padStart(2, "0") +
+        " (" + best.score + ")</small>";
+}
+
+/* ================== RECORD ================== */
+recordBtn.onclick = async () => {
+    if (isRecording || LISTEN_ONLY) return;
+    isRecording = true;
+
+    await ensureAudioContext();
+    recordedChunks = [];
+
+    /* MIC */
+    const micStream = await navigator.mediaDevices.getUserMedia({ audio: true });
+    if (micChain) micChain.disconnect();
+    micChain = await createMicChain(audioContext, micStream, showMicLevel,
+                                    { compressor: levelerToggle.checked });
+    micChain.setMonitor(monitorToggle.checked);
+    micMeter.style.display = "block";
+
+    /* ACCOMPANIMENT: tap the playing element (streamed), never decode the whole track */
+    if (!accSource) {
+        // Once routed into the graph the element only sounds through it
+        accSource = audioContext.createMediaElementSource(accompanimentAudio);
+        accSource.connect(audioContext.destination);
+    }
+
+    const destination = audioContext.createMediaStreamDestination();
+    micChain.output.connect(destination);
+    // Element output already carries GAINS.accompaniment through its volume
+    accTap = audioContext.createGain();
+    accSource.connect(accTap).connect(destination);
+
+    let stream;
+    if (RENDER) {
+        // Audio only: the server renders the video from the lyrics image
+        stream = destination.stream;
+    } else {
+        canvas.width = 1920;
+        canvas.height = 1080;
+        canvasLayer = null;
+        canvasLine = -2;
+        drawCanvas();
+        stream = new MediaStream([
+            ...canvas.captureStream(30).getTracks(),
+            ...destination.stream.getTracks()
+        ]);
+    }
+
+    mediaRecorder = new MediaRecorder(stream);
+    mediaRecorder.ondataavailable = e => e.data.size && recordedChunks.push(e.data);
+
+    // Mic-only copy of the take for pitch scoring
+    vocalChunks = [];
+    let vocalStream = micStream;
+    if (RENDER && micChain.processed) {
+        const vocalDest = audioContext.createMediaStreamDestination();
+        micChain.output.connect(vocalDest);
+        vocalStream = vocalDest.stream;
+    }
+    vocalRecorder = RENDER ? new MediaRecorder(vocalStream) : null;
+    if (vocalRecorder) {
+        const recorder = vocalRecorder;
+        recorder.ondataavailable = e => e.data.size && vocalChunks.push(e.data);
+        recorder.onstop = () => {
+            uploadVocalForScore(new Blob(vocalChunks, { type: recorder.mimeType || "audio/webm" }));
+        };
+    }
+
+    mediaRecorder.onstop = () => {
+        cancelAnimationFrame(canvasRafId);
+
+        const blob = new Blob(recordedChunks, { type: RENDER ? (mediaRecorder.mimeType || "audio/webm") : "video/webm" });
+        const url = URL.createObjectURL(blob);
+
+        if (lastRecordingURL) URL.revokeObjectURL(lastRecordingURL);
+        lastRecordingURL = url;
+
+        finalBg.src = mainBg.src;
+        finalDiv.style.display = "flex";
+
+        downloadRecordingBtn.href = url;
+        downloadRecordingBtn.download = "karaoke_" + Date.now() + ".webm";
+        renderStatus.innerText = "";
+        trackEvent("record_complete", { bytes: blob.size });
+        currentTake = { bytes: blob.size, key: TRACK.key || 0, tempo: TRACK.tempo || 1 };
+        reportState("finished", { take: currentTake });
+        if (RENDER) uploadTakeForRender(blob);
+
+        playRecordingBtn.onclick = () => {
+            if (!isPlayingRecording) {
+                playRecordingAudio = new Audio(url);
+                playRecordingAudio.play();
+                playRecordingBtn.innerText = "⏹ Stop";
+                isPlayingRecording = true;
+                playRecordingAudio.onended = resetPlayBtn;
+            } else {
+                resetPlayBtn();
+            }
+        };
+    };
+
+    mediaRecorder.start();
+    if (vocalRecorder) vocalRecorder.start();
+    trackEvent("record_start", { key: TRACK.key || 0, tempo: TRACK.tempo || 1 });
+    reportState("recording");
+
+    originalAudio.currentTime = 0;
+    accompanimentAudio.currentTime = 0;
+    // The guide vocal would clash with a key/tempo shifted backing track
+    if (!TRACK.shifted) await safePlay(originalAudio);
+    await safePlay(accompanimentAudio);
+
+    playBtn.style.display = "none";
+    recordBtn.style.display = "none";
+    stopBtn.style.display = "inline-block";
+    status.innerText = "🎙 Recording...";
+    
+    // ✅ AUTOMATIC STOP: Set timeout to stop recording when song ends
+    const durationMs = songDuration() / (TRACK.tempo || 1) * 1000; // Precomputed at ingest, so never NaN once analyzed
+    if (durationMs) {
+        setTimeout(() => {
+            if (isRecording) {
+                stopBtn.click(); // Automatically click stop button
+            }
+        }, durationMs + 500); // Add 500ms buffer
+    }
+};
+
+/* ================== STOP ================== */
+stopBtn.onclick = () => {
+    if (!isRecording) return;
+    isRecording = false;
+
+    try { mediaRecorder.stop(); } catch {}
+    try { if (vocalRecorder) vocalRecorder.stop(); } catch {}
+    try { accSource.disconnect(accTap); } catch {}
+
+    originalAudio.pause();
+    accompanimentAudio.pause();
+    stopLyrics();
+    if (micChain) {
+        micChain.disconnect();
+        micChain = null;
+    }
+    micMeter.style.display = "none";
+
+    stopBtn.style.display = "none";
+    status.innerText = "⏹ Processing...";
+};
+
+downloadRecordingBtn.addEventListener("click", () => trackEvent("download"));
+
+/* ================== HELPERS ================== */
+function resetPlayBtn() {
+    if (playRecordingAudio) {
+        playRecordingAudio.pause();
+        playRecordingAudio.currentTime = 0;
+    }
+    playRecordingBtn.innerText = "▶ Play Recording";
+    isPlayingRecording = false;
+}
+
+/* ================== NEW RECORDING ================== */
+newRecordingBtn.onclick = () => {
+    finalDiv.style.display = "none";
+
+    recordedChunks = [];
+    isRecording = false;
+    isPlayingRecording = false;
+
+    originalAudio.pause();
+    accompanimentAudio.pause();
+    originalAudio.currentTime = 0;
+    accompanimentAudio.currentTime = 0;
+
+    if (playRecordingAudio) {
+        playRecordingAudio.pause();
+        playRecordingAudio = null;
+    }
+    renderStatus.innerText = "";
+    scoreDisplay.innerText = "";
+    downloadRecordingBtn.style.display = "inline-block";
+    currentTake = null;
+    reportState("idle");
+
+    playBtn.style.display = "inline-block";
+    recordBtn.style.display = LISTEN_ONLY ? "none" : "inline-block";
+    stopBtn.style.display = "none";
+    playBtn.innerText = "▶ Play";
+    status.innerText = "Ready 🎤";
+};
+
+/* ================== SONG END DETECTION ================== */
+originalAudio.addEventListener('ended', () => {
+    if (isRecording) {
+        // If recording is still active when song ends, stop it
+        setTimeout(() => {
+            if (isRecording) {
+                stopBtn.click();
+            }
+        }, 100);
+    } else {
+        playBtn.innerText = "▶ Play";
+        reportState("idle");
+    }
+});
+
+accompanimentAudio.addEventListener('ended', () => {
+    if (isRecording) {
+        // If recording is still active when accompaniment ends, stop it
+        setTimeout(() => {
+            if (isRecording) {
+                stopBtn.click();
+            }
+        }, 100);
+    }
+});
+</script>
+</body>
+</html>
+"""
+
+
+COMPONENT_BOOTSTRAP = """
+<script>
+/* ================== STREAMLIT COMPONENT BOOTSTRAP (player.py) ================== */
+(function () {
+    let playerId = null;
+    function send(type, data) {
+        window.parent.postMessage(Object.assign({ isStreamlitMessage: true, type: type }, data), "*");
+    }
+    window.onPlayerState = (state, extra) => send("streamlit:setComponentValue", {
+        value: Object.assign({ state: state, at: Date.now() }, extra), dataType: "json"
+    });
+    window.addEventListener("message", event => {
+        if (!event.data || event.data.type !== "streamlit:render") return;
+        const props = event.data.args;
+        if (playerId === null) {
+            if (!props.sources) {
+                // Remounted after Python already sent this player's sources
+                window.onPlayerState("need_sources", { player_id: props.player_id });
+                return;
+            }
+            playerId = props.player_id;
+            window.PLAYER_PROPS = props;
+            document.querySelectorAll("[data-src-prop]").forEach(el => {
+                if (props.sources[el.dataset.srcProp]) el.src = props.sources[el.dataset.srcProp];
+            });
+            const script = document.createElement("script");
+            script.textContent = document.getElementById("playerScript").textContent;
+            document.body.appendChild(script);
+        } else if (props.player_id !== playerId) {
+            // Another song or key/tempo: start over with the new assets
+            location.reload();
+            return;
+        }
+        send("streamlit:setFrameHeight", { height: props.height });
+    });
+    send("streamlit:componentReady", { apiVersion: 1 });
+})();
+</script>
+"""
+
+
+def image_mime(key):
+    return "image/png" if key.endswith(".png") else "image/jpeg"
+
+
+def render_player(lyrics_src, logo_src, original_src, accompaniment_src, track):
+    """Fill the player template; track is the TRACK object (dict or JSON text)"""
+    track_json = track if isinstance(track, str) else json.dumps(track)
+    page = PLAYER_TEMPLATE.replace("%%LYRICS_SRC%%", lyrics_src or "")
+    page = page.replace("%%LOGO_SRC%%", logo_src or "")
+    page = page.replace("%%ORIGINAL_SRC%%", original_src or "")
+    page = page.replace("%%ACCOMP_SRC%%", accompaniment_src or "")
+    # Keep "</script>" inside JSON strings from closing the script tag
+    page = page.replace("%%TRACK_INFO%%", track_json.replace("</", "<\\/"))
+    return page.replace("%%MIC_CHAIN_JS%%", mic_processing.MIC_CHAIN_JS)
+
+
+def component_page():
+    """The player as a static component page: sources and TRACK come from the props"""
+    page = re.sub(r' src="%%(\w+)%%"', lambda m: f' data-src-prop="{m.group(1).lower()}"', PLAYER_TEMPLATE)
+    page = page.replace("<script>\n%%MIC_CHAIN_JS%%", '<script type="text/x-player" id="playerScript">\n%%MIC_CHAIN_JS%%')
+    page = page.replace("const TRACK = %%TRACK_INFO%%;", "const TRACK = window.PLAYER_PROPS.track;")
+    page = page.replace("%%MIC_CHAIN_JS%%", mic_processing.MIC_CHAIN_JS)
+    return page.replace("</body>", COMPONENT_BOOTSTRAP + "</body>")
+
+
+def build_component(directory):
+    """Write the component's index.html (only when it changed); returns the directory"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "index.html")
+    page = component_page()
+    try:
+        with open(path, encoding="utf-8") as f:
+            if f.read() == page:
+                return directory
+    except OSError:
+        pass
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(page)
+    return directory
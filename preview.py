@@ -0,0 +1,125 @@
+"""Short preview clips for the song listings.
+
+At ingest the original is summarised as one feature vector per
+``HOP_SECONDS``: log energies of ``N_BANDS`` log-spaced bands.  The chorus
+is guessed as the window of ``PREVIEW_SECONDS`` that is both loud and
+repeated most strongly elsewhere in the song, measured on the
+self-similarity matrix of those vectors.  ``PREVIEW_OFFSET`` (seconds)
+skips the detection and always cuts from a fixed offset.
+
+The clip is cut straight from the original by ffmpeg as a small mono file
+(MP3 by default, Opus with ``PREVIEW_CODEC=opus``) with short fades.
+"""
+import os
+
+import ffmpeg
+import numpy as np
+
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", "25"))
+PREVIEW_OFFSET = os.getenv("PREVIEW_OFFSET", "")
+PREVIEW_CODEC = os.getenv("PREVIEW_CODEC", "mp3")
+HOP_SECONDS = 0.5
+N_BANDS = 16
+MIN_REPEAT_SECONDS = 10.0
+FADE_SECONDS = 1.0
+
+CODECS = {
+    "mp3": {"ext": "mp3", "mime": "audio/mpeg", "acodec": "libmp3lame", "audio_bitrate": "48k"},
+    "opus": {"ext": "webm", "mime": "audio/webm", "acodec": "libopus", "audio_bitrate": "32k"},
+}
+
+
+def codec_settings(name=PREVIEW_CODEC):
+    return CODECS.get(name, CODECS["mp3"])
+
+
+class PreviewFeatures:
+    """Accumulate per-hop band energies from streamed PCM blocks"""
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.hop = int(sample_rate * HOP_SECONDS)
+        freqs = np.fft.rfftfreq(self.hop, 1.0 / sample_rate)
+        edges = np.geomspace(60.0, min(8000.0, sample_rate / 2), N_BANDS + 1)
+        self.band = np.clip(np.searchsorted(edges, freqs) - 1, -1, N_BANDS)
+        self.in_range = (self.band >= 0) & (self.band < N_BANDS)
+        self.pending = np.zeros(0, np.float32)
+        self.rows = []
+
+    def add(self, block):
+        mono = block.mean(axis=1) if block.ndim > 1 else block
+        data = np.concatenate([self.pending, mono])
+        n = len(data) // self.hop
+        self.pending = data[n * self.hop:]
+        if not n:
+            return
+        power = np.abs(np.fft.rfft(data[:n * self.hop].reshape(n, self.hop), axis=1)) ** 2
+        bands = np.zeros((n, N_BANDS))
+        for b in range(N_BANDS):
+            bands[:, b] = power[:, self.band == b].sum(axis=1)
+        self.rows.append(bands)
+
+    def features(self):
+        return np.concatenate(self.rows) if self.rows else np.zeros((0, N_BANDS))
+
+
+def _window_mean(values, width):
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    return (csum[width:] - csum[:-width]) / width
+
+
+def find_chorus(bands, clip_seconds=PREVIEW_SECONDS):
+    """Start time (seconds) of the loudest, most repeated clip-long window"""
+    n = len(bands)
+    width = max(1, int(clip_seconds / HOP_SECONDS))
+    if n <= width:
+        return 0.0
+
+    log_bands = np.log10(bands + 1e-10)
+    energy = log_bands.max(axis=1)
+    feats = log_bands - log_bands.mean(axis=0)
+    feats /= np.linalg.norm(feats, axis=1, keepdims=True) + 1e-9
+    similarity = feats @ feats.T
+
+    # repeat[t]: best match of the window at t with the same-length window `lag` hops away
+    starts = n - width + 1
+    repeat = np.full(starts, -1.0)
+    for lag in range(int(MIN_REPEAT_SECONDS / HOP_SECONDS), n - width + 1):
+        diagonal = _window_mean(np.diagonal(similarity, lag), width)   # windows at t vs t+lag
+        repeat[:len(diagonal)] = np.maximum(repeat[:len(diagonal)], diagonal)
+        repeat[lag:lag + len(diagonal)] = np.maximum(repeat[lag:lag + len(diagonal)], diagonal)
+
+    loudness = _window_mean(energy, width)
+    zscore = lambda v: (v - v.mean()) / (v.std() + 1e-9)
+    score = zscore(repeat) + zscore(loudness)
+    # Intros and outros are rarely the hook
+    positions = np.arange(starts) / max(1, n)
+    score[(positions < 0.1) | (positions > 0.8)] -= 10.0
+    return float(np.argmax(score) * HOP_SECONDS)
+
+
+def preview_start(bands, duration):
+    """Configured offset, or the detected chorus"""
+    if PREVIEW_OFFSET:
+        return max(0.0, min(float(PREVIEW_OFFSET), max(0.0, duration - PREVIEW_SECONDS)))
+    return find_chorus(bands)
+
+
+def cut_preview(source_path, output_path, start, seconds=PREVIEW_SECONDS, codec=PREVIEW_CODEC):
+    """Cut a faded mono clip of source_path to output_path"""
+    settings = codec_settings(codec)
+    audio = (
+        ffmpeg.input(source_path, ss=start, t=seconds)
+        .audio
+        .filter("afade", type="in", duration=FADE_SECONDS)
+        .filter("afade", type="out", start_time=max(0.0, seconds - FADE_SECONDS), duration=FADE_SECONDS)
+    )
+    (
+        ffmpeg
+        .output(audio, output_path, acodec=settings["acodec"], audio_bitrate=settings["audio_bitrate"],
+                ac=1, vn=None)
+        .global_args("-nostdin", "-loglevel", "error")
+        .overwrite_output()
+        .run()
+    )
+    return output_path
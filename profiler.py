@@ -0,0 +1,163 @@
+"""Per-rerun profiling for the admin Debug Info panel.
+
+Every run of the script is timed by phase (``PhaseTimer``, a handful of
+``perf_counter`` calls, always on).  On request the panel arms a
+``Capture`` in the admin's session that profiles the next N reruns with
+``cProfile`` -- and, optionally, diffs ``tracemalloc`` snapshots taken at
+the start and end of each run to show which lines allocated the most
+(e.g. the base64 strings of inlined media).  The merged profile can be
+downloaded in pstats format for ``python -m pstats`` / snakeviz offline.
+
+Only the armed session's script thread is profiled.  tracemalloc is
+process-wide, so it is started only while some capture wants it and
+stopped again when the last one finishes.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+import tracemalloc
+
+ALLOCATION_FRAMES = 1
+ALLOCATION_TOP = 15
+
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+def _tracemalloc_acquire():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if not _tracemalloc_users and not tracemalloc.is_tracing():
+            tracemalloc.start(ALLOCATION_FRAMES)
+        _tracemalloc_users += 1
+
+
+def _tracemalloc_release():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users = max(0, _tracemalloc_users - 1)
+        if not _tracemalloc_users and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class PhaseTimer:
+    """Wall time of the named phases of one script run"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = []
+
+    def mark(self, name):
+        """End the current phase under this name"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def rows(self):
+        return [{"Phase": name, "ms": round(seconds * 1000, 1)} for name, seconds in self.phases]
+
+
+class Capture:
+    """cProfile (and optionally tracemalloc) over the next `runs` reruns of one session"""
+
+    def __init__(self, runs=5, allocations=False):
+        self.requested = runs
+        self.remaining = runs
+        self.allocations = allocations
+        self.runs = []
+        self.stats = None
+        self.allocation_diff = []
+        self._profile = None
+        self._snapshot = None
+        self._started = None
+
+    @property
+    def done(self):
+        return not self.remaining and not self._profile
+
+    def begin(self):
+        # A run that ended in st.stop()/st.rerun() never reached end(): keep what it profiled
+        if self._profile:
+            self.end(partial=True)
+        if not self.remaining:
+            return
+        if self.allocations:
+            _tracemalloc_acquire()
+            self._snapshot = tracemalloc.take_snapshot()
+        self._started = time.perf_counter()
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError:
+            # Another capture is profiling right now (one profiler per process on 3.12+)
+            self._profile = None
+            if self._snapshot is not None:
+                self._snapshot = None
+                _tracemalloc_release()
+
+    def end(self, phases=None, partial=False):
+        if not self._profile:
+            return
+        self._profile.disable()
+        seconds = time.perf_counter() - self._started
+        if self.stats is None:
+            self.stats = pstats.Stats(self._profile, stream=io.StringIO())
+        else:
+            self.stats.add(self._profile)
+        self._profile = None
+
+        if self._snapshot is not None:
+            diff = tracemalloc.take_snapshot().compare_to(self._snapshot, "lineno")
+            self._snapshot = None
+            _tracemalloc_release()
+            self._merge_allocations(diff)
+
+        self.remaining -= 1
+        self.runs.append({"run": len(self.runs) + 1,
+                          "ms": round(seconds * 1000, 1) if not partial else None,
+                          "partial": partial,
+                          "phases": phases.rows() if phases else []})
+
+    def _merge_allocations(self, diff):
+        totals = {row["Location"]: row for row in self.allocation_diff}
+        for stat in diff:
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            location = f"{frame.filename}:{frame.lineno}"
+            row = totals.setdefault(location, {"Location": location, "KiB": 0.0, "Blocks": 0})
+            row["KiB"] = round(row["KiB"] + stat.size_diff / 1024, 1)
+            row["Blocks"] += stat.count_diff
+        self.allocation_diff = sorted(totals.values(), key=lambda r: r["KiB"], reverse=True)[:ALLOCATION_TOP]
+
+    def cancel(self):
+        if self._profile:
+            self._profile.disable()
+            self._profile = None
+        if self._snapshot is not None:
+            self._snapshot = None
+            _tracemalloc_release()
+        self.remaining = 0
+
+    def top_functions(self, limit=25, sort="cumulative"):
+        """Rows of the heaviest functions across the captured runs"""
+        if self.stats is None:
+            return []
+        key = {"cumulative": 3, "tottime": 2, "calls": 1}[sort]
+        rows = []
+        for (filename, lineno, name), (cc, nc, tt, ct, _) in self.stats.stats.items():
+            rows.append((f"{name} ({filename}:{lineno})", nc, tt, ct))
+        rows.sort(key=lambda r: r[key], reverse=True)
+        return [{"Function": fn, "Calls": nc, "Own ms": round(tt * 1000, 2), "Total ms": round(ct * 1000, 2)}
+                for fn, nc, tt, ct in rows[:limit]]
+
+    def pstats_bytes(self):
+        """The merged profile in the format of pstats.Stats.dump_stats()"""
+        return marshal.dumps(self.stats.stats) if self.stats is not None else b""
@@ -0,0 +1,119 @@
+"""Key and tempo shifted renditions of a song's accompaniment.
+
+A rendition is made in one streaming pass: the accompaniment is
+time-stretched by ``pitch / tempo`` with the phase vocoder, then handed to
+ffmpeg as if it were recorded at ``sample_rate * pitch`` and resampled back
+to the original rate.  Playing it faster by ``pitch`` raises every
+frequency by that factor and undoes the extra stretch, so the result is
+shifted by the requested semitones at the requested tempo.
+
+Renditions are stored under ``renditions/`` keyed by a hash of the
+accompaniment content plus the parameters, so a re-uploaded backing track
+never serves a stale rendition and repeat requests are a storage lookup.
+The media sweeper evicts the least recently used ones once the cache is
+over its quota (``touch`` on every hit keeps popular keys around).
+"""
+import hashlib
+import os
+import tempfile
+
+import audio_io
+import media_lifecycle
+import media_storage
+import pcm_cache
+from spectral import PhaseVocoder
+
+SEMITONE_RANGE = (-6, 6)
+TEMPO_RANGE = (0.8, 1.2)
+TEMPO_STEP = 0.05
+RENDITION_PREFIX = "renditions/"
+
+
+def normalize(semitones, tempo):
+    """Validate and round parameters so equal requests share a cache entry"""
+    semitones = int(round(float(semitones)))
+    tempo = round(round(float(tempo) / TEMPO_STEP) * TEMPO_STEP, 2)
+    if not SEMITONE_RANGE[0] <= semitones <= SEMITONE_RANGE[1]:
+        raise ValueError(f"Key shift must be between {SEMITONE_RANGE[0]} and {SEMITONE_RANGE[1]} semitones")
+    if not TEMPO_RANGE[0] <= tempo <= TEMPO_RANGE[1]:
+        raise ValueError(f"Tempo must be between {TEMPO_RANGE[0]}x and {TEMPO_RANGE[1]}x")
+    return semitones, tempo
+
+
+def is_identity(semitones, tempo):
+    return semitones == 0 and tempo == 1.0
+
+
+def tempo_choices():
+    lo, hi = (int(round(v / TEMPO_STEP)) for v in TEMPO_RANGE)
+    return [round(i * TEMPO_STEP, 2) for i in range(lo, hi + 1)]
+
+
+def content_hash(storage, key):
+    """sha1 of a stored object (hashing the local copy in 1 MB chunks)"""
+    digest = hashlib.sha1()
+    with open(storage.local_path(key), "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def rendition_key(source_hash, semitones, tempo):
+    return f"{RENDITION_PREFIX}{source_hash[:16]}_k{semitones:+d}_t{tempo:.2f}.mp3"
+
+
+def cached_rendition(storage, source_hash, semitones, tempo):
+    """Key of an existing rendition (marked as used), or ''"""
+    key = rendition_key(source_hash, semitones, tempo)
+    if not storage.exists(key):
+        return ""
+    if isinstance(storage, media_storage.LocalStorage):
+        media_lifecycle.touch(storage.local_path(key))
+    return key
+
+
+def render(source_path, output_path, semitones, tempo, bitrate="192k", media_dir=None):
+    """Write the shifted rendition of source_path to output_path"""
+    info = audio_io.probe(source_path)
+    sample_rate = info["sample_rate"]
+    channels = min(2, info["channels"]) or 2
+    pitch = 2.0 ** (semitones / 12.0)
+    vocoder = PhaseVocoder(pitch / tempo, channels)
+    # The resample ratio sets the pitch; the rounded analysis hop only nudges the tempo
+    input_rate = int(round(sample_rate * pitch))
+    blocks = pcm_cache.iter_pcm(media_dir, source_path, sample_rate, channels, info)
+    with audio_io.PcmWriter(output_path, input_rate, channels, bitrate=bitrate,
+                            extra={"ar": sample_rate}) as writer:
+        for block in blocks:
+            out = vocoder.process(block)
+            if len(out):
+                writer.write(out)
+        tail = vocoder.flush()
+        if len(tail):
+            writer.write(tail)
+    return output_path
+
+
+def render_rendition(media_dir, song_name, semitones, tempo):
+    """Job entry point: make (or reuse) a rendition of the accompaniment; returns its key"""
+    semitones, tempo = normalize(semitones, tempo)
+    storage = media_storage.storage_from_env(media_dir)
+    source_key = f"songs/{song_name}_accompaniment.mp3"
+    if is_identity(semitones, tempo):
+        return source_key
+
+    source_hash = content_hash(storage, source_key)
+    key = cached_rendition(storage, source_hash, semitones, tempo)
+    if key:
+        return key
+
+    key = rendition_key(source_hash, semitones, tempo)
+    fd, tmp_path = tempfile.mkstemp(suffix=".mp3", dir=os.path.join(media_dir, "temp"))
+    os.close(fd)
+    try:
+        render(storage.local_path(source_key), tmp_path, semitones, tempo, media_dir=media_dir)
+        with open(tmp_path, "rb") as f:
+            storage.put(key, f, "audio/mpeg")
+    finally:
+        os.remove(tmp_path)
+    return key
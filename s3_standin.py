@@ -0,0 +1,313 @@
+"""A small in-process S3 stand-in, and a check of S3Storage against it.
+
+    python s3_standin.py                    # run the S3Storage checks, print ok/FAIL per operation
+    python s3_standin.py --serve --port 9000   # keep serving (MEDIA_STORAGE=s3 against it)
+
+The server keeps objects in memory and speaks just the path-style subset
+media_storage.S3Storage uses: PUT / GET (with Range) / HEAD / DELETE of
+objects and ListObjectsV2 (``prefix``, ``continuation-token``; pages of
+``--page-size`` keys, small by default so pagination is exercised).  Every
+request's SigV4 signature -- the Authorization header, or the query of a
+presigned ``url_for`` URL -- is recomputed here independently of the
+client's signer from what actually arrived on the wire, so URL encoding
+and canonical-request mistakes show up as 403s.
+
+To run the app or the checks against a real server instead, MinIO::
+
+    docker run -p 9000:9000 -e MINIO_ROOT_USER=minio -e MINIO_ROOT_PASSWORD=minio123 \\
+        minio/minio server /data
+    # create the bucket once (mc, or the console on :9001), then
+    MEDIA_STORAGE=s3 S3_BUCKET=karaoke S3_ENDPOINT_URL=http://127.0.0.1:9000 \\
+        S3_ACCESS_KEY_ID=minio S3_SECRET_ACCESS_KEY=minio123 python s3_standin.py --endpoint env
+"""
+import argparse
+import datetime
+import hashlib
+import hmac
+import os
+import sys
+import tempfile
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+import media_storage
+
+ACCESS_KEY = "standin"
+SECRET_KEY = "standin-secret"
+REGION = "us-east-1"
+BUCKET = "karaoke"
+PAGE_SIZE = 3
+XMLNS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+# =============== SIGV4 (server side) ===============
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def _signature(secret_key, datestamp, region, string_to_sign):
+    key = _hmac(_hmac(_hmac(_hmac(f"AWS4{secret_key}".encode(), datestamp), region), "s3"), "aws4_request")
+    return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+def _canonical_query(pairs):
+    encoded = [(quote(k, safe="-_.~"), quote(v, safe="-_.~")) for k, v in pairs]
+    return "&".join(f"{k}={v}" for k, v in sorted(encoded))
+
+
+def verify_request(method, raw_path, headers, body, secret_key=SECRET_KEY):
+    """None if the request is correctly signed, else the reason"""
+    path, _, raw_query = raw_path.partition("?")
+    query = parse_qsl(raw_query, keep_blank_values=True)
+    lowered = {k.lower(): v for k, v in headers.items()}
+
+    if "X-Amz-Signature" in dict(query):
+        # Presigned URL: everything is in the query, the payload is not signed
+        params = dict(query)
+        credential = params["X-Amz-Credential"].split("/")
+        amz_date, signed_headers = params["X-Amz-Date"], params["X-Amz-SignedHeaders"]
+        given = params["X-Amz-Signature"]
+        issued = datetime.datetime.strptime(amz_date, "%Y%m%dT%H%M%SZ").replace(tzinfo=datetime.timezone.utc)
+        if issued + datetime.timedelta(seconds=int(params["X-Amz-Expires"])) < \
+                datetime.datetime.now(datetime.timezone.utc):
+            return "presigned URL expired"
+        query = [(k, v) for k, v in query if k != "X-Amz-Signature"]
+        payload_hash = "UNSIGNED-PAYLOAD"
+    else:
+        auth = lowered.get("authorization", "")
+        if not auth.startswith("AWS4-HMAC-SHA256 "):
+            return "no SigV4 authorization"
+        fields = dict(part.strip().split("=", 1) for part in auth[len("AWS4-HMAC-SHA256 "):].split(","))
+        credential = fields["Credential"].split("/")
+        signed_headers, given = fields["SignedHeaders"], fields["Signature"]
+        amz_date = lowered.get("x-amz-date", "")
+        payload_hash = lowered.get("x-amz-content-sha256", "")
+        if payload_hash != hashlib.sha256(body).hexdigest():
+            return "x-amz-content-sha256 does not match the body"
+
+    access_key, datestamp, region = credential[0], credential[1], credential[2]
+    if access_key != ACCESS_KEY:
+        return "unknown access key"
+    names = signed_headers.split(";")
+    if "host" not in names or any(n not in lowered for n in names):
+        return "signed headers missing from the request"
+    canonical_headers = "".join(f"{n}:{' '.join(lowered[n].split())}\n" for n in names)
+    canonical_request = "\n".join([method, path, _canonical_query(query), canonical_headers,
+                                   signed_headers, payload_hash])
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, f"{datestamp}/{region}/s3/aws4_request",
+                                hashlib.sha256(canonical_request.encode()).hexdigest()])
+    if not hmac.compare_digest(_signature(secret_key, datestamp, region, string_to_sign), given):
+        return "signature mismatch"
+    return None
+
+
+# =============== SERVER ===============
+class StandInS3(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), page_size=PAGE_SIZE):
+        super().__init__(address, _Handler)
+        self.objects = {}  # (bucket, key) -> (bytes, content type)
+        self.page_size = page_size
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status, code, message=""):
+        body = (f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code>'
+                f"<Message>{escape(message)}</Message></Error>").encode()
+        self._send(status, body, {"Content-Type": "application/xml"})
+
+    def _handle(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        problem = verify_request(self.command, self.path, dict(self.headers), body)
+        if problem:
+            return self._error(403, "SignatureDoesNotMatch", problem)
+        path, _, raw_query = self.path.partition("?")
+        bucket, _, key = unquote(path).lstrip("/").partition("/")
+        store = self.server.objects
+        if not key:
+            if self.command == "GET":
+                return self._list(bucket, dict(parse_qsl(raw_query)))
+            return self._error(405, "MethodNotAllowed")
+
+        if self.command == "PUT":
+            with self.server.lock:
+                store[(bucket, key)] = (body, self.headers.get("Content-Type", "binary/octet-stream"))
+            return self._send(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        if self.command == "DELETE":
+            with self.server.lock:
+                store.pop((bucket, key), None)
+            return self._send(204)
+        item = store.get((bucket, key))
+        if item is None:
+            return self._error(404, "NoSuchKey", key)
+        data, content_type = item
+        headers = {"Content-Type": content_type, "Accept-Ranges": "bytes"}
+        byte_range = self.headers.get("Range")
+        if byte_range and self.command == "GET":
+            start, _, end = byte_range[len("bytes="):].partition("-")
+            start, end = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+            if start >= len(data) or start > end:
+                return self._error(416, "InvalidRange")
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return self._send(206, data[start:end + 1], headers)
+        if self.command == "HEAD":
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            return
+        return self._send(200, data, headers)
+
+    def _list(self, bucket, params):
+        if params.get("list-type") != "2":
+            return self._error(400, "InvalidArgument", "only ListObjectsV2")
+        prefix = params.get("prefix", "")
+        keys = sorted(k for b, k in self.server.objects if b == bucket and k.startswith(prefix))
+        after = params.get("continuation-token", "")
+        if after:
+            keys = [k for k in keys if k > after]
+        page, rest = keys[:self.server.page_size], keys[self.server.page_size:]
+        parts = [f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="{XMLNS}">',
+                 f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>",
+                 f"<KeyCount>{len(page)}</KeyCount><IsTruncated>{'true' if rest else 'false'}</IsTruncated>"]
+        if rest:
+            parts.append(f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>")
+        for key in page:
+            parts.append(f"<Contents><Key>{escape(key)}</Key>"
+                         f"<Size>{len(self.server.objects[(bucket, key)][0])}</Size></Contents>")
+        parts.append("</ListBucketResult>")
+        self._send(200, "".join(parts).encode(), {"Content-Type": "application/xml"})
+
+    do_GET = do_PUT = do_HEAD = do_DELETE = _handle
+
+
+def start(page_size=PAGE_SIZE, port=0):
+    """A running stand-in on 127.0.0.1 (port 0: any free one); stop with .shutdown()"""
+    server = StandInS3(("127.0.0.1", port), page_size=page_size)
+    threading.Thread(target=server.serve_forever, name="s3-standin", daemon=True).start()
+    return server
+
+
+# =============== CHECKS ===============
+def run_checks(storage, out=sys.stdout):
+    """Exercise every S3Storage operation the app uses; returns the number of failures"""
+    failures = 0
+    keys = ["songs/Song A_original.mp3", "songs/Pāṭa #1_original.mp3", "songs/b+c_accompaniment.mp3",
+            "songs/x_original.mp3", "lyrics_images/Song A_lyrics_bg.jpg"]
+    payloads = {key: os.urandom(1000 + i) for i, key in enumerate(keys)}
+
+    def check(name, fn):
+        nonlocal failures
+        try:
+            problem = fn()
+        except Exception as e:
+            problem = f"{type(e).__name__}: {e}"
+        print(f"{'ok  ' if not problem else 'FAIL'} {name}" + (f": {problem}" if problem else ""), file=out)
+        failures += bool(problem)
+
+    def put():
+        for key, data in payloads.items():
+            storage.put(key, data, media_storage.guess_content_type(key))
+
+    def get():
+        bad = [k for k, data in payloads.items() if storage.get(k) != data]
+        return f"wrong bytes for {bad}" if bad else None
+
+    def ranges():
+        key, data = keys[0], payloads[keys[0]]
+        got = [storage.open_range(key, 10, 19), storage.open_range(key, 990), storage.open_range(key, 0, 0)]
+        return None if got == [data[10:20], data[990:], data[:1]] else "wrong range bytes"
+
+    def head():
+        if not storage.exists(keys[1]) or storage.exists("songs/missing.mp3"):
+            return "exists() is wrong"
+        return None if storage.size(keys[1]) == len(payloads[keys[1]]) else "size() is wrong"
+
+    def listing():
+        # More keys than one page, so continuation tokens are followed
+        got = storage.list("songs/")
+        want = sorted(k for k in keys if k.startswith("songs/"))
+        return None if got == want else f"list gave {got}"
+
+    def presigned():
+        with urllib.request.urlopen(storage.url_for(keys[1], expires_in=60), timeout=10) as resp:
+            return None if resp.read() == payloads[keys[1]] else "presigned GET returned other bytes"
+
+    def local_copy():
+        with open(storage.local_path(keys[2]), "rb") as f:
+            return None if f.read() == payloads[keys[2]] else "cached copy differs"
+
+    def delete():
+        storage.delete(keys[3])
+        storage.delete("songs/never-existed.mp3")
+        if storage.exists(keys[3]):
+            return "still there after delete"
+        try:
+            storage.get(keys[3])
+        except media_storage.StorageError:
+            return None
+        return "get() of a deleted key did not raise"
+
+    for name, fn in (("put", put), ("get", get), ("open_range", ranges), ("exists/size", head),
+                     ("list (paginated)", listing), ("url_for (presigned)", presigned),
+                     ("local_path", local_copy), ("delete", delete)):
+        check(name, fn)
+    for key in keys:
+        storage.delete(key)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="In-process S3 stand-in and S3Storage checks")
+    parser.add_argument("--serve", action="store_true", help="keep serving instead of running the checks")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="keys per ListObjectsV2 page")
+    parser.add_argument("--endpoint", choices=("standin", "env"), default="standin",
+                        help="env: check the S3 configured by MEDIA_STORAGE=s3 variables instead")
+    args = parser.parse_args(argv)
+
+    if args.endpoint == "env":
+        with tempfile.TemporaryDirectory() as media_dir:
+            return 1 if run_checks(media_storage.storage_from_env(media_dir)) else 0
+
+    server = start(page_size=args.page_size, port=args.port)
+    if args.serve:
+        print(f"S3 stand-in on {server.endpoint_url}: S3_BUCKET={BUCKET} S3_ACCESS_KEY_ID={ACCESS_KEY} "
+              f"S3_SECRET_ACCESS_KEY={SECRET_KEY} (objects in memory; Ctrl-C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return 0
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            storage = media_storage.S3Storage(BUCKET, server.endpoint_url, ACCESS_KEY, SECRET_KEY,
+                                              region=REGION, prefix="media", cache_dir=cache_dir)
+            return 1 if run_checks(storage) else 0
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
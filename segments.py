@@ -0,0 +1,139 @@
+"""Segmented (HLS-style) copies of the song tracks for streaming playback.
+
+A whole 4-5 MB MP3 has to partly download before ``<audio>`` starts, and
+the old record path decoded the entire backing track into one
+``AudioBuffer``.  At ingest every original and accompaniment is also
+encoded as fragmented MP4 (AAC) in ``SEGMENT_SECONDS`` chunks:
+
+* ``segments/<sha1[:16]>/init.mp4``, ``seg_00000.m4s``, ... and a VOD
+  ``index.m3u8`` playlist, keyed by the content hash of the source, so the
+  objects never change and are served with a long, immutable lifetime;
+* ``analysis/<song>_<kind>.segments.json`` -- the manifest the pages read:
+  codec, init key and ``[key, duration]`` per segment.
+
+The encoder is fed the PCM blocks of the single ingest decode pass (see
+``SegmentAnalyzer`` in ingest.py).  The player appends segments to a
+MediaSource a little ahead of the playhead and removes what has been
+played, so time to first note and client memory no longer depend on the
+length of the song.  Key/tempo renditions are not segmented; they stay on
+progressive download.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import ffmpeg
+
+import media_storage
+
+SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", "4"))
+SEGMENT_BITRATE = os.getenv("SEGMENT_BITRATE", "160k")
+SEGMENT_MIME = 'audio/mp4; codecs="mp4a.40.2"'
+SEGMENT_PREFIX = "segments/"
+PLAYLIST_NAME = "index.m3u8"
+INIT_NAME = "init.mp4"
+
+
+def segment_prefix(digest):
+    return f"{SEGMENT_PREFIX}{digest[:16]}/"
+
+
+def start_encoder(out_dir, sample_rate, channels):
+    """ffmpeg reading float32 PCM on stdin and writing an fMP4 HLS playlist to out_dir"""
+    return (
+        ffmpeg
+        .input("pipe:", format="f32le", ar=sample_rate, ac=channels)
+        .output(os.path.join(out_dir, PLAYLIST_NAME), format="hls", acodec="aac",
+                audio_bitrate=SEGMENT_BITRATE, hls_time=SEGMENT_SECONDS,
+                hls_playlist_type="vod", hls_segment_type="fmp4",
+                hls_fmp4_init_filename=INIT_NAME,
+                hls_segment_filename=os.path.join(out_dir, "seg_%05d.m4s"))
+        .global_args("-nostdin", "-loglevel", "error")
+        .overwrite_output()
+        .run_async(pipe_stdin=True)
+    )
+
+
+def parse_playlist(text):
+    """[(segment name, seconds)] of a VOD playlist"""
+    segments, duration = [], None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",")[0])
+        elif line and not line.startswith("#") and duration is not None:
+            segments.append((line, duration))
+            duration = None
+    return segments
+
+
+def store_segments(storage, out_dir, digest):
+    """Upload an encoded playlist directory; returns the manifest"""
+    prefix = segment_prefix(digest)
+    with open(os.path.join(out_dir, PLAYLIST_NAME), encoding="utf-8") as f:
+        playlist = f.read()
+    segments = parse_playlist(playlist)
+    if not segments:
+        raise ValueError("encoder produced no segments")
+    for name in [INIT_NAME] + [name for name, _ in segments]:
+        with open(os.path.join(out_dir, name), "rb") as f:
+            storage.put(prefix + name, f, "audio/mp4" if name == INIT_NAME else "video/iso.segment")
+    # Playlist last: its presence means the set is complete
+    storage.put(prefix + PLAYLIST_NAME, playlist.encode("utf-8"), "application/vnd.apple.mpegurl")
+    return {
+        "hash": digest,
+        "mime": SEGMENT_MIME,
+        "init": prefix + INIT_NAME,
+        "segments": [[prefix + name, round(seconds, 3)] for name, seconds in segments],
+        "duration": round(sum(seconds for _, seconds in segments), 3),
+    }
+
+
+class SegmentEncoder:
+    """Streamed encode of one track: feed PCM blocks, then finish() to store"""
+
+    def __init__(self, sample_rate, channels):
+        self.out_dir = tempfile.mkdtemp(prefix="segments-")
+        self.process = start_encoder(self.out_dir, sample_rate, channels)
+        self.failed = False
+
+    def add(self, block):
+        if self.failed:
+            return
+        try:
+            self.process.stdin.write(block.astype("<f4", copy=False).tobytes())
+        except (BrokenPipeError, OSError):
+            self.failed = True
+
+    def finish(self, storage, digest):
+        try:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            if self.process.wait() != 0 or self.failed:
+                raise RuntimeError("segment encoder failed")
+            return store_segments(storage, self.out_dir, digest)
+        finally:
+            shutil.rmtree(self.out_dir, ignore_errors=True)
+
+
+def load_manifest(storage, key):
+    try:
+        return json.loads(storage.get(key))
+    except (media_storage.StorageError, ValueError):
+        return None
+
+
+def signed_manifest(manifest, url_for):
+    """The manifest with URLs for the player (url_for(key) -> URL or None), or None"""
+    if not manifest:
+        return None
+    init = url_for(manifest["init"])
+    if not init:
+        return None
+    urls = [[url_for(key), seconds] for key, seconds in manifest["segments"]]
+    if not all(url for url, _ in urls):
+        return None
+    return {"mime": manifest["mime"], "init": init, "segments": urls, "duration": manifest["duration"]}
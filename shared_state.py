@@ -0,0 +1,200 @@
+"""Cross-process cache and invalidation for running several app workers.
+
+With ``WEB_CONCURRENCY`` > 1 (see cluster.py) there are N Streamlit
+processes on one host, each with its own ``st.cache_data``.  These pieces
+keep them coherent without duplicating the work N times:
+
+* ``Epochs`` -- a one-page memory-mapped file of 64-bit counters, one per
+  namespace in ``NAMESPACES``.  ``bump()`` is an increment under an
+  ``flock``; ``get()`` is a plain read of shared memory, cheap enough for
+  every rerun.  Cached functions take the current epoch as an argument, so
+  when any process (an admin's worker, or an ingest job) bumps a
+  namespace, every worker's cache misses on its next call.  No polling and
+  no messages.
+* ``SharedCache`` -- SQLite (WAL) key/value store of pickled values with an
+  expiry, tagged with the namespace epoch they were computed under.  Per
+  process caches sit on top of it, so each sidecar read or content hash is
+  computed once per host instead of once per worker.
+* ``JobBoard`` -- status/result of background jobs by key, so a poll for
+  a job reaches its status whichever process (uvicorn worker) submitted it.
+
+All of these live in ``SHARED_STATE_DIR`` (default ``media/shared_state``) so the
+job processes, which only know ``media_dir``, can reach them.
+"""
+import mmap
+import json
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes run a single process anyway
+    fcntl = None
+
+NAMESPACES = ("shared_links", "catalog", "tracks", "lyrics")
+EPOCH_FILE_BYTES = 4096
+PURGE_EVERY_WRITES = 500
+JOB_BOARD_KEEP_SECONDS = 86400
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def state_dir(media_dir):
+    return os.getenv("SHARED_STATE_DIR", os.path.join(media_dir, "shared_state"))
+
+
+class Epochs:
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < EPOCH_FILE_BYTES:
+            os.ftruncate(self._fd, EPOCH_FILE_BYTES)
+        self._map = mmap.mmap(self._fd, EPOCH_FILE_BYTES)
+
+    def _offset(self, namespace):
+        return 8 * NAMESPACES.index(namespace)
+
+    def get(self, namespace):
+        return struct.unpack_from("<Q", self._map, self._offset(namespace))[0]
+
+    def snapshot(self):
+        return tuple(self.get(namespace) for namespace in NAMESPACES)
+
+    def bump(self, *namespaces):
+        """Invalidate these namespaces in every process on the host"""
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for namespace in namespaces:
+                offset = self._offset(namespace)
+                value = struct.unpack_from("<Q", self._map, offset)[0]
+                struct.pack_into("<Q", self._map, offset, value + 1)
+        finally:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class SharedCache:
+    def __init__(self, db_path, epochs):
+        self.db_path = db_path
+        self.epochs = epochs
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS cache
+                        (key TEXT PRIMARY KEY,
+                         namespace TEXT,
+                         epoch INTEGER,
+                         expires REAL,
+                         value BLOB)''')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_or_compute(self, namespace, key, compute, ttl):
+        """Value of key from any process if still valid, else compute() and store it"""
+        epoch = self.epochs.get(namespace)
+        now = time.time()
+        try:
+            row = self._conn().execute('SELECT epoch, expires, value FROM cache WHERE key = ?',
+                                       (key,)).fetchone()
+            if row and row[0] == epoch and row[1] > now:
+                return pickle.loads(row[2])
+        except (sqlite3.Error, pickle.UnpicklingError):
+            pass
+
+        value = compute()
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO cache (key, namespace, epoch, expires, value) VALUES (?, ?, ?, ?, ?)',
+                             (key, namespace, epoch, now + ttl, pickle.dumps(value)))
+                self._writes += 1
+                if self._writes % PURGE_EVERY_WRITES == 0:
+                    conn.execute('DELETE FROM cache WHERE expires < ?', (now,))
+        except sqlite3.Error:
+            pass
+        return value
+
+
+class JobBoard:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                        (key TEXT PRIMARY KEY,
+                         status TEXT,
+                         submitted REAL,
+                         finished REAL,
+                         result TEXT,
+                         error TEXT)''')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def publish(self, job):
+        """Record a JobQueue job record (its result must be JSON-serializable)"""
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO jobs (key, status, submitted, finished, result, error) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (job["key"], job["status"], job["submitted"], job["finished"],
+                              json.dumps(job["result"]), job["error"]))
+                self._writes += 1
+                if self._writes % PURGE_EVERY_WRITES == 0:
+                    conn.execute('DELETE FROM jobs WHERE finished < ?', (time.time() - JOB_BOARD_KEEP_SECONDS,))
+        except (sqlite3.Error, TypeError, ValueError):
+            pass
+
+    def get(self, key):
+        try:
+            row = self._conn().execute('SELECT status, submitted, finished, result, error FROM jobs WHERE key = ?',
+                                       (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if not row:
+            return None
+        return {"key": key, "status": row[0], "submitted": row[1], "finished": row[2],
+                "result": json.loads(row[3]) if row[3] else None, "error": row[4]}
+
+
+def open_job_board(media_dir):
+    directory = state_dir(media_dir)
+    os.makedirs(directory, exist_ok=True)
+    return JobBoard(os.path.join(directory, "cache.db"))
+
+
+def open_state(media_dir):
+    """(Epochs, SharedCache) for this host, one pair per process"""
+    directory = state_dir(media_dir)
+    with _states_lock:
+        if directory not in _states:
+            os.makedirs(directory, exist_ok=True)
+            epochs = Epochs(os.path.join(directory, "epochs"))
+            _states[directory] = (epochs, SharedCache(os.path.join(directory, "cache.db"), epochs))
+        return _states[directory]
+
+
+def invalidate(media_dir, *namespaces):
+    open_state(media_dir)[0].bump(*namespaces)
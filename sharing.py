@@ -0,0 +1,257 @@
+"""Shared-link lookups used by both the Streamlit app and media_server.py.
+
+A song is shared when it has an active row in the ``shared_links`` table of
+the session database or an active ``media/shared_links/<song>.json`` file;
+the database wins when both exist.  Writes stay in app.py (admins only);
+this module is read-only so the guest player can check access without
+importing Streamlit.
+
+Share tokens are the stateless alternative to ``?song=`` links::
+
+    base64url({"s": song, "e": expires, "c": scope, "i": id, "t": issued}) . base64url(hmac)
+
+(HMAC-SHA256 truncated to 128 bits).  Verifying one is a signature check
+plus a lookup in the process's ``RevocationSet`` -- no directory scan, no
+query -- so it costs microseconds.  ``scope`` is ``record`` (sing and
+record) or ``play`` (listen only); ``expires`` 0 means never.  A token can
+be revoked on its own, and unsharing a song revokes every token issued for
+it before that moment.  Revocations live in the ``share_revocations``
+table and are re-read at most every ``REVOCATION_REFRESH_SECONDS``.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+SHARE_SCOPES = ("record", "play")
+# Issue and revocation times share this resolution (µs): a link minted right after an
+# unshare, even in the same second, is newer than the cut-off
+STAMP_DIGITS = 6
+REVOCATION_REFRESH_SECONDS = 30
+
+
+def load_shared_links_from_db(db_path):
+    """Load shared links from database"""
+    links = {}
+    try:
+        conn = sqlite3.connect(db_path)
+        c = conn.cursor()
+        c.execute('SELECT song_name, shared_by FROM shared_links WHERE active = 1')
+        results = c.fetchall()
+        conn.close()
+
+        for song_name, shared_by in results:
+            links[song_name] = {"shared_by": shared_by, "active": True}
+    except:
+        pass
+    return links
+
+
+def load_shared_links(shared_links_dir, db_path):
+    """Load shared links from both file and database"""
+    file_links = {}
+    if os.path.exists(shared_links_dir):
+        for filename in os.listdir(shared_links_dir):
+            if filename.endswith('.json'):
+                song_name = filename[:-5]
+                filepath = os.path.join(shared_links_dir, filename)
+                try:
+                    with open(filepath, 'r') as f:
+                        data = json.load(f)
+                        if data.get("active", True):
+                            file_links[song_name] = data
+                except:
+                    pass
+
+    # Merge with database links
+    file_links.update(load_shared_links_from_db(db_path))
+    return file_links
+
+
+def is_shared(shared_links_dir, db_path, song_name):
+    """Access check for guests: is this one song currently shared?"""
+    if not song_name or "/" in song_name or "\\" in song_name or song_name.startswith("."):
+        return False
+    try:
+        conn = sqlite3.connect(db_path)
+        row = conn.execute('SELECT 1 FROM shared_links WHERE song_name = ? AND active = 1',
+                           (song_name,)).fetchone()
+        conn.close()
+        if row:
+            return True
+    except:
+        pass
+    filepath = os.path.join(shared_links_dir, f"{song_name}.json")
+    try:
+        with open(filepath, 'r') as f:
+            return bool(json.load(f).get("active", True))
+    except (OSError, ValueError):
+        return False
+
+
+# =============== SHARE TOKENS ===============
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(secret, payload):
+    return hmac.new(secret.encode(), payload, hashlib.sha256).digest()[:16]
+
+
+def take_token_key(song_name, scope="record"):
+    """Media key a player's upload/analytics token is signed for; the scope is part of it"""
+    return f"takes/{scope}/{song_name}"
+
+
+def _stamp():
+    return round(time.time(), STAMP_DIGITS)
+
+
+def mint_share_token(secret, song_name, expires_in=None, scope="record"):
+    """(token, claims) for a song; expires_in seconds, None = never"""
+    if scope not in SHARE_SCOPES:
+        raise ValueError(f"Unknown share scope: {scope}")
+    now = _stamp()
+    claims = {"s": song_name, "e": int(now) + int(expires_in) if expires_in else 0, "c": scope,
+              "i": uuid.uuid4().hex[:12], "t": now}
+    payload = json.dumps(claims, separators=(",", ":"), ensure_ascii=False).encode()
+    return f"{_b64(payload)}.{_b64(_sign(secret, payload))}", claims
+
+
+def verify_share_token(secret, token, revocations=None, now=None):
+    """The token's claims if it is authentic, unexpired and not revoked, else None"""
+    if not secret or not token or "." not in token:
+        return None
+    body, _, signature = token.partition(".")
+    try:
+        payload = _unb64(body)
+        if not hmac.compare_digest(_sign(secret, payload), _unb64(signature)):
+            return None
+        claims = json.loads(payload)
+    except (ValueError, TypeError):
+        return None
+    now = time.time() if now is None else now
+    if claims.get("e") and claims["e"] < now:
+        return None
+    if revocations is not None and revocations.is_revoked(claims):
+        return None
+    return claims
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('''CREATE TABLE IF NOT EXISTS share_revocations
+                    (token_id TEXT,
+                     song_name TEXT,
+                     revoked_at REAL,
+                     expires REAL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS share_tokens
+                    (token_id TEXT PRIMARY KEY,
+                     song_name TEXT,
+                     scope TEXT,
+                     label TEXT,
+                     expires REAL,
+                     created_by TEXT,
+                     created_at REAL,
+                     token TEXT)''')
+    return conn
+
+
+class RevocationSet:
+    """In-memory copy of share_revocations: revoked token ids and per-song cut-offs"""
+
+    def __init__(self, db_path, refresh_seconds=REVOCATION_REFRESH_SECONDS):
+        self.db_path = db_path
+        self.refresh_seconds = refresh_seconds
+        self._ids = frozenset()
+        self._songs = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        if not force and time.time() - self._loaded_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if not force and time.time() - self._loaded_at < self.refresh_seconds:
+                return
+            try:
+                conn = _connect(self.db_path)
+                try:
+                    # Read only: this runs on the guest request path (pruning is done on insert)
+                    rows = conn.execute('SELECT token_id, song_name, revoked_at FROM share_revocations').fetchall()
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                rows = None
+            if rows is not None:
+                self._ids = frozenset(token_id for token_id, _, _ in rows if token_id)
+                songs = {}
+                for token_id, song_name, revoked_at in rows:
+                    if not token_id and song_name:
+                        songs[song_name] = max(songs.get(song_name, 0), revoked_at)
+                self._songs = songs
+            self._loaded_at = time.time()
+
+    def is_revoked(self, claims):
+        self.refresh()
+        if claims.get("i") in self._ids:
+            return True
+        # Tokens issued before the song's cut-off; ones from the same instant on stay valid
+        return claims.get("t", 0) < self._songs.get(claims.get("s"), -1)
+
+    def _insert(self, rows):
+        conn = _connect(self.db_path)
+        try:
+            with conn:
+                conn.executemany('INSERT INTO share_revocations (token_id, song_name, revoked_at, expires) VALUES (?, ?, ?, ?)',
+                                 rows)
+                # Expired tokens fail verification anyway; keep the set compact
+                conn.execute('DELETE FROM share_revocations WHERE expires > 0 AND expires < ?', (time.time(),))
+        finally:
+            conn.close()
+        self.refresh(force=True)
+
+    def revoke_token(self, token_id, expires=0):
+        self._insert([(token_id, None, _stamp(), expires or 0)])
+
+    def revoke_songs(self, song_names):
+        """Revoke every token issued so far for these songs"""
+        now = _stamp()
+        self._insert([(None, song_name, now, 0) for song_name in song_names])
+
+
+def record_token(db_path, token, claims, label="", created_by=""):
+    """Log a minted token for the admin list (verification never reads this)"""
+    conn = _connect(db_path)
+    try:
+        with conn:
+            conn.execute('''INSERT OR REPLACE INTO share_tokens
+                            (token_id, song_name, scope, label, expires, created_by, created_at, token)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                         (claims["i"], claims["s"], claims["c"], label, claims["e"], created_by,
+                          claims["t"], token))
+    finally:
+        conn.close()
+
+
+def list_tokens(db_path, include_expired=False):
+    """Minted tokens, newest first, as dicts"""
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute('''SELECT token_id, song_name, scope, label, expires, created_by, created_at, token
+                               FROM share_tokens ORDER BY created_at DESC''').fetchall()
+    finally:
+        conn.close()
+    fields = ("token_id", "song_name", "scope", "label", "expires", "created_by", "created_at", "token")
+    now = time.time()
+    return [dict(zip(fields, row)) for row in rows
+            if include_expired or not row[4] or row[4] >= now]
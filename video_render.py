@@ -0,0 +1,113 @@
+"""Server-side render of a finished take: lyrics image + logo + mixed audio -> MP4.
+
+The browser used to redraw a 1920x1080 canvas every frame and encode it
+with MediaRecorder.  The picture is a still image, so here it is encoded
+once with x264's ``stillimage`` tuning at a low frame rate and a long GOP:
+almost all of the bitrate goes to the first keyframe and the rest of the
+video costs next to nothing to encode or store.
+
+Layout matches the old canvas: lyrics image scaled to fit the top 85 % of
+the frame, centred horizontally, logo at (20, 20) with 60 % opacity.  Songs
+with timed lyrics get them burned in as subtitles; the subtitle frames are
+the only ones that change, so the still-image savings mostly survive.
+"""
+import os
+import tempfile
+
+import ffmpeg
+
+import lyrics
+import media_lifecycle
+import media_storage
+
+FINAL_WIDTH = int(os.getenv("FINAL_VIDEO_WIDTH", "1920"))
+FINAL_HEIGHT = int(os.getenv("FINAL_VIDEO_HEIGHT", "1080"))
+FINAL_FPS = 2
+FINAL_CRF = 28
+LOGO_SIZE = 60
+LOGO_OPACITY = 0.6
+LYRICS_EXTS = (".jpg", ".jpeg", ".png")
+SUBTITLE_STYLE = "Fontsize=28,Bold=1,Alignment=2,MarginV=120,Outline=2,Shadow=1"
+
+
+def find_lyrics_key(storage, song_name):
+    for ext in LYRICS_EXTS:
+        key = f"lyrics_images/{song_name}_lyrics_bg{ext}"
+        if storage.exists(key):
+            return key
+    return ""
+
+
+def render_video(audio_path, output_path, image_path=None, logo_path=None,
+                 width=FINAL_WIDTH, height=FINAL_HEIGHT, subtitles_path=None):
+    """Encode a still-image MP4 with the given audio"""
+    if image_path:
+        video = (
+            ffmpeg.input(image_path, loop=1, framerate=FINAL_FPS)
+            .filter("scale", width, int(height * 0.85), force_original_aspect_ratio="decrease")
+            .filter("pad", width, height, "(ow-iw)/2", 0, color="black")
+        )
+    else:
+        video = ffmpeg.input(f"color=c=black:s={width}x{height}:r={FINAL_FPS}", f="lavfi")
+
+    if logo_path and os.path.exists(logo_path):
+        logo = (
+            ffmpeg.input(logo_path, loop=1, framerate=FINAL_FPS)
+            .filter("scale", LOGO_SIZE, LOGO_SIZE)
+            .filter("format", "rgba")
+            .filter("colorchannelmixer", aa=LOGO_OPACITY)
+        )
+        video = ffmpeg.overlay(video, logo, x=20, y=20)
+
+    if subtitles_path:
+        video = video.filter("subtitles", subtitles_path, force_style=SUBTITLE_STYLE)
+
+    audio = ffmpeg.input(audio_path).audio
+    (
+        ffmpeg
+        .output(video, audio, output_path,
+                vcodec="libx264", tune="stillimage", preset="veryfast", crf=FINAL_CRF,
+                pix_fmt="yuv420p", r=FINAL_FPS, g=FINAL_FPS * 10,
+                acodec="aac", audio_bitrate="192k",
+                movflags="+faststart", shortest=None)
+        .global_args("-nostdin", "-loglevel", "error")
+        .overwrite_output()
+        .run()
+    )
+    return output_path
+
+
+def render_final(media_dir, song_name, audio_path, logo_path=None, tempo=1.0):
+    """Job entry point: render a take and store it under finals/; returns the key"""
+    storage = media_storage.storage_from_env(media_dir)
+    lyrics_key = find_lyrics_key(storage, song_name)
+    image_path = storage.local_path(lyrics_key) if lyrics_key else None
+
+    temp_dir = os.path.join(media_dir, "temp")
+    fd, tmp_path = tempfile.mkstemp(suffix=".mp4", dir=temp_dir)
+    os.close(fd)
+    srt_path = None
+    rows = lyrics.load_lyrics(storage, song_name)
+    if rows:
+        fd, srt_path = tempfile.mkstemp(suffix=".srt", dir=temp_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(lyrics.to_srt(rows, tempo))
+    try:
+        try:
+            render_video(audio_path, tmp_path, image_path, logo_path, subtitles_path=srt_path)
+        except ffmpeg.Error:
+            if not srt_path:
+                raise
+            # ffmpeg built without libass: fall back to the plain still image
+            render_video(audio_path, tmp_path, image_path, logo_path)
+        key = media_storage.new_final_key("mp4")
+        with open(tmp_path, "rb") as f:
+            storage.put(key, f, "video/mp4")
+        if isinstance(storage, media_storage.LocalStorage):
+            # final_<uuid> names say nothing about the song: the sweeper reads this instead
+            media_lifecycle.record_owner(storage.local_path(key), song_name)
+    finally:
+        os.remove(tmp_path)
+        if srt_path:
+            os.remove(srt_path)
+    return key
@@ -0,0 +1,64 @@
+"""Background cache warm-up for shared songs.
+
+After a restart every per-process cache is empty, so the first guest on
+each shared link would pay for the storage listing, sidecar reads, media
+URL signing and any rendition renders.  (Inlined base64 media is not
+warmed: it would pin megabytes per song in every worker.)  ``CacheWarmer``
+is a daemon thread that takes song names from a queue and runs the app's
+``warm_fn`` for them, most popular first, so none of that happens on a
+guest's request -- and the server is ready immediately because nothing
+waits for it.
+"""
+import threading
+import time
+
+
+class CacheWarmer(threading.Thread):
+    def __init__(self, warm_fn, priority_fn=None):
+        super().__init__(name="cache-warmer", daemon=True)
+        self.warm_fn = warm_fn
+        # priority_fn() -> {song: score}; higher scores are warmed first
+        self.priority_fn = priority_fn
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self.warmed = 0
+        self.errors = {}
+        self.last_run = None
+
+    def enqueue(self, song_names):
+        with self._lock:
+            self._pending.update(s for s in song_names if s)
+        self._wake.set()
+
+    def _next_batch(self):
+        with self._lock:
+            batch, self._pending = self._pending, set()
+        if not batch:
+            return []
+        try:
+            scores = self.priority_fn() if self.priority_fn else {}
+        except Exception:
+            scores = {}
+        return sorted(batch, key=lambda s: (-scores.get(s, 0), s))
+
+    def run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            started = time.time()
+            for song_name in self._next_batch():
+                try:
+                    self.warm_fn(song_name)
+                    self.warmed += 1
+                    self.errors.pop(song_name, None)
+                except Exception as e:
+                    self.errors[song_name] = f"{type(e).__name__}: {e}"
+            self.last_run = {"started": started, "seconds": round(time.time() - started, 2)}
+
+
+def start_warmer(warm_fn, priority_fn=None, initial=()):
+    warmer = CacheWarmer(warm_fn, priority_fn)
+    warmer.start()
+    warmer.enqueue(initial)
+    return warmer
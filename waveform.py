@@ -0,0 +1,153 @@
+"""Waveform peaks and duration metadata, stored as a small binary sidecar.
+
+Sidecar layout (little endian)::
+
+    magic  b"KPK1"
+    header  <I sample_rate> <H channels> <H levels> <I bitrate>
+            <d duration> <Q frames>
+    levels  repeated: <I samples_per_peak> <I count>
+                      count x (int8 min, int8 max)
+
+Level 0 has one min/max pair per ``BASE_SAMPLES_PER_PEAK`` frames, every
+following level halves the resolution, down to roughly ``MIN_LEVEL_PEAKS``
+pairs.  A 5 minute song takes about 50 KB.
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b"KPK1"
+HEADER = struct.Struct("<IHHIdQ")
+LEVEL_HEADER = struct.Struct("<II")
+BASE_SAMPLES_PER_PEAK = 1024
+MIN_LEVEL_PEAKS = 256
+
+
+class PeakAccumulator:
+    """Collects min/max peaks from streamed PCM blocks"""
+
+    def __init__(self, samples_per_peak=BASE_SAMPLES_PER_PEAK):
+        self.samples_per_peak = samples_per_peak
+        self.frames = 0
+        self._mins = []
+        self._maxs = []
+        self._carry = np.zeros(0, dtype=np.float32)
+
+    def add(self, block):
+        """block: float32 (frames, channels) or (frames,)"""
+        if block.ndim == 2:
+            lo, hi = block.min(axis=1), block.max(axis=1)
+        else:
+            lo = hi = block
+        self.frames += len(lo)
+        # Interleave lo/hi so one carry buffer serves both
+        stacked = np.concatenate([self._carry, np.stack([lo, hi], axis=1).ravel()])
+        spp2 = self.samples_per_peak * 2
+        usable = len(stacked) - len(stacked) % spp2
+        if usable:
+            windows = stacked[:usable].reshape(-1, self.samples_per_peak, 2)
+            self._mins.append(windows[:, :, 0].min(axis=1))
+            self._maxs.append(windows[:, :, 1].max(axis=1))
+        self._carry = stacked[usable:]
+
+    def finish(self):
+        """Return (mins, maxs) float32 arrays for level 0"""
+        mins, maxs = list(self._mins), list(self._maxs)
+        if len(self._carry):
+            tail = self._carry.reshape(-1, 2)
+            mins.append(tail[:, 0].min(keepdims=True))
+            maxs.append(tail[:, 1].max(keepdims=True))
+        if not mins:
+            return np.zeros(0, np.float32), np.zeros(0, np.float32)
+        return np.concatenate(mins), np.concatenate(maxs)
+
+
+def build_levels(mins, maxs, samples_per_peak=BASE_SAMPLES_PER_PEAK,
+                 min_peaks=MIN_LEVEL_PEAKS):
+    """Multi-resolution pyramid: [(samples_per_peak, mins, maxs), ...]"""
+    levels = [(samples_per_peak, mins, maxs)]
+    while len(mins) > min_peaks * 2:
+        if len(mins) % 2:
+            mins = np.append(mins, mins[-1])
+            maxs = np.append(maxs, maxs[-1])
+        mins = mins.reshape(-1, 2).min(axis=1)
+        maxs = maxs.reshape(-1, 2).max(axis=1)
+        samples_per_peak *= 2
+        levels.append((samples_per_peak, mins, maxs))
+    return levels
+
+
+def _quantize(values):
+    return np.clip(np.round(values * 127.0), -127, 127).astype(np.int8)
+
+
+def encode_sidecar(info, levels):
+    parts = [MAGIC, HEADER.pack(int(info["sample_rate"]), int(info["channels"]),
+                                len(levels), int(info.get("bitrate") or 0),
+                                float(info["duration"]), int(info["frames"]))]
+    for samples_per_peak, mins, maxs in levels:
+        pairs = np.stack([_quantize(mins), _quantize(maxs)], axis=1)
+        parts.append(LEVEL_HEADER.pack(samples_per_peak, len(pairs)))
+        parts.append(pairs.tobytes())
+    return b"".join(parts)
+
+
+def decode_header(data):
+    if data[:4] != MAGIC:
+        raise ValueError("Not a waveform sidecar")
+    sample_rate, channels, n_levels, bitrate, duration, frames = HEADER.unpack_from(data, 4)
+    return {"sample_rate": sample_rate, "channels": channels, "levels": n_levels,
+            "bitrate": bitrate, "duration": duration, "frames": frames}
+
+
+def decode_sidecar(data):
+    """Return (info, [(samples_per_peak, int8 pairs array (n, 2)), ...])"""
+    info = decode_header(data)
+    offset = 4 + HEADER.size
+    levels = []
+    for _ in range(info["levels"]):
+        samples_per_peak, count = LEVEL_HEADER.unpack_from(data, offset)
+        offset += LEVEL_HEADER.size
+        pairs = np.frombuffer(data, dtype=np.int8, count=count * 2, offset=offset).reshape(-1, 2)
+        offset += count * 2
+        levels.append((samples_per_peak, pairs))
+    return info, levels
+
+
+def peaks_for_width(levels, width):
+    """Pick the coarsest level with at least `width` peaks and resample to width.
+
+    Returns a flat list [min0, max0, min1, max1, ...] scaled to -1..1.
+    """
+    if not levels or width <= 0:
+        return []
+    chosen = levels[0][1]
+    for _, pairs in levels:
+        if len(pairs) >= width:
+            chosen = pairs
+    if not len(chosen):
+        return []
+    starts = (np.arange(width) * len(chosen)) // width
+    mins = np.minimum.reduceat(chosen[:, 0], starts)
+    maxs = np.maximum.reduceat(chosen[:, 1], starts)
+    out = np.stack([mins, maxs], axis=1).astype(np.float32) / 127.0
+    return [round(float(v), 3) for v in out.ravel()]
+
+
+def sidecar_from_accumulator(acc, info):
+    """Return (info with exact frames/duration, sidecar bytes)"""
+    mins, maxs = acc.finish()
+    info = dict(info)
+    info["frames"] = acc.frames
+    if info.get("sample_rate"):
+        # The decoded frame count is exact; container durations often aren't
+        info["duration"] = acc.frames / float(info["sample_rate"])
+    return info, encode_sidecar(info, build_levels(mins, maxs, acc.samples_per_peak))
+
+
+def analyze_stream(blocks, info, samples_per_peak=BASE_SAMPLES_PER_PEAK):
+    """Consume PCM blocks once and return (info, sidecar bytes)"""
+    acc = PeakAccumulator(samples_per_peak)
+    for block in blocks:
+        acc.add(block)
+    return sidecar_from_accumulator(acc, info)